@@ -107,6 +107,7 @@ class Lakeshore240_Simulator:
             with conn:
 
                 # Main data loop
+                buffer = b''
                 while True:
                     data = conn.recv(BUFF_SIZE)
 
@@ -114,36 +115,41 @@ class Lakeshore240_Simulator:
                         self.log.info("Connection closed by client")
                         break
 
-                    self.log.debug("Command: {}".format(data))
-                    # Only takes first command in case multiple commands are s
-                    cmds = data.decode().split(';')
-
-                    for c in cmds:
-                        if c.strip() == '':
-                            continue
+                    # Commands may be split over several reads, or share one,
+                    # so handle each complete line.
+                    buffer += data
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        self.log.debug("Command: {}".format(line))
+                        # Only takes first command in case multiple commands are s
+                        cmds = line.decode().split(';')
+
+                        for c in cmds:
+                            if c.strip() == '':
+                                continue
 
-                        cmd_list = c.strip().split(' ')
+                            cmd_list = c.strip().split(' ')
 
-                        if len(cmd_list) == 1:
-                            cmd, args = cmd_list[0], []
-                        else:
-                            cmd, args = cmd_list[0], cmd_list[1].split(',')
-                        self.log.debug(f"{cmd} {args}")
+                            if len(cmd_list) == 1:
+                                cmd, args = cmd_list[0], []
+                            else:
+                                cmd, args = cmd_list[0], cmd_list[1].split(',')
+                            self.log.debug(f"{cmd} {args}")
 
-                        try:
-                            cmd_fn = self.cmds.get(cmd)
-                            if cmd_fn is None:
-                                self.log.warning(f"Command {cmd} is not registered")
-                                continue
+                            try:
+                                cmd_fn = self.cmds.get(cmd)
+                                if cmd_fn is None:
+                                    self.log.warning(f"Command {cmd} is not registered")
+                                    continue
 
-                            resp = cmd_fn(*args)
+                                resp = cmd_fn(*args)
 
-                        except TypeError as e:
-                            self.log.error(f"Command error: {e}")
-                            continue
+                            except TypeError as e:
+                                self.log.error(f"Command error: {e}")
+                                continue
 
-                        if resp is not None:
-                            conn.send(resp.encode())
+                            if resp is not None:
+                                conn.send((resp + '\r\n').encode())
 
     def get_idn(self):
         return ','.join([
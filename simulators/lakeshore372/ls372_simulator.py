@@ -219,6 +219,7 @@ class Lakeshore372_Simulator:
             with conn:
 
                 # Main data loop
+                buffer = b''
                 while True:
                     data = conn.recv(BUFF_SIZE)
                     elapsed_time = time.time() - start_time
@@ -228,54 +229,65 @@ class Lakeshore372_Simulator:
                         self.log.info("Connection closed by client")
                         break
 
-                    clean_cmd = data.decode().strip()
-                    self.log.info(f"Received command: {clean_cmd}")
-                    self.log.debug("Raw Command: {}".format(data))
-                    # Only takes first command in case multiple commands are s
-                    cmds = data.decode().split(';')
-
-                    if int(self.scanner) == 1:  # useful only if all channels have the same dwell and pause settings
-                        channel_change = int(elapsed_time // (self.channels[int(self.active_channel)].dwell
-                                                              + self.channels[int(self.active_channel)].pause))
-                        # print(channel_change)
-                        if 0 < channel_change < 16:
-                            self.active_channel = 1 + channel_change
-                        elif channel_change >= 16:
-                            new_channel_change = int(channel_change % 16)
-                            self.active_channel = 1 + new_channel_change
-
-                        self.log.debug(f"Active channel: {self.active_channel}")
-
-                    elif int(self.scanner) == 0:
-                        pass
-
-                    for c in cmds:
-                        if c.strip() == '':
-                            continue
-
-                        cmd_list = c.strip().split(' ')
-
-                        if len(cmd_list) == 1:
-                            cmd, args = cmd_list[0], []
-                        else:
-                            cmd, args = cmd_list[0], cmd_list[1].split(',')
-                        self.log.debug(f"{cmd} {args}")
-
-                        try:
-                            cmd_fn = self.cmds.get(cmd)
-                            if cmd_fn is None:
-                                self.log.warning(f"Command {cmd} is not registered")
+                    # Commands may be split over several reads, or share one,
+                    # so handle each complete line.
+                    buffer += data
+                    *lines, buffer = buffer.split(b'\n')
+                    for line in lines:
+                        clean_cmd = line.decode().strip()
+                        self.log.info(f"Received command: {clean_cmd}")
+                        self.log.debug("Raw Command: {}".format(line))
+                        # Only takes first command in case multiple commands are s
+                        cmds = line.decode().split(';')
+
+                        if int(self.scanner) == 1:  # useful only if all channels have the same dwell and pause settings
+                            channel_change = int(elapsed_time // (self.channels[int(self.active_channel)].dwell
+                                                                  + self.channels[int(self.active_channel)].pause))
+                            # print(channel_change)
+                            if 0 < channel_change < 16:
+                                self.active_channel = 1 + channel_change
+                            elif channel_change >= 16:
+                                new_channel_change = int(channel_change % 16)
+                                self.active_channel = 1 + new_channel_change
+
+                            self.log.debug(f"Active channel: {self.active_channel}")
+
+                        elif int(self.scanner) == 0:
+                            pass
+
+                        # Responses to compound queries are sent on one line,
+                        # separated by ';', like the 372 does.
+                        resps = []
+                        for c in cmds:
+                            if c.strip() == '':
                                 continue
 
-                            resp = cmd_fn(*args)
-                            self.log.info(f"Sent response: {resp}")
+                            cmd_list = c.strip().split(' ')
 
-                        except TypeError as e:
-                            self.log.error(f"Command error: {e}")
-                            continue
+                            if len(cmd_list) == 1:
+                                cmd, args = cmd_list[0], []
+                            else:
+                                cmd, args = cmd_list[0], cmd_list[1].split(',')
+                            self.log.debug(f"{cmd} {args}")
 
-                        if resp is not None:
-                            conn.send(resp.encode())
+                            try:
+                                cmd_fn = self.cmds.get(cmd)
+                                if cmd_fn is None:
+                                    self.log.warning(f"Command {cmd} is not registered")
+                                    continue
+
+                                resp = cmd_fn(*args)
+                                self.log.info(f"Sent response: {resp}")
+
+                            except TypeError as e:
+                                self.log.error(f"Command error: {e}")
+                                continue
+
+                            if resp is not None:
+                                resps.append(resp)
+
+                        if resps:
+                            conn.send((';'.join(resps) + '\r\n').encode())
 
     def get_idn(self):
         return ','.join([
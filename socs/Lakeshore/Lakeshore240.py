@@ -8,13 +8,28 @@ Created on Fri Feb 23 14:15:51 2018
 
 import socket
 import sys
-import time
 from collections import OrderedDict
 from typing import List
 
-from serial import Serial
-
-BUFF_SIZE = 1024
+from socs.Lakeshore.transport import SerialTransport, TCPTransport
+
+
+def _connect_simulator(address, timeout, port):
+    """Connect to a simulator, trying the given port and the next nine."""
+    for p in range(port, port + 10):
+        try:
+            print(f"Trying to connect to {address} on port {p}")
+            com = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            com.connect((address, p))
+            print(f"Found connection on port {p}")
+            break
+        except ConnectionRefusedError as e:
+            if e.errno == 61:
+                continue
+            else:
+                raise e
+    com.settimeout(timeout)
+    return com
 
 
 class Module:
@@ -33,23 +48,14 @@ class Module:
         if port[:6] == 'tcp://':
             self.simulator = True
             address, socket_port = port[6:].split(':')
-            socket_port = int(socket_port)
-
-            for p in range(socket_port, socket_port + 10):
-                try:
-                    print(f"Trying to connect to {address} on port {p}")
-                    self.com = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                    self.com.connect((address, p))
-                    print(f"Found connection on port {p}")
-                    break
-                except ConnectionRefusedError as e:
-                    if e.errno == 61:
-                        continue
-                    else:
-                        raise e
-
+            self.com = TCPTransport(address, int(socket_port),
+                                    connect=_connect_simulator,
+                                    timeout=timeout, attempts=1,
+                                    min_interval=.01)
         else:
-            self.com = Serial(port=port, baudrate=baud, timeout=timeout)
+            # Must wait 10 ms before sending another command
+            self.com = SerialTransport(port, baudrate=baud, timeout=timeout,
+                                       attempts=1, min_interval=.01)
             self.simulator = False
 
         # First comms usually fails if this is your first time communicating
@@ -59,7 +65,7 @@ class Module:
                 print('attempt %s' % i)
                 idn = self.msg("*IDN?")
                 break
-            except TimeoutError:
+            except RuntimeError:
                 print("Comms failed on attempt %s" % i)
 
         self.manufacturer, self.model, self.inst_sn, self.firmware_version = idn.split(',')
@@ -73,44 +79,17 @@ class Module:
             self.channels.append(c)
 
     def close(self):
-        if self.simulator:
-            self.com.close()
+        self.com.close()
 
     def __exit__(self):
         self.close()
 
-    def msg(self, msg):
+    def msg(self, msg, timeout=None):
         """
             Send command or query to module.
             Return response (within timeout) if message is a query.
         """
-        if self.simulator:
-            message_string = "{}".format(msg)
-            self.com.send(message_string.encode())
-            resp = ''
-            if '?' in msg:
-                resp = self.com.recv(BUFF_SIZE).decode()
-            return resp
-
-        else:
-            # Writes message
-            message_string = "{}\r\n".format(msg).encode()
-
-            # write(message_string)
-            self.com.write(message_string)
-
-            # Reads response if queried
-            resp = ''
-            if "?" in msg:
-                resp = self.com.readline()
-                resp = str(resp[:-2], 'utf-8')       # Strips terminating chars
-                if not resp:
-                    raise TimeoutError("Device timed out")
-
-            # Must wait 10 ms before sending another command
-            time.sleep(.01)
-
-            return resp
+        return self.com.msg(msg, timeout=timeout)
 
     def set_name(self, name):
         self.name = name
@@ -2,12 +2,13 @@
 # contributors: zatkins, bkoopman, sbhimani, zhuber
 
 import math
-import socket
 import sys
 import time
 
 import numpy as np
 
+from socs.Lakeshore.transport import TCPTransport
+
 # helper dicts
 sensor_key = {
     '0': 'disabled',
@@ -92,6 +93,10 @@ ramp_key = {
 }
 ramp_lock = {v: k for k, v in ramp_key.items()}
 
+# Minimum time between commands sent to the Lakeshore, in seconds. The manual
+# asks for 50 ms between the end of one command and the start of the next.
+MIN_COMMAND_INTERVAL = 0.05
+
 # main class - Lakeshore 336 driver
 
 
@@ -108,9 +113,8 @@ class LS336:
     def __init__(self, ip, timeout=10):
 
         # LS336 defaults
-        self.com = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.com.connect((ip, 7777))
-        self.com.settimeout(timeout)
+        self.com = TCPTransport(ip, 7777, timeout=timeout,
+                                min_interval=MIN_COMMAND_INTERVAL)
 
         self.timeout = timeout
         self.id = self.get_id()
@@ -138,19 +142,25 @@ class LS336:
 
     # Instance methods
 
-    # copied from Lakeshore372 driver on 2020/12/09,
-    # modified end-of-method sleep to 0.1s in all cases
-    def msg(self, message):
+    def msg(self, message, timeout=None):
         """Send message to the Lakeshore 336 over ethernet.
 
+        Commands are paced so that at least MIN_COMMAND_INTERVAL separates
+        consecutive transmits, and responses are read up to the line
+        terminator rather than after a fixed delay.
+
         If we're asking for something from the Lakeshore (indicated by a ? in
-        the message string), then we will attempt to ask twice before giving
-        up due to potential communication timeouts.
+        the message string), then we will wait for the response twice before
+        giving up due to potential communication timeouts. See
+        :meth:`socs.Lakeshore.transport.LakeshoreTransport.msg`.
 
         Parameters
         ----------
         message : str
             Message string as described in the Lakeshore 336 manual.
+        timeout : float, optional
+            Time to wait for the response in seconds, defaults to the timeout
+            of the connection.
 
         Returns
         -------
@@ -158,31 +168,37 @@ class LS336:
             Response string from the Lakeshore, if any. Else, an empty string.
 
         """
-        msg_str = f'{message}\r\n'.encode()
-
-        if '?' in message:
-            self.com.send(msg_str)
-            # Try once, if we timeout, try again.
-            # Usually gets around single event glitches.
-            for attempt in range(2):
-                try:
-                    time.sleep(0.061)
-                    resp = str(self.com.recv(4096), 'utf-8').strip()
-                    break
-                except socket.timeout:
-                    print("Warning: Caught timeout waiting for response "
-                          "to '%s', trying again before giving up" % message)
-                    if attempt == 1:
-                        raise RuntimeError('Query response to Lakeshore timed '
-                                           'out after two attempts. '
-                                           'Check connection.')
-        else:
-            self.com.send(msg_str)
-            resp = ''
+        return self.com.msg(message, timeout=timeout)
 
-        # No comms for 100ms after sending message (manual says 50ms)
-        time.sleep(0.1)
-        return resp
+    @property
+    def compound_queries(self):
+        """Whether :meth:`query` sends compound queries. Cleared when the
+        device does not support them."""
+        return self.com.compound_queries
+
+    @compound_queries.setter
+    def compound_queries(self, value):
+        self.com.compound_queries = value
+
+    def query(self, *messages):
+        """Send several queries to the Lakeshore 336 in a single request.
+
+        See :meth:`socs.Lakeshore.transport.LakeshoreTransport.query` for the
+        fallback to single queries on devices that don't support compound
+        queries.
+
+        Parameters
+        ----------
+        *messages : str
+            Query strings as described in the Lakeshore 336 manual.
+
+        Returns
+        -------
+        list of str
+            Response string for each query.
+
+        """
+        return self.com.query(*messages, msg=self.msg)
 
     def get_id(self):
         """Get identification information of the Lakeshore module"""
@@ -1067,14 +1083,15 @@ class Heater:
 
         """
         resp = self.ls.msg("HTRSET? {}".format(self.output)).split(',')
+        self._parse_heater_setup(resp)
+        return resp
 
+    def _parse_heater_setup(self, resp):
         self.resistance_setting = int(resp[0])
         self.max_current = max_current_key[resp[1]]
         self.max_user_current = float(resp[2].strip('E+'))
         self.display = heater_display_key[resp[3]]
 
-        return resp
-
     def _set_heater_setup(self, params):
         """
         Sets the heater setup using the HTRSET command.
@@ -1395,6 +1412,33 @@ class Heater:
         self.percent = float(resp)
         return self.percent
 
+    def get_status(self):
+        """Get the heater output level, range, limiting current and setpoint
+        with a single compound query.
+
+        Returns
+        -------
+        dict
+            'percent', 'range', 'max_current' and 'setpoint', as returned by
+            get_heater_percent, get_heater_range, get_max_current and
+            get_setpoint
+        """
+        resp = self.ls.query(f'HTR? {self.output}', f'RANGE? {self.output}',
+                             f'HTRSET? {self.output}', f'SETP? {self.output}')
+        self.percent = float(resp[0])
+        self.range = heater_range_key[resp[1]]
+        self._parse_heater_setup(resp[2].split(','))
+        self.setpoint = float(resp[3])
+
+        if self.max_current == 'User':
+            max_current = self.max_user_current
+        else:
+            max_current = self.max_current
+        return {'percent': self.percent,
+                'range': self.range,
+                'max_current': max_current,
+                'setpoint': self.setpoint}
+
 # Do stuff
 
 
@@ -2,11 +2,12 @@
 # Lakeshore370.py
 
 import sys
-import time
 
 import numpy as np
 import serial
 
+from socs.Lakeshore.transport import SerialTransport
+
 # Lookup keys for command parameters.
 autorange_key = {'0': 'off',
                  '1': 'on'}
@@ -193,7 +194,10 @@ class LS370:
 
         print(self.baudrate)
 
-        self.com = serial.Serial(self.port, self.baudrate, self._bytesize, self._parity, self._stopbits, self.timeout)
+        # No comms for 100ms after sending message (manual says 50ms)
+        self.com = SerialTransport(self.port, self.baudrate, self._bytesize,
+                                   self._parity, self._stopbits,
+                                   timeout=self.timeout, min_interval=0.1)
         self.num_channels = num_channels
 
         self.id = self.get_id()
@@ -209,17 +213,21 @@ class LS370:
         self.sample_heater = Heater(self)
         # self.still_heater = Heater(self, 2)
 
-    def msg(self, message):
+    def msg(self, message, timeout=None):
         """Send message to the Lakeshore 370 over RS-232.
 
         If we're asking for something from the Lakeshore (indicated by a ? in
-        the message string), then we will attempt to ask twice before giving up
-        due to potential communication timeouts.
+        the message string), then we will wait for the response twice before
+        giving up due to potential communication timeouts. See
+        :meth:`socs.Lakeshore.transport.LakeshoreTransport.msg`.
 
         Parameters
         ----------
         message : str
             Message string as described in the Lakeshore 370 manual.
+        timeout : float, optional
+            Time to wait for the response in seconds, defaults to the timeout
+            of the connection.
 
         Returns
         -------
@@ -227,31 +235,7 @@ class LS370:
             Response string from the Lakeshore, if any. Else, an empty string.
 
         """
-        msg_str = f'{message}\r\n'.encode()
-        self.com.write(msg_str)
-        resp = ''
-
-        if '?' in message:
-            resp = str(self.com.read_until(), 'utf-8').strip()
-
-            # Try a few times, if we timeout, try again.
-            try_count = 3
-            while resp == '':
-                if try_count == 0:
-                    break
-
-                print(f"Warning: Caught timeout waiting for response to {message}, waiting 1s and "
-                      "trying again {try_count} more time(s) before giving up")
-                time.sleep(1)
-
-                # retry comms
-                self.com.write(msg_str)
-                resp = str(self.com.read_until(), 'utf-8').strip()
-                try_count -= 1
-
-        time.sleep(0.1)  # No comms for 100ms after sending message (manual says 50ms)
-
-        return resp
+        return self.com.msg(message, timeout=timeout)
 
     def get_id(self):
         """Get the ID number of the Lakeshore unit."""
@@ -6,6 +6,8 @@ import time
 
 import numpy as np
 
+from socs.Lakeshore.transport import TCPTransport
+
 # Lookup keys for command parameters.
 autorange_key = {'0': 'off',
                  '1': 'on',
@@ -173,6 +175,11 @@ heater_display_key = {'1': 'current',
 heater_display_lock = {v: k for k, v in heater_display_key.items()}
 
 
+# Number of channels whose configuration is loaded in a single compound query
+# by LS372.load_channels.
+CHANNELS_PER_QUERY = 4
+
+
 def _establish_socket_connection(ip, timeout, port=7777):
     """Establish socket connection to the LS372.
 
@@ -210,11 +217,14 @@ class LS372:
 
     Attributes:
         channels - list of channels, index corresponds to channel number with
-                   index 0 corresponding to the control channel, 'A'
+                   index 0 corresponding to the control channel, 'A'. The
+                   configuration of each channel is loaded on first access,
+                   or for all channels at once with load_channels()
     """
 
-    def __init__(self, ip, timeout=10, num_channels=16):
-        self.com = _establish_socket_connection(ip, timeout)
+    def __init__(self, ip, timeout=10, num_channels=16, port=7777):
+        self.com = TCPTransport(ip, port, connect=_establish_socket_connection,
+                                timeout=timeout)
         self.num_channels = num_channels
 
         self.id = self.get_id()
@@ -232,21 +242,26 @@ class LS372:
             else:
                 c = Channel(self, i)
             self.channels.append(c)
+        self._channels_by_num = {c.channel_num: c for c in self.channels}
 
         self.sample_heater = Heater(self, 0)
         self.still_heater = Heater(self, 2)
 
-    def msg(self, message):
+    def msg(self, message, timeout=None):
         """Send message to the Lakeshore 372 over ethernet.
 
         If we're asking for something from the Lakeshore (indicated by a ? in
-        the message string), then we will attempt to ask twice before giving up
-        due to potential communication timeouts.
+        the message string), then we will wait for the response twice before
+        giving up due to potential communication timeouts. See
+        :meth:`socs.Lakeshore.transport.LakeshoreTransport.msg`.
 
         Parameters
         ----------
         message : str
             Message string as described in the Lakeshore 372 manual.
+        timeout : float, optional
+            Time to wait for the response in seconds, defaults to the timeout
+            of the connection.
 
         Returns
         -------
@@ -254,26 +269,37 @@ class LS372:
             Response string from the Lakeshore, if any. Else, an empty string.
 
         """
-        msg_str = f'{message}\r\n'.encode()
-
-        if '?' in message:
-            self.com.send(msg_str)
-            # Try once, if we timeout, try again. Usually gets around single event glitches.
-            for attempt in range(2):
-                try:
-                    resp = str(self.com.recv(4096), 'utf-8').strip()
-                    break
-                except socket.timeout:
-                    print("Warning: Caught timeout waiting for response to '%s', trying again "
-                          "before giving up" % message)
-                    if attempt == 1:
-                        raise RuntimeError('Query response to Lakeshore timed out after two '
-                                           'attempts. Check connection.')
-        else:
-            self.com.send(msg_str)
-            resp = ''
+        return self.com.msg(message, timeout=timeout)
 
-        return resp
+    @property
+    def compound_queries(self):
+        """Whether :meth:`query` sends compound queries. Cleared when the
+        device does not support them."""
+        return self.com.compound_queries
+
+    @compound_queries.setter
+    def compound_queries(self, value):
+        self.com.compound_queries = value
+
+    def query(self, *messages):
+        """Send several queries to the Lakeshore 372 in a single request.
+
+        See :meth:`socs.Lakeshore.transport.LakeshoreTransport.query` for the
+        fallback to single queries on devices that don't support compound
+        queries.
+
+        Parameters
+        ----------
+        *messages : str
+            Query strings as described in the Lakeshore 372 manual.
+
+        Returns
+        -------
+        list of str
+            Response string for each query.
+
+        """
+        return self.com.query(*messages, msg=self.msg)
 
     def get_id(self):
         """Get the ID number of the Lakeshore unit."""
@@ -361,10 +387,61 @@ class LS372:
         :rtype: Channel Object
         """
         resp = self.msg("SCAN?")
-        channel_number = int(resp.split(',')[0])
-        channel_list = [_.channel_num for _ in self.channels]
-        idx = channel_list.index(channel_number)
-        return self.channels[idx]
+        return self._get_channel(int(resp.split(',')[0]))
+
+    def _get_channel(self, channel_number):
+        return self._channels_by_num[channel_number]
+
+    def load_channels(self, channels=None):
+        """Load the configuration of several channels at once, in compound
+        queries covering CHANNELS_PER_QUERY channels each.
+
+        :param channels: Channels to load, defaults to all channels
+        :type channels: list of Channel Objects
+        """
+        if channels is None:
+            channels = self.channels
+        for i in range(0, len(channels), CHANNELS_PER_QUERY):
+            chunk = channels[i:i + CHANNELS_PER_QUERY]
+            resp = self.query(*[q for c in chunk for q in c._config_queries()])
+            for j, c in enumerate(chunk):
+                c._parse_config(resp[4 * j:4 * j + 4])
+
+    def get_scan_readings(self, chans=(), heater=False):
+        """Query the active channel and the readings of several channels
+        (and optionally the sample heater output) in a single compound query.
+
+        Readings are only valid for the channel the scanner is on, so callers
+        should check the returned active channel against the channels they
+        asked for.
+
+        :param chans: Channel numbers to read, 0 or 'A' for the control
+                      channel
+        :type chans: list
+        :param heater: If True, also read the sample heater output
+        :type heater: bool
+
+        :returns: dict with the active 'channel' (Channel object), the
+                  'readings' of each requested channel as a (kelvin, ohms)
+                  tuple, and the 'heater' output if requested
+        :rtype: dict
+        """
+        queries = ['SCAN?']
+        for chan in chans:
+            c = 'A' if chan in (0, 'A') else str(chan)
+            queries += ['KRDG? %s' % c, 'SRDG? %s' % c]
+        if heater:
+            queries.append('HTR?')
+
+        resp = self.query(*queries)
+        sample = {
+            'channel': self._get_channel(int(resp[0].split(',')[0])),
+            'readings': {chan: (float(resp[2 * i + 1]), float(resp[2 * i + 2]))
+                         for i, chan in enumerate(chans)},
+        }
+        if heater:
+            sample['heater'] = float(resp[-1])
+        return sample
 
     def set_active_channel(self, channel):
         """Set the active scanner channel.
@@ -399,14 +476,51 @@ class Channel:
     :type channel_num: int
     """
 
+    #: Attributes holding the channel configuration. They are loaded from the
+    #: Lakeshore on first access, see :meth:`load`.
+    config_attrs = ('enabled', 'dwell', 'pause', 'curve_num', 'tempco', 'name',
+                    'mode', 'excitation', 'excitation_units', 'autorange',
+                    'range', 'csshunt', 'units', 'tlimit')
+
     def __init__(self, ls, channel_num):
         self.ls = ls
         self.channel_num = channel_num
-        self.enabled = False
-        self.get_input_channel_parameter()
-        self.get_sensor_input_name()
-        self.get_input_setup()
-        self.tlimit = self.get_temperature_limit()
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, i.e. configuration that
+        # wasn't loaded yet or has been invalidated.
+        if name in Channel.config_attrs:
+            self.load()
+            return self.__dict__[name]
+        raise AttributeError(f"'Channel' object has no attribute '{name}'")
+
+    def _config_queries(self):
+        """Queries for the channel configuration, parsed by _parse_config."""
+        n = self.channel_num
+        return [f"INSET? {n}", f"INNAME? {n}", f"INTYPE? {n}", f"TLIMIT? {n}"]
+
+    def _parse_config(self, resp):
+        """Store the responses to the _config_queries."""
+        inset, name, intype, tlimit = resp
+        self._parse_input_channel_parameter(inset.split(','))
+        self.name = name.strip()
+        self._parse_input_setup(intype.split(','))
+        self.tlimit = float(tlimit)
+
+    def load(self):
+        """Load the channel configuration (INSET?, INNAME?, INTYPE? and
+        TLIMIT?) in a single compound query.
+
+        This happens automatically on first access of any of the
+        configuration attributes, and again after :meth:`invalidate`.
+        """
+        self._parse_config(self.ls.query(*self._config_queries()))
+
+    def invalidate(self):
+        """Drop the cached channel configuration, so that it is loaded from
+        the Lakeshore again on next access."""
+        for attr in Channel.config_attrs:
+            self.__dict__.pop(attr, None)
 
     def get_input_channel_parameter(self):
         """Run Input Channel Parameter Query
@@ -432,15 +546,17 @@ class Channel:
         Reference: LakeShore 372 Manual - pg177
         """
         resp = self.ls.msg(f"INSET? {self.channel_num}").split(',')
+        self._parse_input_channel_parameter(resp)
 
+        return resp
+
+    def _parse_input_channel_parameter(self, resp):
         self.enabled = bool(int(resp[0]))
         self.dwell = int(resp[1])  # seconds
         self.pause = int(resp[2])  # seconds
         self.curve_num = int(resp[3])
         self.tempco = tempco_key[resp[4]]
 
-        return resp
-
     def _set_input_channel_parameter(self, params):
         """Set INSET.
 
@@ -460,7 +576,9 @@ class Channel:
         [reply.append(x) for x in params]
 
         param_str = ','.join(reply)
-        return self.ls.msg(f"INSET {param_str}")
+        resp = self.ls.msg(f"INSET {param_str}")
+        self.invalidate()
+        return resp
 
     def get_input_setup(self):
         """Run Input Setup Query, storing results in human readable format.
@@ -497,7 +615,11 @@ class Channel:
         Reference: LakeShore 372 Manual - pg178-179
         """
         resp = self.ls.msg(f"INTYPE? {self.channel_num}").split(',')
+        self._parse_input_setup(resp)
+
+        return resp
 
+    def _parse_input_setup(self, resp):
         _mode = resp[0]
         _excitation = resp[1]
         _autorange = resp[2]
@@ -538,8 +660,6 @@ class Channel:
 
         self.units = units_key[_units]
 
-        return resp
-
     def _set_input_setup(self, params):
         """Set INTYPE.
 
@@ -557,7 +677,9 @@ class Channel:
         [reply.append(x) for x in params]
 
         param_str = ','.join(reply)
-        return self.ls.msg(f"INTYPE {param_str}")
+        resp = self.ls.msg(f"INTYPE {param_str}")
+        self.invalidate()
+        return resp
 
     # Public API
 
@@ -0,0 +1,389 @@
+"""Framed, line based transports shared by the Lakeshore drivers.
+
+Lakeshore devices answer each query with a single line, ended by a
+terminator. The transports buffer incoming data and split it on the
+terminator, so a response spread over several reads, or several responses
+arriving in a single read, are matched to the right query. Lost connections
+are re-opened automatically, and the latency and errors of each command are
+counted, so the agents can publish them.
+"""
+
+import bisect
+import socket
+import threading
+import time
+
+import serial
+
+#: Upper edges of the command latency histogram bins, in seconds. Latencies
+#: above the last edge are counted in a final overflow bin.
+LATENCY_BINS = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+
+
+def _command_key(message):
+    """Name under which the statistics of a message are counted, i.e. the
+    command without its arguments ('RDGK?' for 'RDGK? 1', 'HTR?;RANGE?' for a
+    compound query)."""
+    return ';'.join((m.split() or [''])[0] for m in message.split(';'))
+
+
+def _new_stats():
+    return {'count': 0,
+            'timeouts': 0,
+            'errors': 0,
+            'latency_total': 0.,
+            'latency_max': 0.,
+            'latency_hist': [0] * (len(LATENCY_BINS) + 1)}
+
+
+def socket_connect(ip, timeout, port=7777):
+    """Open a TCP connection to a Lakeshore.
+
+    Args:
+        ip (str): IP address of the Lakeshore.
+        timeout (float): Timeout of the socket, in seconds.
+        port (int): Port for the connection, defaults to the Lakeshore port
+            of 7777.
+
+    Returns:
+        socket.socket: The connected socket.
+
+    """
+    com = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    com.connect((ip, port))
+    com.settimeout(timeout)
+    return com
+
+
+class LakeshoreTransport:
+    """Base class for line based connections to a Lakeshore.
+
+    Subclasses open and close the connection and implement the raw reads and
+    writes. This class takes care of pacing the commands, framing the
+    responses, retrying on timeouts and reconnecting after connection errors.
+
+    Args:
+        timeout (float): Default time to wait for a response, in seconds.
+        terminator (str): Terminator of messages and responses.
+        min_interval (float): Minimum time between sending two commands, in
+            seconds.
+        attempts (int): Number of attempts at getting a response before
+            giving up.
+
+    Attributes:
+        reconnects (int): Number of times the connection was re-opened.
+        compound_queries (bool): Whether :meth:`query` joins its queries into
+            a single compound query. Cleared when the device does not
+            support them.
+
+    """
+
+    def __init__(self, timeout=10, terminator='\r\n', min_interval=0.,
+                 attempts=2):
+        self.timeout = timeout
+        self.terminator = terminator.encode()
+        self.min_interval = min_interval
+        self.attempts = attempts
+        self.reconnects = 0
+        self.compound_queries = True
+
+        self._connected = False
+        self._buffer = b''
+        self._last_transmit = 0.
+        self._lock = threading.Lock()
+        self._stats = {}
+
+        self.connect()
+
+    # Implemented by the subclasses.
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def _write(self, data):
+        raise NotImplementedError
+
+    def _read(self, timeout):
+        """Read the available data, waiting at most ``timeout`` seconds.
+
+        Raises TimeoutError if no data arrived, and ConnectionError if the
+        connection was closed.
+        """
+        raise NotImplementedError
+
+    # Connection handling.
+
+    def connect(self):
+        """Open the connection, dropping any buffered data."""
+        self._buffer = b''
+        self._open()
+        self._connected = True
+
+    def close(self):
+        """Close the connection, dropping any buffered data."""
+        self._buffer = b''
+        self._connected = False
+        self._close()
+
+    def reconnect(self):
+        """Close and re-open the connection."""
+        self.reconnects += 1
+        try:
+            self.close()
+        except OSError:
+            pass
+        self.connect()
+
+    # Framing.
+
+    def _send(self, message):
+        """Send a message, waiting until min_interval has passed since the
+        previous one was sent."""
+        wait = self._last_transmit + self.min_interval - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._write(message.encode() + self.terminator)
+        self._last_transmit = time.monotonic()
+
+    def _read_line(self, timeout):
+        """Read one response, up to the terminator."""
+        deadline = time.monotonic() + timeout
+        while self.terminator not in self._buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError
+            self._buffer += self._read(remaining)
+        line, self._buffer = self._buffer.split(self.terminator, 1)
+        return str(line, 'utf-8').strip()
+
+    def msg(self, message, timeout=None):
+        """Send a message to the Lakeshore, and read the response if it is a
+        query (indicated by a ? in the message string).
+
+        On a timeout we keep waiting for the response, up to ``attempts``
+        times. After a connection error the connection is re-opened and the
+        message sent again. If no response is received the connection is
+        closed, so that a late response can't be read as the response to the
+        next query, and re-opened by the next message.
+
+        Args:
+            message (str): Message string as described in the Lakeshore
+                manual.
+            timeout (float): Time to wait for the response, in seconds.
+                Defaults to the transport's timeout.
+
+        Returns:
+            str: Response string from the Lakeshore, if any. Else, an empty
+            string.
+
+        """
+        if timeout is None:
+            timeout = self.timeout
+        query = '?' in message
+
+        with self._lock:
+            stats = self._stats.setdefault(_command_key(message), _new_stats())
+            t0 = time.monotonic()
+            sent = False
+            for attempt in range(self.attempts):
+                try:
+                    if not self._connected:
+                        self.reconnect()
+                    if not sent:
+                        self._send(message)
+                        sent = True
+                    resp = self._read_line(timeout) if query else ''
+                    break
+                except TimeoutError:
+                    stats['timeouts'] += 1
+                    print("Warning: Caught timeout waiting for response to '%s' "
+                          "(attempt %d of %d)" % (message, attempt + 1, self.attempts))
+                except OSError as e:
+                    stats['errors'] += 1
+                    print("Warning: Lost connection to Lakeshore while sending '%s' "
+                          "(attempt %d of %d): %s" % (message, attempt + 1, self.attempts, e))
+                    self._connected = False
+                    sent = False
+            else:
+                try:
+                    self.close()
+                except OSError:
+                    pass
+                raise RuntimeError("No response from Lakeshore to '%s' after %d "
+                                   "attempts. Check connection." % (message, self.attempts))
+
+            latency = time.monotonic() - t0
+            stats['count'] += 1
+            stats['latency_total'] += latency
+            stats['latency_max'] = max(stats['latency_max'], latency)
+            stats['latency_hist'][bisect.bisect_left(LATENCY_BINS, latency)] += 1
+
+        return resp
+
+    def query(self, *messages, msg=None):
+        """Send several queries to the Lakeshore in a single request.
+
+        The queries are joined with ';', which the Lakeshore answers with a
+        single line holding each response, also separated by ';'. If the
+        reply can't be split into one response per query, the connection is
+        re-opened, dropping any responses still to arrive, and the queries
+        are sent one at a time. Compound queries are then disabled for this
+        connection. Communication errors are raised, rather than taken as a
+        lack of support.
+
+        Args:
+            *messages (str): Query strings as described in the Lakeshore
+                manual.
+            msg (callable): Function sending a single message and returning
+                the response. Defaults to :meth:`msg`.
+
+        Returns:
+            list of str: Response string for each query.
+
+        """
+        if msg is None:
+            msg = self.msg
+
+        if len(messages) > 1 and self.compound_queries:
+            resp = msg(';'.join(messages)).split(';')
+            if len(resp) == len(messages):
+                return [r.strip() for r in resp]
+            print("Warning: Compound query '%s' not supported, falling back to "
+                  "single queries" % ';'.join(messages))
+            self.compound_queries = False
+            # Some devices answer each query on its own line, which would be
+            # read as the responses to the next queries.
+            with self._lock:
+                self.reconnect()
+
+        return [msg(m) for m in messages]
+
+    def get_stats(self, reset=False):
+        """Get the latency and error counters of each command.
+
+        Args:
+            reset (bool): If True, reset the counters after reading them.
+
+        Returns:
+            dict: Number of reconnects, the bin edges of the latency
+            histograms, and for each command the number of completed
+            messages, timeouts and connection errors, and the mean, maximum
+            and histogram of the latencies in seconds::
+
+                {'reconnects': 0,
+                 'latency_bins': [0.005, 0.01, ...],
+                 'commands': {'RDGK?': {'count': 10,
+                                        'timeouts': 0,
+                                        'errors': 0,
+                                        'latency_mean': 0.012,
+                                        'latency_max': 0.02,
+                                        'latency_hist': [0, 2, 8, ...]}}}
+
+        """
+        with self._lock:
+            commands = {}
+            for key, stats in self._stats.items():
+                count = stats['count']
+                commands[key] = {
+                    'count': count,
+                    'timeouts': stats['timeouts'],
+                    'errors': stats['errors'],
+                    'latency_mean': stats['latency_total'] / count if count else 0.,
+                    'latency_max': stats['latency_max'],
+                    'latency_hist': list(stats['latency_hist'])}
+            result = {'reconnects': self.reconnects,
+                      'latency_bins': list(LATENCY_BINS),
+                      'commands': commands}
+            if reset:
+                self._stats = {}
+                self.reconnects = 0
+        return result
+
+
+class TCPTransport(LakeshoreTransport):
+    """Connection to a Lakeshore over ethernet.
+
+    Args:
+        ip (str): IP address of the Lakeshore.
+        port (int): Port for the connection.
+        connect (callable): Function opening the connection, called as
+            ``connect(ip, timeout, port=port)`` and returning a socket.
+            Defaults to :func:`socket_connect`.
+        **kwargs: Passed on to :class:`LakeshoreTransport`.
+
+    """
+
+    def __init__(self, ip, port=7777, connect=None, **kwargs):
+        self.ip = ip
+        self.port = port
+        self._connect = socket_connect if connect is None else connect
+        self.sock = None
+        super().__init__(**kwargs)
+
+    def _open(self):
+        self.sock = self._connect(self.ip, self.timeout, port=self.port)
+
+    def _close(self):
+        if self.sock is not None:
+            sock, self.sock = self.sock, None
+            sock.close()
+
+    def _write(self, data):
+        self.sock.sendall(data)
+
+    def _read(self, timeout):
+        self.sock.settimeout(timeout)
+        try:
+            data = self.sock.recv(4096)
+        except socket.timeout:
+            raise TimeoutError
+        if not data:
+            raise ConnectionError('Connection to Lakeshore closed.')
+        return data
+
+
+class SerialTransport(LakeshoreTransport):
+    """Connection to a Lakeshore over a serial port.
+
+    Args:
+        port (str): Path of the serial port.
+        baudrate (int): Baud rate.
+        bytesize (int): Number of data bits.
+        parity (str): Parity checking.
+        stopbits (float): Number of stop bits.
+        **kwargs: Passed on to :class:`LakeshoreTransport`.
+
+    """
+
+    def __init__(self, port, baudrate=9600, bytesize=serial.EIGHTBITS,
+                 parity=serial.PARITY_NONE, stopbits=serial.STOPBITS_ONE,
+                 **kwargs):
+        self.port = port
+        self.baudrate = baudrate
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.ser = None
+        super().__init__(**kwargs)
+
+    def _open(self):
+        self.ser = serial.Serial(self.port, self.baudrate, self.bytesize,
+                                 self.parity, self.stopbits, self.timeout)
+
+    def _close(self):
+        if self.ser is not None:
+            ser, self.ser = self.ser, None
+            ser.close()
+
+    def _write(self, data):
+        self.ser.write(data)
+
+    def _read(self, timeout):
+        self.ser.timeout = timeout
+        data = self.ser.read(max(1, self.ser.in_waiting))
+        if not data:
+            raise TimeoutError
+        return data
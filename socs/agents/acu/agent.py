@@ -68,6 +68,189 @@ SUN_CONFIGS = {
 #: How often to refresh to Sun Safety map (valid up to 2x this time)
 SUN_MAP_REFRESH = 6 * avoidance.HOUR
 
+#: Axis mode string to influx value; numbering as per ICD.
+MODE_KEY = {
+    'Stop': 0,
+    'Preset': 1,
+    'ProgramTrack': 2,
+    'Rate': 3,
+    'SectorScan': 4,
+    'SearchSpiral': 5,
+    'SurvivalMode': 6,
+    'StepTrack': 7,
+    'GeoSync': 8,
+    'OPT': 9,
+    'TLE': 10,
+    'Stow': 11,
+    'StarTrack': 12,
+    'SunTrack': 13,
+    'MoonTrack': 14,
+    'I11P': 15,
+    'AutoTrack/Preset': 16,
+    'AutoTrack/PositionMemory': 17,
+    'AutoTrack/PT': 18,
+    'AutoTrack/OPT': 19,
+    'AutoTrack/PT/Search': 20,
+    'AutoTrack/TLE': 21,
+    'AutoTrack/TLE/Search': 22,
+
+    # Currently we do not have ICD values for these, but they
+    # are included in the output of Meta.  ElSync, at least,
+    # is a known third axis mode for the LAT.
+    'ElSync': 100,
+    'UnStow': 101,
+    'MaintenanceStow': 102,
+}
+
+#: Fault string to influx value, taken from ICD (correspond to
+#: byte-encoding).
+FAULT_KEY = {
+    'No Fault': 0,
+    'Warning': 1,
+    'Fault': 2,
+    'Critical': 3,
+    'No Data': 4,
+    'Latched Fault': 5,
+    'Latched Critical Fault': 6,
+}
+
+#: SATP pin status string to influx value.
+PIN_KEY = {
+    # Capitalization matches strings in ACU binary, not ICD.
+    # Are these needed for the SAT still?
+    'Any Moving': 0,
+    'All Inserted': 1,
+    'All Retracted': 2,
+    'Failure': 3,
+}
+
+#: LAT pin status string to influx value.
+LAT_PIN_KEY = {
+    # From "meta" output.
+    'Moving': 0,
+    'Inserted': 1,
+    'Retracted': 2,
+    'Error': 3,
+}
+
+#: Three-valued boolean string to influx value.
+TFN_KEY = {
+    'None': float('nan'),
+    'False': 0,
+    'True': 1,
+}
+
+#: Status fields with int values that are reported to influx as floats.
+INFLUX_FLOAT_FIELDS = ['Year', 'Free_upload_positions']
+
+
+def _status_value(value):
+    """Convert a raw ACU status value for storage in self.data['status']."""
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if value is None:
+        return float('nan')
+    return str(value)
+
+
+def _changed(old, new):
+    """Test whether a status value has changed, treating nan as equal to
+    nan."""
+    return old != new and not (old != old and new != new)
+
+
+def compile_monitor_routes(monitor_fields):
+    """Compile the routing tables used by the monitor process.
+
+    Args:
+        monitor_fields (dict): Map from status category to a map from ACU
+            status key to field name, as in soaculib.status_keys.
+
+    Returns:
+        routes (dict): Map from ACU status key to a tuple of
+            (category, field) targets.
+        influx_keys (dict): Map from field name to (influx field name,
+            converter), where the converter maps a stored status value to
+            its influx value.
+
+    """
+    str_map = {}
+    for key_map in [LAT_PIN_KEY, PIN_KEY, FAULT_KEY, MODE_KEY, TFN_KEY]:
+        str_map.update(key_map)
+
+    def to_influx(value):
+        if isinstance(value, float):
+            return value
+        if isinstance(value, str):
+            return str_map[value]
+        return int(value)
+
+    def to_influx_float(value):
+        if isinstance(value, int):
+            return float(value)
+        return to_influx(value)
+
+    routes = {}
+    influx_keys = {}
+    for category, fields in monitor_fields.items():
+        for key, field in fields.items():
+            routes.setdefault(key, ())
+            routes[key] += ((category, field),)
+            converter = to_influx
+            if field in INFLUX_FLOAT_FIELDS:
+                converter = to_influx_float
+            influx_keys[field] = (field + '_influx', converter)
+    influx_keys['ctime'] = ('ctime_influx', to_influx)
+    return routes, influx_keys
+
+
+def influx_status_blocks(status, influx_keys, last, ctime):
+    """Get the acu_status_influx blocks to publish for the status categories.
+
+    A category is published, with all of its fields, when any field has
+    changed since it was last published, and at least every
+    MONITOR_MAX_TIME_DELTA. The feed is recorded, which requires every
+    block of a given name to have the same fields.
+
+    Args:
+        status (dict): The status categories, as in self.data['status'].
+        influx_keys (dict): Map from field name to (influx field name,
+            converter), from compile_monitor_routes.
+        last (dict): Map from category to (time, influx data) of the last
+            published block, which is updated.
+        ctime (float): Timestamp of the status.
+
+    Returns:
+        list: The blocks to publish.
+
+    """
+    blocks = []
+    for category, fields in status.items():
+        # Check that we have data (corotator often doesn't)
+        if category == 'commands' or not fields:
+            continue
+        influx_data = {}
+        for statkey, statval in fields.items():
+            influx_key, converter = influx_keys[statkey]
+            try:
+                influx_data[influx_key] = converter(statval)
+            except KeyError:
+                raise ValueError('Could not convert value for %s="%s"' %
+                                 (statkey, statval))
+        last_t, last_data = last.get(category, (0, {}))
+        if ctime - last_t <= MONITOR_MAX_TIME_DELTA \
+                and influx_data.keys() == last_data.keys() \
+                and not any(_changed(last_data[k], v)
+                            for k, v in influx_data.items()):
+            continue
+        last[category] = (ctime, influx_data)
+        blocks.append({'timestamp': ctime,
+                       'block_name': category,
+                       'data': influx_data})
+    return blocks
+
 
 class ACUAgent:
     """Agent to acquire data from an ACU and control telescope pointing with the
@@ -131,6 +314,8 @@ class ACUAgent:
         # needs to be probed.
         self.acu3rdaxis = self.acu_config['status'].get('3rdaxis_name')
         self.monitor_fields = status_keys.status_fields[self.acu_config['platform']]['status_fields']
+        self._monitor_routes, self._influx_keys = \
+            compile_monitor_routes(self.monitor_fields)
         self.motion_limits = self.acu_config['motion_limits']
 
         if min_el:
@@ -435,16 +620,12 @@ class ACUAgent:
 
         session.set_status('running')
 
-        # Note that session.data will get scanned, to assign data to
-        # feed blocks.  We make an explicit list of items to ignore
-        # during that scan (not_data_keys).
         session.data = {'PlatformType': self.acu_config['platform'],
                         'DefaultScanParams': self.scan_params,
                         'StatusResponseRate': 0.,
                         'IgnoredAxes': self.ignore_axes,
                         'NamedPositions': self.named_positions,
                         'connected': False}
-        not_data_keys = list(session.data.keys())
 
         last_complaint = 0
         while True:
@@ -462,69 +643,6 @@ class ACUAgent:
         self.log.info(version)
         session.data['connected'] = True
 
-        # Numbering as per ICD.
-        mode_key = {
-            'Stop': 0,
-            'Preset': 1,
-            'ProgramTrack': 2,
-            'Rate': 3,
-            'SectorScan': 4,
-            'SearchSpiral': 5,
-            'SurvivalMode': 6,
-            'StepTrack': 7,
-            'GeoSync': 8,
-            'OPT': 9,
-            'TLE': 10,
-            'Stow': 11,
-            'StarTrack': 12,
-            'SunTrack': 13,
-            'MoonTrack': 14,
-            'I11P': 15,
-            'AutoTrack/Preset': 16,
-            'AutoTrack/PositionMemory': 17,
-            'AutoTrack/PT': 18,
-            'AutoTrack/OPT': 19,
-            'AutoTrack/PT/Search': 20,
-            'AutoTrack/TLE': 21,
-            'AutoTrack/TLE/Search': 22,
-
-            # Currently we do not have ICD values for these, but they
-            # are included in the output of Meta.  ElSync, at least,
-            # is a known third axis mode for the LAT.
-            'ElSync': 100,
-            'UnStow': 101,
-            'MaintenanceStow': 102,
-        }
-
-        # fault_key digital values taken from ICD (correspond to byte-encoding)
-        fault_key = {
-            'No Fault': 0,
-            'Warning': 1,
-            'Fault': 2,
-            'Critical': 3,
-            'No Data': 4,
-            'Latched Fault': 5,
-            'Latched Critical Fault': 6,
-        }
-        pin_key = {
-            # Capitalization matches strings in ACU binary, not ICD.
-            # Are these needed for the SAT still?
-            'Any Moving': 0,
-            'All Inserted': 1,
-            'All Retracted': 2,
-            'Failure': 3,
-        }
-        lat_pin_key = {
-            # From "meta" output.
-            'Moving': 0,
-            'Inserted': 1,
-            'Retracted': 2,
-            'Error': 3,
-        }
-        tfn_key = {'None': float('nan'),
-                   'False': 0,
-                   'True': 1,
-                   }
         report_t = time.time()
         report_period = 20
         n_ok = 0
@@ -551,7 +669,7 @@ class ACUAgent:
         was_remote = False
         last_resp_rate = None
         data_blocks = {}
-        influx_blocks = {}
+        influx_last = {}
 
         while session.status in ['running']:
 
@@ -612,20 +730,18 @@ class ACUAgent:
                     session.data['connected'] = False
                 yield dsleep(1)
                 continue
-            for k, v in session.data.items():
-                if k in not_data_keys:
-                    continue
-                for (key, value) in v.items():
-                    for category in self.monitor_fields:
-                        if key in self.monitor_fields[category]:
-                            if isinstance(value, bool):
-                                self.data['status'][category][self.monitor_fields[category][key]] = int(value)
-                            elif isinstance(value, int) or isinstance(value, float):
-                                self.data['status'][category][self.monitor_fields[category][key]] = value
-                            elif value is None:
-                                self.data['status'][category][self.monitor_fields[category][key]] = float('nan')
-                            else:
-                                self.data['status'][category][self.monitor_fields[category][key]] = str(value)
+            changed = set()
+            status = self.data['status']
+            for acu_status in [j, j2]:
+                for key, value in acu_status.items():
+                    targets = self._monitor_routes.get(key)
+                    if targets is None:
+                        continue
+                    value = _status_value(value)
+                    for category, field in targets:
+                        if _changed(status[category].get(field), value):
+                            status[category][field] = value
+                            changed.add(category)
 
             self.data['status']['summary']['ctime'] =\
                 sh.timecode(self.data['status']['summary']['Time'])
@@ -651,73 +767,23 @@ class ACUAgent:
                                   axis_mode=axis_mode, v=v)
                     prev_checkdata[axis_mode] = v
 
-            # influx_blocks are constructed based on refers to all
-            # other self.data['status'] keys. Do not add more keys to
-            # any self.data['status'] categories beyond this point
-            new_influx_blocks = {}
-            for category in self.data['status']:
-                new_influx_blocks[category] = {
-                    'timestamp': self.data['status']['summary']['ctime'],
-                    'block_name': category,
-                    'data': {}}
-
-                if category != 'commands':
-                    for statkey, statval in self.data['status'][category].items():
-                        if isinstance(statval, float):
-                            influx_val = statval
-                        elif isinstance(statval, str):
-                            for key_map in [tfn_key, mode_key, fault_key, pin_key,
-                                            lat_pin_key]:
-                                if statval in key_map:
-                                    influx_val = key_map[statval]
-                                    break
-                            else:
-                                raise ValueError('Could not convert value for %s="%s"' %
-                                                 (statkey, statval))
-                        elif isinstance(statval, int):
-                            if statkey in ['Year', 'Free_upload_positions']:
-                                influx_val = float(statval)
-                            else:
-                                influx_val = int(statval)
-                        new_influx_blocks[category]['data'][statkey + '_influx'] = influx_val
-                else:  # i.e. category == 'commands':
-                    if str(self.data['status']['commands']['Azimuth_commanded_position']) != 'nan':
-                        acucommand_az = {'timestamp': self.data['status']['summary']['ctime'],
-                                         'block_name': 'ACU_commanded_positions_az',
-                                         'data': {'Azimuth_commanded_position_influx': self.data['status']['commands']['Azimuth_commanded_position']}
-                                         }
-                        self.agent.publish_to_feed('acu_commands_influx', acucommand_az)
-                    if str(self.data['status']['commands']['Elevation_commanded_position']) != 'nan':
-                        acucommand_el = {'timestamp': self.data['status']['summary']['ctime'],
-                                         'block_name': 'ACU_commanded_positions_el',
-                                         'data': {'Elevation_commanded_position_influx': self.data['status']['commands']['Elevation_commanded_position']}
-                                         }
-                        self.agent.publish_to_feed('acu_commands_influx', acucommand_el)
-                    if self.acu_config['platform'] == 'satp':
-                        if str(self.data['status']['commands']['Boresight_commanded_position']) != 'nan':
-                            acucommand_bs = {'timestamp': self.data['status']['summary']['ctime'],
-                                             'block_name': 'ACU_commanded_positions_boresight',
-                                             'data': {'Boresight_commanded_position_influx': self.data['status']['commands']['Boresight_commanded_position']}
-                                             }
-                            self.agent.publish_to_feed('acu_commands_influx', acucommand_bs)
-
-            # Only keep blocks that have changed or have new data.
-            block_keys = list(new_influx_blocks.keys())
-            for k in block_keys:
-                if k not in influx_blocks:
-                    continue
-                B, N = influx_blocks[k], new_influx_blocks[k]
-                if N['timestamp'] - B['timestamp'] > MONITOR_MAX_TIME_DELTA:
-                    continue
-                if any([B['data'][_k] != _v for _k, _v in N['data'].items()]):
-                    continue
-                del new_influx_blocks[k]
-
-            for block in new_influx_blocks.values():
-                # Check that we have data (commands and corotator often don't)
-                if len(block['data']) > 0:
-                    self.agent.publish_to_feed('acu_status_influx', block)
-            influx_blocks.update(new_influx_blocks)
+            ctime = status['summary']['ctime']
+            for block in influx_status_blocks(status, self._influx_keys,
+                                              influx_last, ctime):
+                self.agent.publish_to_feed('acu_status_influx', block)
+
+            if 'commands' in changed:
+                command_blocks = [('az', 'Azimuth'), ('el', 'Elevation')]
+                if self.acu_config['platform'] == 'satp':
+                    command_blocks.append(('boresight', 'Boresight'))
+                for suffix, axis in command_blocks:
+                    key = axis + '_commanded_position'
+                    if str(status['commands'][key]) != 'nan':
+                        acucommand = {'timestamp': ctime,
+                                      'block_name': 'ACU_commanded_positions_' + suffix,
+                                      'data': {key + '_influx': status['commands'][key]}
+                                      }
+                        self.agent.publish_to_feed('acu_commands_influx', acucommand)
 
             # Assemble data for aggregator ...
             new_blocks = {}
@@ -736,26 +802,19 @@ class ACUAgent:
                     ('ACU_emergency', 'ACU_emergency'),
                     ('ACU_corotator', 'corotator'),
             ]:
+                # Only keep blocks that have changed or have new data;
+                # the summary is always stored, as a sort of reference
+                # tick.
+                if data_key != 'summary' and data_key not in changed \
+                        and block_name in data_blocks \
+                        and ctime - data_blocks[block_name]['timestamp'] <= MONITOR_MAX_TIME_DELTA:
+                    continue
                 new_blocks[block_name] = {
-                    'timestamp': self.data['status']['summary']['ctime'],
+                    'timestamp': ctime,
                     'block_name': block_name,
-                    'data': self.data['status'][data_key],
+                    'data': dict(status[data_key]),
                 }
 
-            # Only keep blocks that have changed or have new data.
-            block_keys = list(new_blocks.keys())
-            for k in block_keys:
-                if k == 'summary':  # always store these, as a sort of reference tick.
-                    continue
-                if k not in data_blocks:
-                    continue
-                B, N = data_blocks[k], new_blocks[k]
-                if N['timestamp'] - B['timestamp'] > MONITOR_MAX_TIME_DELTA:
-                    continue
-                if any([B['data'][_k] != _v for _k, _v in N['data'].items()]):
-                    continue
-                del new_blocks[k]
-
             for block in new_blocks.values():
                 self.agent.publish_to_feed('acu_status', block)
 
@@ -809,13 +868,18 @@ class ACUAgent:
         session.set_status('running')
         FMT = self.udp_schema['format']
         FMT_LEN = struct.calcsize(FMT)
+        DTYPE = sh.struct_dtype(FMT)
         UDP_PORT = self.udp['port']
+        CHUNK = 200
 
         # The udp_data list is used as a queue; it contains
-        # struct-unpacked samples from the UDP stream in the form
-        # (time_received, data).
+        # (times_received, samples) for each datagram, where samples is
+        # a structured array of the decoded samples.
         udp_data = []
         fields = self.udp_schema['fields']
+        # Sanitized field names, and the corresponding dtype fields.
+        names = [f.replace(' ', '_') for f in fields]
+        data_fields = [(names[i], DTYPE.names[i]) for i in range(2, len(fields))]
         session.data = {}
 
         # BroadcastStreamControl instance.
@@ -824,18 +888,13 @@ class ACUAgent:
         class MonitorUDP(protocol.DatagramProtocol):
             def datagramReceived(self, data, src_addr):
                 now = time.time()
-                host, port = src_addr
-                offset = 0
-                while len(data) - offset >= FMT_LEN:
-                    d = struct.unpack(FMT, data[offset:offset + FMT_LEN])
-                    udp_data.append((now, d))
-                    offset += FMT_LEN
+                count = len(data) // FMT_LEN
+                if count:
+                    udp_data.append(
+                        (np.full(count, now),
+                         np.frombuffer(data, dtype=DTYPE, count=count)))
 
         handler = reactor.listenUDP(int(UDP_PORT), MonitorUDP())
-        influx_data = {}
-        influx_data['Time_bcast_influx'] = []
-        for i in range(2, len(fields)):
-            influx_data[fields[i].replace(' ', '_') + '_bcast_influx'] = []
 
         best_dt = None
 
@@ -845,34 +904,36 @@ class ACUAgent:
         while session.status in ['running']:
             now = time.time()
 
-            if len(udp_data) >= 200:
+            if sum([len(d) for _, d in udp_data]) >= CHUNK:
                 if not active:
                     self.log.info('UDP packets are being received.')
                     active = True
                 last_packet_time = now
-                best_dt = None
-
-                process_data = udp_data[:200]
-                udp_data = udp_data[200:]
-                for recv_time, d in process_data:
-                    data_ctime = sh.timecode(d[0] + d[1] / sh.DAY)
-                    if best_dt is None or abs(recv_time - data_ctime) < best_dt:
-                        best_dt = recv_time - data_ctime
-
-                    self.data['broadcast']['Time'] = data_ctime
-                    influx_data['Time_bcast_influx'].append(data_ctime)
-                    for i in range(2, len(d)):
-                        self.data['broadcast'][fields[i].replace(' ', '_')] = d[i]
-                        influx_data[fields[i].replace(' ', '_') + '_bcast_influx'].append(d[i])
-                    acu_udp_stream = {'timestamp': self.data['broadcast']['Time'],
-                                      'block_name': 'ACU_broadcast',
-                                      'data': self.data['broadcast']
-                                      }
-                    self.agent.publish_to_feed('acu_udp_stream', acu_udp_stream)
-                influx_means = {}
-                for key in influx_data.keys():
-                    influx_means[key] = np.mean(influx_data[key])
-                    influx_data[key] = []
+
+                # Take the first CHUNK samples off the queue.
+                recv_times = np.concatenate([t for t, _ in udp_data])
+                samples = np.concatenate([d for _, d in udp_data])
+                udp_data[:] = [(recv_times[CHUNK:], samples[CHUNK:])]
+                recv_times, samples = recv_times[:CHUNK], samples[:CHUNK]
+
+                d0, d1 = DTYPE.names[:2]
+                data_ctimes = sh.timecode(samples[d0] + samples[d1] / sh.DAY)
+                offsets = recv_times - data_ctimes
+                best_dt = offsets[np.argmin(np.abs(offsets))]
+
+                block_data = {'Time': data_ctimes.tolist()}
+                for name, key in data_fields:
+                    block_data[name] = samples[key].tolist()
+                acu_udp_stream = {'timestamps': block_data['Time'],
+                                  'block_name': 'ACU_broadcast',
+                                  'data': block_data,
+                                  }
+                self.agent.publish_to_feed('acu_udp_stream', acu_udp_stream)
+                self.data['broadcast'] = {k: v[-1] for k, v in block_data.items()}
+
+                influx_means = {'Time_bcast_influx': np.mean(data_ctimes)}
+                for name, key in data_fields:
+                    influx_means[name + '_bcast_influx'] = np.mean(samples[key])
                 acu_broadcast_influx = {'timestamp': influx_means['Time_bcast_influx'],
                                         'block_name': 'ACU_bcast_influx',
                                         'data': influx_means,
@@ -2290,7 +2351,12 @@ class ACUAgent:
                 sun_is_real = ('WARNING' not in info)
                 new_data['sun_pos'].update(info)
                 if az is not None:
-                    t = self.sun.check_trajectory([az], [el])['sun_time']
+                    t = self.sun.lookup_sun_time(az, el)
+                    # Confirm with the exact check before warning or
+                    # escaping, as the grid look-up is conservative.
+                    policy = self.sun_params['policy']
+                    if t < max(policy['min_sun_time'], policy['response_time']):
+                        t = self.sun.check_trajectory([az], [el])['sun_time']
                     new_data['sun_pos']['sun_safe_time'] = t if t > 0 else 0
 
             # Are we currently in safe position?
@@ -2544,12 +2610,16 @@ class ACUAgent:
         n = max(2, int(np.ceil((az2 - az1) / 1.)))
         azs = np.linspace(az1, az2, n)
 
-        info = self.sun.check_trajectory(azs, azs * 0 + el)
-        safe = info['sun_time'] >= self.sun_params['policy']['min_sun_time']
+        # The grid look-up never exceeds the exact check, so only
+        # scans it can't pass need the exact check.
+        sun_time = self.sun.lookup_sun_time(azs, el).min()
+        if sun_time < self.sun_params['policy']['min_sun_time']:
+            sun_time = self.sun.check_trajectory(azs, azs * 0 + el)['sun_time']
+        safe = sun_time >= self.sun_params['policy']['min_sun_time']
         if safe:
-            msg = 'Scan is safe for %.1f hours' % (info['sun_time'] / 3600)
+            msg = 'Scan is safe for %.1f hours' % (sun_time / 3600)
         else:
-            msg = 'Scan will be unsafe in %.1f hours' % (info['sun_time'] / 3600)
+            msg = 'Scan will be unsafe in %.1f hours' % (sun_time / 3600)
 
         return safe, msg
 
@@ -125,14 +125,21 @@ class SunTracker:
         by calling .reset().
       base_time (unix timestamp): Store this base_time and, if compute
         is True, pass it to .reset().
+      azel_res (float, deg): resolution of the horizon coordinate
+        grid used by lookup_sun_time.
+      azel_window (float, seconds): time for which a snapshot of the
+        horizon coordinate grid is used before it is rebuilt.
 
     """
 
     def __init__(self, policy=None, site=None,
                  map_res=.5, sun_time_shift=None, fake_now=None,
-                 compute=True, base_time=None):
+                 compute=True, base_time=None, azel_res=.5,
+                 azel_window=60.):
         # Note res is stored in radians.
         self.res = map_res * DEG
+        self.azel_res = azel_res
+        self.azel_window = azel_window
         if sun_time_shift is None:
             sun_time_shift = 0.
         self.sun_time_shift = sun_time_shift
@@ -156,6 +163,7 @@ class SunTracker:
         site_eph.lat = site.lat * DEG
         site_eph.elevation = site.elev
         self._site = site_eph
+        self._sun_pos_cache = None
 
         if compute:
             self.reset(base_time)
@@ -232,6 +240,96 @@ class SunTracker:
         self.sun_times = sun_times
         self.sun_dist = sun_dist
         self.map_q = map_q
+        self._reset_azel_grid()
+
+    def _reset_azel_grid(self):
+        """Project the nodes of the horizon coordinate grid onto the Sun
+        Safety Map, at base_time.
+
+        For fixed (az, el), the passage of time only shifts the RA
+        index of the map pixel, so this projection is done once;
+        snapshots of the grid at later times are then a cheap,
+        shifted look-up (see _get_azel_grid).
+
+        """
+        n_az = int(round(360. / self.azel_res))
+        n_el = int(round(180. / self.azel_res)) + 1
+        az, el = np.meshgrid(np.arange(n_az) * self.azel_res,
+                             np.arange(n_el) * self.azel_res - 90.)
+        j, i = self._azel_pix(az.ravel(), el.ravel(), round=False)
+        j = j.round().astype(int).clip(0, self.sun_times.shape[-2] - 1)
+        self._azel_pix0 = (j.reshape(az.shape), i.reshape(az.shape))
+        # Take the minimum over neighboring map pixels, so that
+        # positions that round onto a masked pixel near the edge of
+        # the exclusion disk are not missed by the grid nodes.
+        sun_times = np.asarray(self.sun_times)
+        padded = np.vstack((sun_times[:1], sun_times, sun_times[-1:]))
+        padded = np.minimum(np.minimum(padded[:-2], padded[1:-1]), padded[2:])
+        self._azel_map = np.minimum(
+            np.minimum(np.roll(padded, 1, axis=-1), padded),
+            np.roll(padded, -1, axis=-1))
+        self._azel_ref0 = self._azel_pix(0., 0., round=False)[1]
+        self._azel_grid = None
+
+    def _get_azel_grid(self, t):
+        """Return (t_grid, grid), where grid holds the Sun Safety Map
+        value for each node of the horizon coordinate grid at time
+        t_grid.  The snapshot is rebuilt whenever t moves outside of
+        [t_grid, t_grid + azel_window).
+
+        """
+        if self._azel_grid is not None:
+            t_grid, grid = self._azel_grid
+            if t_grid <= t < t_grid + self.azel_window:
+                return self._azel_grid
+        t_grid = t - (t - self.base_time) % self.azel_window
+        di = self._azel_pix(0., 0., dt=t_grid - self.base_time,
+                            round=False)[1] - self._azel_ref0
+        j, i = self._azel_pix0
+        i = (i + di).round().astype(int) % self.sun_times.shape[-1]
+        self._azel_grid = (t_grid, self._azel_map[j, i])
+        return self._azel_grid
+
+    def lookup_sun_time(self, az, el, t=None):
+        """Get the Sun Safety Time for (az, el) positions (in deg) at time
+        t (defaults to now), using the horizon coordinate grid.
+
+        This is much cheaper than check_trajectory, which projects
+        every point onto the Sun Safety Map.  The result is the
+        minimum over the grid nodes surrounding each position (and the
+        map pixels next to each node), reduced by the time elapsed
+        since the grid snapshot was made and by the time the sky takes
+        to rotate across one grid cell and one map pixel.  This bounds
+        the error of the grid, so that the result does not exceed the
+        sun_time from check_trajectory; it is typically lower by 5-10
+        minutes, and is 0 within about a pixel of the exclusion disk.
+
+        Returns an array with the shape of az and el (or a float, for
+        scalar inputs).
+
+        """
+        if t is None:
+            t = self._now()
+        t_grid, grid = self._get_azel_grid(t)
+        n_el, n_az = grid.shape
+
+        fa = (np.asarray(az, dtype=float) % 360.) / self.azel_res
+        fe = (np.asarray(el, dtype=float) + 90.) / self.azel_res
+        a0 = np.floor(fa).astype(int) % n_az
+        a1 = (a0 + 1) % n_az
+        e0 = np.floor(fe).astype(int).clip(0, n_el - 1)
+        e1 = (e0 + 1).clip(0, n_el - 1)
+        sun_time = np.minimum(np.minimum(grid[e0, a0], grid[e0, a1]),
+                              np.minimum(grid[e1, a0], grid[e1, a1]))
+
+        # Positions that are never in the mask stay at NO_TIME.
+        margin = (self.azel_res * DEG + self.res) * DAY / (2 * np.pi)
+        sun_time = np.where(
+            sun_time < NO_TIME,
+            np.maximum(sun_time - (t - t_grid) - margin, 0.), sun_time)
+        if sun_time.ndim == 0:
+            return float(sun_time)
+        return sun_time
 
     def _azel_pix(self, az, el, dt=0, round=True, segments=False):
         """Return the pixel indices of the Sun Safety Map that are
@@ -297,6 +395,49 @@ class SunTracker:
         """
         if t is None:
             t = self._now()
+        if raw:
+            return self._lookup_traj(az, el, t)
+        return self.check_trajectories([(az, el)], t=t)[0]
+
+    def check_trajectories(self, trajs, t=None):
+        """Like check_trajectory, but for a list of (az, el) trajectories,
+        all assumed to occur at time t (defaults to now).  The
+        trajectories are concatenated and projected onto the Sun
+        Safety Map in a single call, which is much faster than
+        checking them one by one.
+
+        Returns a list of dicts, one per trajectory, with the same
+        entries as check_trajectory.
+
+        """
+        if t is None:
+            t = self._now()
+        if len(trajs) == 0:
+            return []
+        az = [np.atleast_1d(np.asarray(_az, dtype=float)) for _az, _ in trajs]
+        el = [np.atleast_1d(np.asarray(_el, dtype=float)) for _, _el in trajs]
+        lens = np.array([len(_az) for _az in az])
+        starts = np.hstack((0, np.cumsum(lens)[:-1]))
+        stops = starts + lens - 1
+
+        sun_delta, sun_dists = self._lookup_traj(
+            np.hstack(az), np.hstack(el), t)
+        time_min = np.minimum.reduceat(sun_delta, starts)
+        dist_min = np.minimum.reduceat(sun_dists, starts)
+        dist_mean = np.add.reduceat(sun_dists, starts) / lens
+        return [{
+            'sun_time': time_min[k],
+            'sun_time_start': sun_delta[starts[k]],
+            'sun_time_stop': sun_delta[stops[k]],
+            'sun_dist_start': sun_dists[starts[k]],
+            'sun_dist_stop': sun_dists[stops[k]],
+            'sun_dist_min': dist_min[k],
+            'sun_dist_mean': dist_mean[k],
+        } for k in range(len(trajs))]
+
+    def _lookup_traj(self, az, el, t):
+        """Return the Sun Safety Map and Sun Distance Map values along
+        the trajectory (az, el) at time t."""
         j, i = self._azel_pix(az, el, dt=t - self.base_time)
         sun_delta = self.sun_times[j, i]
         sun_dists = self.sun_dist[j, i]
@@ -304,18 +445,7 @@ class SunTracker:
         # If sun is below horizon, rail sun_dist to 180 deg.
         if self.get_sun_pos(t=t)['sun_azel'][1] < self.policy['el_horizon']:
             sun_dists[:] = 180.
-
-        if raw:
-            return sun_delta, sun_dists
-        return {
-            'sun_time': sun_delta.min(),
-            'sun_time_start': sun_delta[0],
-            'sun_time_stop': sun_delta[-1],
-            'sun_dist_start': sun_dists[0],
-            'sun_dist_stop': sun_dists[-1],
-            'sun_dist_min': sun_dists.min(),
-            'sun_dist_mean': sun_dists.mean(),
-        }
+        return sun_delta, sun_dists
 
     def get_sun_pos(self, az=None, el=None, t=None):
         """Get info on the Sun's location at time t.  If (az, el) are also
@@ -325,16 +455,24 @@ class SunTracker:
         """
         if t is None:
             t = self._now()
-        v = self._sun(t)
-        qsun = quat.rotation_lonlat(v.ra, v.dec)
 
-        qzen = coords.CelestialSightLine.naive_az_el(t, 0, np.pi / 2).Q
-        neg_zen_az, zen_el, _ = quat.decompose_lonlat(~qzen * qsun)
+        # The ephem computation is slow compared to everything else
+        # here, so remember the result for the most recent t.
+        key = (t, self.sun_time_shift)
+        if self._sun_pos_cache is None or self._sun_pos_cache[0] != key:
+            v = self._sun(t)
+            qsun = quat.rotation_lonlat(v.ra, v.dec)
 
-        results = {
-            'sun_radec': (v.ra / DEG, v.dec / DEG),
-            'sun_azel': ((-neg_zen_az / DEG) % 360., zen_el / DEG),
-        }
+            qzen = coords.CelestialSightLine.naive_az_el(t, 0, np.pi / 2).Q
+            neg_zen_az, zen_el, _ = quat.decompose_lonlat(~qzen * qsun)
+
+            self._sun_pos_cache = (key, qsun, {
+                'sun_radec': (v.ra / DEG, v.dec / DEG),
+                'sun_azel': ((-neg_zen_az / DEG) % 360., zen_el / DEG),
+            })
+        _, qsun, results = self._sun_pos_cache
+
+        results = dict(results)
         if self.sun_time_shift != 0:
             results['WARNING'] = 'Fake Sun Position is in use!'
 
@@ -390,8 +528,51 @@ class SunTracker:
         if plot_file:
             assert (t == self.base_time)  # Can only plot "now" results.
             fig, axes, imgs = self.show_map(show=False)
+
+        all_moves, direct = self._design_paths(az0, el0, az1, el1, t,
+                                               dodging=dodging)
+        all_moves = self._evaluate_paths([(all_moves, direct)], t)[0]
+
+        if plot_file:
             last_el = None
+            for m in all_moves:
+                if m['direct']:
+                    continue
+                iel = m['travel_el']
+                if last_el is None or abs(last_el - iel) > 5:
+                    c = 'black'
+                    for j, i in self._azel_pix(*m['moves'].get_traj(), round=True, segments=True):
+                        for ax in axes:
+                            a, = ax.plot(i, j, color=c, lw=1)
+                    last_el = iel
+
+            # Add the direct traj, in blue.
+            segments = self._azel_pix(*direct['moves'].get_traj(), round=True, segments=True)
+            for ax in axes:
+                for j, i in segments:
+                    ax.plot(i, j, color='blue')
+                for seg, rng, mrk in [(segments[0], slice(0, 1), 'o'),
+                                      (segments[-1], slice(-1, None), 'x')]:
+                    ax.scatter(seg[1][rng], seg[0][rng], marker=mrk, color='blue')
+            # Add the selected trajectory in green.
+            selected = self.select_move(all_moves)[0]
+            if selected is not None:
+                traj = selected['moves'].get_traj()
+                segments = self._azel_pix(*traj, round=True, segments=True)
+                for ax in axes:
+                    for j, i in segments:
+                        ax.plot(i, j, color='green')
 
+            pl.savefig(plot_file)
+        return all_moves
+
+    def _design_paths(self, az0, el0, az1, el1, t, dodging=True):
+        """Construct the candidate moves considered by analyze_paths,
+        without evaluating them.  Returns (moves, direct), where moves
+        is the list of paths via intermediate elevations and direct is
+        the single-leg path.
+
+        """
         # Test all trajectories with intermediate el.
         all_moves = []
 
@@ -431,51 +612,43 @@ class SunTracker:
                 'travel_el': iel,
                 'travel_el_confined': (iel >= min(el0, el1)) and (iel <= max(el0, el1)),
             })
-            moves = MoveSequence(az0, el0, az0, iel, az1, iel, az1, el1, simplify=True)
-
-            detail['moves'] = moves
-            traj_info = self.check_trajectory(*moves.get_traj(), t=t)
-            detail.update(traj_info)
+            detail['moves'] = MoveSequence(az0, el0, az0, iel, az1, iel, az1, el1, simplify=True)
             all_moves.append(detail)
-            if plot_file and (last_el is None or abs(last_el - iel) > 5):
-                c = 'black'
-                for j, i in self._azel_pix(*moves.get_traj(), round=True, segments=True):
-                    for ax in axes:
-                        a, = ax.plot(i, j, color=c, lw=1)
-                last_el = iel
-
-        # Include the direct path, but put in "worst case" details
-        # based on all "confined" paths computed above.
+
         direct = dict(base)
         direct['moves'] = MoveSequence(az0, el0, az1, el1, simplify=True)
-        traj_info = self.check_trajectory(*direct['moves'].get_traj(), t=t)
-        direct.update(traj_info)
-        conf = [m for m in all_moves if m['travel_el_confined']]
-        if len(conf):
-            for k in ['sun_time', 'sun_dist_min', 'sun_dist_mean']:
-                direct[k] = min([m[k] for m in conf])
-            all_moves.append(direct)
+        return all_moves, direct
 
-        if plot_file:
-            # Add the direct traj, in blue.
-            segments = self._azel_pix(*direct['moves'].get_traj(), round=True, segments=True)
-            for ax in axes:
-                for j, i in segments:
-                    ax.plot(i, j, color='blue')
-                for seg, rng, mrk in [(segments[0], slice(0, 1), 'o'),
-                                      (segments[-1], slice(-1, None), 'x')]:
-                    ax.scatter(seg[1][rng], seg[0][rng], marker=mrk, color='blue')
-            # Add the selected trajectory in green.
-            selected = self.select_move(all_moves)[0]
-            if selected is not None:
-                traj = selected['moves'].get_traj()
-                segments = self._azel_pix(*traj, round=True, segments=True)
-                for ax in axes:
-                    for j, i in segments:
-                        ax.plot(i, j, color='green')
+    def _evaluate_paths(self, designs, t):
+        """Evaluate a list of (moves, direct) designs, as returned by
+        _design_paths, checking all trajectories in a single batch.
+        Returns a list with the analyzed moves for each design, as
+        returned by analyze_paths.
 
-            pl.savefig(plot_file)
-        return all_moves
+        """
+        trajs = []
+        for all_moves, direct in designs:
+            trajs.extend(m['moves'].get_traj() for m in all_moves)
+            trajs.append(direct['moves'].get_traj())
+        infos = iter(self.check_trajectories(trajs, t=t))
+
+        results = []
+        for all_moves, direct in designs:
+            all_moves = [dict(m) for m in all_moves]
+            for m in all_moves:
+                m.update(next(infos))
+
+            # Include the direct path, but put in "worst case" details
+            # based on all "confined" paths.
+            direct = dict(direct)
+            direct.update(next(infos))
+            conf = [m for m in all_moves if m['travel_el_confined']]
+            if len(conf):
+                for k in ['sun_time', 'sun_dist_min', 'sun_dist_mean']:
+                    direct[k] = min([m[k] for m in conf])
+                all_moves.append(direct)
+            results.append(all_moves)
+        return results
 
     def find_escape_paths(self, az0, el0, t=None,
                           debug=False):
@@ -502,8 +675,10 @@ class SunTracker:
 
         path = None
         for el1 in els:
-            paths = [self.analyze_paths(az0, el0, _az, el1, t=t, dodging=False)
-                     for _az in az_cands]
+            # Paths to all az candidates are evaluated together.
+            designs = [self._design_paths(az0, el0, _az, el1, t, dodging=False)
+                       for _az in az_cands]
+            paths = self._evaluate_paths(designs, t)
             best_paths = [self.select_move(p)[0] for p in paths]
             best_paths = [p for p in best_paths if p is not None]
             if len(best_paths):
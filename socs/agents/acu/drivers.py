@@ -1,6 +1,7 @@
 import calendar
 import datetime
 import math
+import re
 import time
 
 import numpy as np
@@ -166,19 +167,32 @@ def ptstack_format(conctimes, concaz, concel, concva, concve, az_flags,
 
     """
 
-    fmt = '%j, %H:%M:%S'
     if not absolute:
         start_offset = time.time() + start_offset
-    true_times = [start_offset + i for i in conctimes]
-    fmt_times = [time.strftime(fmt, time.gmtime(t))
-                 + ('{tt:.6f}'.format(tt=t % 1.))[1:] for t in true_times]
-
-    all_lines = [('{ftime}; {az:.6f}; {el:.6f}; {azvel:.4f}; '
-                  '{elvel:.4f}; {azflag}; {elflag}'
-                  '\r\n'.format(ftime=fmt_times[n], az=concaz[n],
-                                el=concel[n], azvel=concva[n], elvel=concve[n],
-                                azflag=az_flags[n], elflag=el_flags[n]))
-                 for n in range(len(fmt_times))]
+    true_times = start_offset + np.asarray(conctimes, dtype=float)
+    n = len(true_times)
+    if n == 0:
+        return []
+
+    # Break the times into day of year, hours, minutes and seconds
+    # (like time.gmtime, which truncates).  The fractional seconds
+    # are the last 7 characters of each time formatted to 6 decimal
+    # places.
+    secs = np.floor(true_times).astype(np.int64)
+    days = secs // DAY
+    year_days = (days.astype('datetime64[D]').astype('datetime64[Y]')
+                 .astype('datetime64[D]').astype(np.int64))
+    sod = secs % DAY
+    fracs = [f[-7:] for f in (('%.6f\n' * n) % tuple(true_times)).split()]
+
+    # Format all lines in a single operation.
+    values = np.empty((n, 11), dtype=object)
+    for col, v in enumerate([days - year_days + 1, sod // 3600,
+                             sod // 60 % 60, sod % 60, fracs, concaz, concel,
+                             concva, concve, az_flags, el_flags]):
+        values[:, col] = v
+    line_fmt = '%03d, %02d:%02d:%02d%s; %.6f; %.6f; %.4f; %.4f; %s; %s\r\n'
+    all_lines = ((line_fmt * n) % tuple(values.ravel())).splitlines(True)
 
     if group_flag is not None:
         all_lines = [(i, line) for i, line in zip(group_flag, all_lines)]
@@ -186,34 +200,91 @@ def ptstack_format(conctimes, concaz, concel, concva, concve, az_flags,
     return all_lines
 
 
+def _year_start(t):
+    """Returns the unix timestamp of the start of the year containing
+    unix timestamp t."""
+    year = datetime.datetime.utcfromtimestamp(t).year
+    return calendar.timegm(time.strptime(str(year), '%Y'))
+
+
 def timecode(acutime, now=None):
     """Takes the time code produced by the ACU status stream and returns
     a unix timestamp.
 
     Parameters:
-        acutime (float): The time recorded by the ACU status stream,
-            corresponding to the fractional day of the year.
+        acutime (float or array): The time recorded by the ACU status
+            stream, corresponding to the fractional day of the year.
+            An array of times is converted at once.
         now (float): The time, as unix timestamp, to assume it is now.
             This is for testing, it defaults to time.time().
 
+    Returns:
+        The unix timestamp, as a float or an array matching acutime.
+
     """
-    sec_of_day = (acutime - 1) * DAY
     if now is None:
         now = time.time()  # testing
 
     # This guard protects us at end of year, when time.time() and
     # acutime might correspond to different years.
-    if acutime > 180:
-        context = datetime.datetime.utcfromtimestamp(now - 30 * DAY)
+    if np.ndim(acutime) == 0:
+        if acutime > 180:
+            gyear = _year_start(now - 30 * DAY)
+        else:
+            gyear = _year_start(now + 30 * DAY)
     else:
-        context = datetime.datetime.utcfromtimestamp(now + 30 * DAY)
+        acutime = np.asarray(acutime)
+        gyear = np.where(acutime > 180, _year_start(now - 30 * DAY),
+                         _year_start(now + 30 * DAY))
 
-    year = context.year
-    gyear = calendar.timegm(time.strptime(str(year), '%Y'))
+    sec_of_day = (acutime - 1) * DAY
     comptime = gyear + sec_of_day
     return comptime
 
 
+def struct_dtype(fmt):
+    """Converts a struct format string, such as the one in a UDP stream
+    schema, into the equivalent numpy structured dtype.  The fields are
+    named 'f0', 'f1', ...  Pad bytes ('x') are skipped in the naming.
+
+    Parameters:
+        fmt (str): The struct format string; must use standard sizes,
+            i.e. start with one of '<', '>', '!' or '='.
+
+    Returns:
+        numpy.dtype with the same itemsize as struct.calcsize(fmt).
+
+    """
+    codes = {'b': 'i1', 'B': 'u1', '?': 'b1', 'h': 'i2', 'H': 'u2',
+             'i': 'i4', 'I': 'u4', 'l': 'i4', 'L': 'u4', 'q': 'i8',
+             'Q': 'u8', 'e': 'f2', 'f': 'f4', 'd': 'f8'}
+    if not fmt or fmt[0] not in '<>!=':
+        raise ValueError(f'Format "{fmt}" does not use standard sizes.')
+    order = {'!': '>', '=': '='}.get(fmt[0], fmt[0])
+
+    names, formats, offsets = [], [], []
+    offset = 0
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', fmt[1:]):
+        count = int(count) if count else 1
+        if code == 'x':
+            offset += count
+        elif code == 's':
+            names.append(f'f{len(names)}')
+            formats.append(f'S{count}')
+            offsets.append(offset)
+            offset += count
+        elif code in codes:
+            for _ in range(count):
+                names.append(f'f{len(names)}')
+                formats.append(order + codes[code])
+                offsets.append(offset)
+                offset += int(codes[code][1:])
+        else:
+            raise ValueError(f'Format code "{code}" is not supported.')
+    return np.dtype({'names': names, 'formats': formats,
+                     'offsets': offsets, 'itemsize': offset})
+
+
 def generate_constant_velocity_scan(az_endpoint1, az_endpoint2, az_speed,
                                     acc, el_endpoint1, el_endpoint2,
                                     el_speed=0,
@@ -323,7 +394,6 @@ def generate_constant_velocity_scan(az_endpoint1, az_endpoint2, az_speed,
     else:
         raise ValueError(f'az_start value "{az_start}" not supported. Choose from '
                          'az_endpoint1, az_endpoint2, mid_inc, mid_dec')
-    az_vel = az_speed if increasing else -az_speed
 
     # Bias the starting point for the first leg?
     if az_first_pos is not None:
@@ -333,7 +403,6 @@ def generate_constant_velocity_scan(az_endpoint1, az_endpoint2, az_speed,
         t0 = time.time() + wait_to_start
     else:
         t0 = start_time
-    t = 0
     turntime = 2.0 * az_speed / acc
     el = el_endpoint1
     if step_time < 0.05:
@@ -341,7 +410,6 @@ def generate_constant_velocity_scan(az_endpoint1, az_endpoint2, az_speed,
                          '0.05 seconds')
     daz = step_time * az_speed
     el_vel = el_speed
-    az_flag = 0
     el_flag = 0
     if num_batches is None:
         stop_iter = float('inf')
@@ -349,105 +417,85 @@ def generate_constant_velocity_scan(az_endpoint1, az_endpoint2, az_speed,
         stop_iter = num_batches
         batch_size = int(np.ceil(abs(az_endpoint2 - az_endpoint1) / daz))
 
-    def dec_num_scans():
-        nonlocal num_scans
-        if num_scans is not None:
-            num_scans -= 1
-
-    def check_num_scans():
-        return num_scans is None or num_scans > 0
-
-    target_az = get_target_az(az, t, increasing)
-    point_group_batch = 0
-
-    i = 0
-    while i < stop_iter and check_num_scans():
-        i += 1
-        point_block = [[], [], [], [], [], [], [], []]
-        for j in range(batch_size):
-            point_block[0].append(t + t0)
-            point_block[1].append(az)
-            point_block[2].append(el)
-            point_block[3].append(az_vel)
-            point_block[4].append(el_vel)
-            point_block[5].append(az_flag)
-            point_block[6].append(el_flag)
-            point_block[7].append(int(point_group_batch > 0))
-
-            if point_group_batch > 0:
-                point_group_batch -= 1
-
+    def plan_legs(az, increasing, num_scans):
+        # Yield (t, az, az_vel, az_flag, group_flag) arrays for each
+        # leg of the scan: the first point (the start, or the end of
+        # a turn-around), the constant velocity steps, and a final
+        # point exactly on the target az, if the steps did not land
+        # there.  Positions and times are accumulated with cumsum, so
+        # they are identical to stepping one point at a time.
+        t = 0.
+        az_vel = az_speed if increasing else -az_speed
+        az_flag = 0
+        n_group = 0
+        target_az = get_target_az(az, t, increasing)
+        while num_scans is None or num_scans > 0:
+            sign = 1 if increasing else -1
+            n = int(np.ceil(abs(target_az - az) / daz)) + 2
+            azs = np.cumsum(np.hstack((az, np.full(n, sign * daz))))
+            ts = np.cumsum(np.hstack((t, np.full(n, step_time))))
+
+            # Keep stepping while at least 2 steps from the target.
             if increasing:
-                if az <= (target_az - 2 * daz):
-                    t += step_time
-                    az += daz
-                    az_vel = az_speed
-                    el_vel = el_speed
-                    az_flag = 1
-                    el_flag = 0
-                elif az == target_az:
-                    # Turn around.
-                    t += turntime
-                    az_vel = -1 * az_speed
-                    el_vel = el_speed
-                    az_flag = 1
-                    el_flag = 0
-                    increasing = False
-                    target_az = get_target_az(az, t, increasing)
-                    dec_num_scans()
-                    point_group_batch = MIN_GROUP_NEW_LEG - 1
-                else:
-                    time_remaining = (target_az - az) / az_speed
-                    az = target_az
-                    t += time_remaining
-                    az_vel = az_speed
-                    el_vel = el_speed
-                    az_flag = 2
-                    el_flag = 0
+                n_steps = np.argmax(azs > target_az - 2 * daz)
             else:
-                if az >= (target_az + 2 * daz):
-                    t += step_time
-                    az -= daz
-                    az_vel = -1 * az_speed
-                    el_vel = el_speed
-                    az_flag = 1
-                    el_flag = 0
-                elif az == target_az:
-                    # Turn around.
-                    t += turntime
-                    az_vel = az_speed
-                    el_vel = el_speed
-                    az_flag = 1
-                    el_flag = 0
-                    increasing = True
-                    target_az = get_target_az(az, t, increasing)
-                    dec_num_scans()
-                    point_group_batch = MIN_GROUP_NEW_LEG - 1
-                else:
-                    time_remaining = (az - target_az) / az_speed
-                    az = target_az
-                    t += time_remaining
-                    az_vel = -1 * az_speed
-                    el_vel = el_speed
-                    az_flag = 2
-                    el_flag = 0
-
-            if not check_num_scans():
-                # Kill the velocity on the last point and exit -- this
-                # was recommended at LAT FAT for smoothly stopping the
-                # motion at end of program.
-                point_block[3][-1] = 0
-                point_block[4][-1] = 0
+                n_steps = np.argmax(azs < target_az + 2 * daz)
+            azs, ts = azs[:n_steps + 1], ts[:n_steps + 1]
+            vels = np.full(n_steps + 1, sign * az_speed)
+            flags = np.ones(n_steps + 1, dtype=int)
+            vels[0], flags[0] = az_vel, az_flag
+            if azs[-1] != target_az:
+                azs = np.hstack((azs, target_az))
+                ts = np.hstack((ts, ts[-1] + sign * (target_az - azs[-2]) / az_speed))
+                vels = np.hstack((vels, sign * az_speed))
+                flags = np.hstack((flags, 2))
+            groups = np.zeros(len(ts), dtype=int)
+            groups[:n_group] = 1
+
+            # Turn around.
+            az = target_az
+            t = ts[-1] + turntime
+            increasing = not increasing
+            az_vel = -sign * az_speed
+            az_flag = 1
+            n_group = MIN_GROUP_NEW_LEG - 1
+            target_az = get_target_az(az, t, increasing)
+            if num_scans is not None:
+                num_scans -= 1
+                if num_scans <= 0:
+                    # Kill the velocity on the last point -- this was
+                    # recommended at LAT FAT for smoothly stopping the
+                    # motion at end of program.
+                    vels[-1] = 0
+            yield ts, azs, vels, flags, groups
+
+    legs = plan_legs(az, increasing, num_scans)
+    pending = []
+    n_pending = 0
+    i = 0
+    while i < stop_iter:
+        while n_pending < batch_size:
+            leg = next(legs, None)
+            if leg is None:
                 break
+            pending.append(leg)
+            n_pending += len(leg[0])
+        if n_pending == 0:
+            break
+        i += 1
+        ts, azs, vels, flags, groups = [np.concatenate(x) for x in zip(*pending)]
+        pending = [tuple(x[batch_size:] for x in (ts, azs, vels, flags, groups))]
+        n_pending = len(pending[0][0])
+        n = len(ts[:batch_size])
+        point_block = (ts[:batch_size] + t0, azs[:batch_size], [el] * n,
+                       vels[:batch_size], [el_vel] * n, flags[:batch_size],
+                       [el_flag] * n, groups[:batch_size])
 
         if ptstack_fmt:
-            yield ptstack_format(point_block[0], point_block[1],
-                                 point_block[2], point_block[3],
-                                 point_block[4], point_block[5],
-                                 point_block[6], point_block[7],
-                                 start_offset=3, absolute=True)
+            yield ptstack_format(*point_block, start_offset=3, absolute=True)
         else:
-            yield tuple(point_block)
+            yield tuple(x if isinstance(x, list) else x.tolist()
+                        for x in point_block)
 
 
 def plan_scan(az_end1, az_end2, el, v_az=1, a_az=1, az_start=None):
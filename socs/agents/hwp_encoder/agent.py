@@ -43,6 +43,14 @@ HWPEncoder:
    irig_synch_pulse_clock_counts: clock counts for reference markers
    irig_info: IRIG bit info
 
+   (HWPEncoder_health)
+   packet_rate: rate of received packets in Hz
+   num_counter_packets: total number of received encoder packets
+   num_irig_packets: total number of received IRIG packets
+   num_dropped_packets: total number of packets dropped due to a full queue
+   counter_queue_depth: number of encoder batches waiting to be published
+   irig_queue_depth: number of IRIG batches waiting to be published
+
 HWPEncoder_full: separated feed for full-sample HWP encoder data,
                  not to be included in influxdb database
    (HWPEncoder_counter)
@@ -51,10 +59,10 @@ HWPEncoder_full: separated feed for full-sample HWP encoder data,
 """
 
 import argparse
-import calendar
 import select
 import socket
 import struct
+import threading
 import time
 from collections import deque
 
@@ -66,6 +74,9 @@ txaio.use_twisted()
 from ocs import ocs_agent, site_config
 from ocs.ocs_twisted import TimeoutLock
 
+from socs.common.irig import (BBB_CLOCK_FREQ, count2time, decode_irig,
+                              fit_clock_freq, irig2unix)
+
 # These three values (COUNTER_INFO_LENGTH, COUNTER_PACKET_SIZE, IRIG_PACKET_SIZE)
 # should be consistent with the software on beaglebone.
 # The number of datapoints in every encoder packet from the Beaglebone
@@ -76,6 +87,19 @@ COUNTER_PACKET_SIZE = 4 + 4 * COUNTER_INFO_LENGTH + 8 * COUNTER_INFO_LENGTH + 4
 # The size of the IRIG packet from the Beaglebone
 IRIG_PACKET_SIZE = 132
 
+# Layout of the packets from the Beaglebone, used to decode many packets at once
+COUNTER_PACKET_DTYPE = np.dtype([('header', '<u4'),
+                                 ('quad', '<u4'),
+                                 ('clock', '<u4', (COUNTER_INFO_LENGTH,)),
+                                 ('overflow', '<u4', (COUNTER_INFO_LENGTH,)),
+                                 ('index', '<u4', (COUNTER_INFO_LENGTH,))])
+IRIG_PACKET_DTYPE = np.dtype([('header', '<u4'),
+                              ('rising_edge', '<u4'),
+                              ('rising_edge_overflow', '<u4'),
+                              ('info', '<u4', (10,)),
+                              ('synch_pulse', '<u4', (10,)),
+                              ('synch_pulse_overflow', '<u4', (10,))])
+
 # The slit scaler value for rough HWP rotating frequency
 NUM_SLITS = 570
 # Number of encoder counter samples to publish at once
@@ -84,58 +108,10 @@ NUM_ENCODER_TO_PUBLISH = 4200
 SEC_ENCODER_TO_PUBLISH = 10
 # Subsampling facot for the encoder counter data to influxdb
 NUM_SUBSAMPLE = 500
-
-
-def de_irig(val, base_shift=0):
-    """Converts the IRIG signal into sec/min/hours/day/year depending on the parameters
-
-    Parameters
-    ----------
-    val : int
-       raw IRIG bit info of each 100msec chunk
-    base_shift : int, optional
-       number of bit shifts. This should be 0 except for seccods
-
-    Returns
-    -------
-    int
-       Either of sec/min/hourds/day/year
-
-    """
-    return (((val >> (0 + base_shift)) & 1)
-            + ((val >> (1 + base_shift)) & 1) * 2
-            + ((val >> (2 + base_shift)) & 1) * 4
-            + ((val >> (3 + base_shift)) & 1) * 8
-            + ((val >> (5 + base_shift)) & 1) * 10
-            + ((val >> (6 + base_shift)) & 1) * 20
-            + ((val >> (7 + base_shift)) & 1) * 40
-            + ((val >> (8 + base_shift)) & 1) * 80)
-
-
-def count2time(counts, t_offset=0.):
-    """Quick etimation of time using Beagleboneblack clock counts
-
-    Parameters
-    ----------
-    counts : list of int
-       Beagleboneblack clock counter value
-    t_offset : int, optional
-       time offset in seconds
-
-    Returns
-    -------
-    list of float
-       Estimated time in seconds assuming the Beagleboneblack clock frequency is 200 MHz.
-       Without specifying t_offset, output is just the difference
-       from the first sample in the input list
-
-    """
-    t_array = np.array(counts, dtype=float) - counts[0]
-    # Assuming BBB clock is 200MHz
-    t_array *= 5.e-9
-    t_array += t_offset
-
-    return t_array.tolist()
+# Seconds between publishing the health of the data reception
+SEC_HEALTH_TO_PUBLISH = 1
+# Number of IRIG packets (one per second) to fit the Beaglebone clock frequency
+NUM_IRIG_TO_FIT = 10
 
 
 class EncoderParser:
@@ -144,9 +120,9 @@ class EncoderParser:
     Attributes
     ----------
     counter_queue : deque object
-       deque to store the encoder counter data
+       deque to store batches of the encoder counter data
     irig_queue : deque object
-       deque to store the IRIG data
+       deque to store batches of the IRIG data
     is_start : int
        Used for procedures that only run when data collection begins
        Initialized to be 1, until the first IRIG parsing happens and set to 0
@@ -154,14 +130,28 @@ class EncoderParser:
        Will hold the time at which data collection started [hours, mins, secs]
     current_time : int
        Current unix timestamp in seconds parased from IRIG
+    clock_freq : float
+       Beaglebone clock frequency in Hz, fitted to the IRIG rising edges of
+       the last NUM_IRIG_TO_FIT packets
     sock : scoket.sock
        a UDP socket to connect to the Beagleboneblack
-    data : str
-       String which will hold the raw data from the Beaglebone before it is parsed
+    buffer : bytearray
+       Preallocated buffer which holds the raw data from the Beaglebone before
+       it is parsed. Unparsed bytes are kept between reads.
     read_chunk_size : int
        Maximum data size to receive UDP packets in bytes
+    data_ready : threading.Event
+       Set by the receiver thread when new data are put to the queues
+    receiver_error : Exception or None
+       Unexpected error which stopped the receiver thread, if any
+    num_counter_packets : int
+       Total number of parsed encoder packets
+    num_irig_packets : int
+       Total number of parsed IRIG packets
+    num_dropped_packets : int
+       Total number of packets dropped because a queue was full
 
-   Parameters
+    Parameters
     ----------
     beaglebone_port : int, optional
        Port number to receive UDP packets from Beagleboneblack
@@ -169,10 +159,17 @@ class EncoderParser:
     read_chunk_size : int, optional
        Maximum data size to receive UDP packets in bytes
        read_chunk_size: This value shouldn't need to change
+    buffer_size : int, optional
+       Size of the preallocated receive buffer in bytes. It is enlarged if
+       needed to fit one read chunk on top of a partial packet.
+    max_queue_size : int, optional
+       Maximum number of batches held in each of counter_queue and irig_queue.
+       New batches are dropped and counted while a queue is full.
 
     """
 
-    def __init__(self, beaglebone_port=8080, read_chunk_size=8196):
+    def __init__(self, beaglebone_port=8080, read_chunk_size=8196, buffer_size=65536,
+                 max_queue_size=1000):
         # Creates twoe queues to hold the data from the encoder, IRIG, and quadrature respectively
         self.counter_queue = deque()
         self.irig_queue = deque()
@@ -183,6 +180,10 @@ class EncoderParser:
         self.start_time = [0, 0, 0]
         # Will be continually updated with unix in seconds
         self.current_time = 0
+        # Clock counts and times of the recent IRIG rising edges, to fit the
+        # Beaglebone clock frequency
+        self.clock_freq = BBB_CLOCK_FREQ
+        self._irig_edges = deque(maxlen=NUM_IRIG_TO_FIT)
 
         # Creates a UDP socket to connect to the Beaglebone
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -191,9 +192,24 @@ class EncoderParser:
         self.sock.bind(('', beaglebone_port))
         # self.sock.setblocking(0)
 
-        # String which will hold the raw data from the Beaglebone before it is parsed
-        self.data = ''
+        # Buffer which will hold the raw data from the Beaglebone before it is parsed.
+        # Unparsed data lives in self.buffer[self._start:self._end]
         self.read_chunk_size = read_chunk_size
+        self.buffer = bytearray(max(buffer_size, read_chunk_size + COUNTER_PACKET_SIZE))
+        self._view = memoryview(self.buffer)
+        self._bytes = np.frombuffer(self.buffer, dtype=np.uint8)
+        self._start = 0
+        self._end = 0
+
+        # Receiver thread and the counters for its health
+        self.max_queue_size = max_queue_size
+        self.data_ready = threading.Event()
+        self._receiver = None
+        self._receiving = False
+        self.receiver_error = None
+        self.num_counter_packets = 0
+        self.num_irig_packets = 0
+        self.num_dropped_packets = 0
 
         self.log = txaio.make_logger()
 
@@ -216,13 +232,13 @@ class EncoderParser:
            Current unix timestamp in seconds parased from IRIG
 
         """
-        # Calls self.de_irig() to get the sec/min/hour of the IRIG packet
-        secs = de_irig(irig_info[0], 1)
-        mins = de_irig(irig_info[1], 0)
-        hours = de_irig(irig_info[2], 0)
-        day = de_irig(irig_info[3], 0) \
-            + de_irig(irig_info[4], 0) * 100
-        year = de_irig(irig_info[5], 0)
+        # Calls decode_irig() to get the sec/min/hour of the IRIG packet
+        fields = decode_irig(irig_info)
+        secs = fields['sec']
+        mins = fields['min']
+        hours = fields['hour']
+        day = fields['day']
+        year = fields['year']
 
         # If it is the first time that the function is called then set self.start_time
         # to the current time
@@ -255,43 +271,53 @@ class EncoderParser:
 
         # Set the current time in seconds (changed to seconds from unix epoch)
         # self.current_time = secs + mins*60 + hours*3600
-        try:
-            st_time = time.strptime("%d %d %d:%d:%d" % (year, day, hours, mins, secs),
-                                    "%y %j %H:%M:%S")
-            self.current_time = calendar.timegm(st_time)
-        except ValueError:
+        self.current_time = irig2unix(fields)
+        if self.current_time < 0:
             self.log.error(f'Invalid IRIG-B timestamp: {year} {day} {hours} {mins} {secs}')
-            self.current_time = -1
 
         return self.current_time
 
-    def check_data_length(self, start_index, size_of_read):
-        """Checks to make sure that self.data is the right size
-        Return false if the wrong size, return true if the data is the right size
+    def _compact(self):
+        """Moves the unparsed bytes to the front of self.buffer so that a full
+        read chunk fits behind them. The leftover is at most one partial
+        packet, so this is a small copy.
+        """
+        size = self._end - self._start
+        if self._start > 0:
+            self.buffer[:size] = self.buffer[self._start:self._end]
+        self._start = 0
+        self._end = size
+
+    def _gather(self, offsets, dtype):
+        """Copies the packets starting at each of the offsets out of self.buffer
 
         Parameters
         ----------
-        start_index : int
-           first index of the data to read
-        size_of_read : int
-           data size to read in bytes
+        offsets : list of int
+           byte offsets in self.buffer of the packet headers
+        dtype : numpy.dtype
+           structured dtype of the packet
 
         Returns
         -------
-        bool
-           False if the current data size is smaller than the data size suggested by the header info
+        numpy.ndarray
+           structured array with one entry per packet
 
         """
-        if start_index + size_of_read > len(self.data):
-            self.data = self.data[start_index:]
-            return False
-
-        return True
+        offsets = np.asarray(offsets)
+        if np.all(np.diff(offsets) == dtype.itemsize):
+            # Back-to-back packets of the same type can be copied in one go
+            return np.frombuffer(self.buffer, dtype=dtype, count=len(offsets),
+                                 offset=int(offsets[0])).copy()
+        index = offsets[:, np.newaxis] + np.arange(dtype.itemsize)
+        return self._bytes[index].view(dtype)[:, 0]
 
     def grab_and_parse_data(self):
-        """Grabs self.data, determine what packet it corresponds to, parses the data.
-        This is a while loop to look for an appropriate header in a packet from beaglebone.
-        Then, the data will be passed to an appropriate parsing method
+        """Grabs data from the socket, determine what packets it corresponds to, parses the data.
+        This is a while loop to wait for data from beaglebone.
+        The data is received directly into the preallocated buffer and all complete
+        packets in it are then located by their headers in a single pass.
+        Packets of each type are passed to an appropriate parsing method in one batch
         and stored in either of counter_queue or irig_queue.
         The detailed structure of the queues can be found in parse_counter_info/parse_irig_info.
 
@@ -302,177 +328,367 @@ class EncoderParser:
            Error 2: data length is shorter than the IRIG info
                     even though the IRIG packet header is found.
         """
-        while True:
-            # If there is data from the socket attached to the beaglebone then
-            #     ready[0] = true
-            # If not then continue checking for 2 seconds and if there is still no data
-            #     ready[0] = false
-            ready = select.select([self.sock], [], [], 2)
-            if ready[0]:
-                # Add the data from the socket attached to the beaglebone
-                # to the self.data string
-                data = self.sock.recv(self.read_chunk_size)
-                if len(self.data) > 0:
-                    self.data += data
-                else:
-                    self.data = data
-
-                while True:
-                    # Check to make sure that there is at least 1 int in the packet
-                    # The first int in every packet should be the header
-                    if not self.check_data_length(0, 4):
-                        self.log.error('Error 0')
-                        break
-
-                    header = self.data[0:4]
-                    # Convert a structure value from the beaglebone (header) to an int
-                    header = struct.unpack('<I', header)[0]
-                    # print('header ', '0x%x'%header)
-
-                    # 0x1EAF = Encoder Packet
-                    # 0xCAFE = IRIG Packet
-                    # 0xE12A = Error Packet
-
-                    # Encoder
-                    if header == 0x1eaf:
-                        # Make sure the data is the correct length for an Encoder Packet
-                        if not self.check_data_length(0, COUNTER_PACKET_SIZE):
-                            self.log.error('Error 1')
-                            break
-                        # Call the meathod self.parse_counter_info() to parse the Encoder Packet
-                        self.parse_counter_info(self.data[4: COUNTER_PACKET_SIZE])
-                        if len(self.data) >= COUNTER_PACKET_SIZE:
-                            self.data = self.data[COUNTER_PACKET_SIZE:]
-
-                    # IRIG
-                    elif header == 0xcafe:
-                        # Make sure the data is the correct length for an IRIG Packet
-                        if not self.check_data_length(0, IRIG_PACKET_SIZE):
-                            self.log.error('Error 2')
-                            break
-                        # Call the meathod self.parse_irig_info() to parse the IRIG Packet
-                        self.parse_irig_info(self.data[4: IRIG_PACKET_SIZE])
-                        if len(self.data) >= IRIG_PACKET_SIZE:
-                            self.data = self.data[IRIG_PACKET_SIZE:]
-
-                    # Error
-                    # An Error Packet will be sent if there is a timing error in the
-                    # synchronization pulses of the IRIG packet
-                    # If you see 'Packet Error' check to make sure the IRIG is functioning as
-                    # intended and that all the connections are made correctly
-                    elif header == 0xe12a:
-                        self.log.error('Packet Error')
-                        # Clear self.data
-                        self.data = ''
-                    elif header == 0x1234:
-                        self.log.error('Received timeout packet.')
-                        # Clear self.data
-                        self.data = ''
-                    else:
-                        self.log.error('Bad header')
-                        # Clear self.data
-                        self.data = ''
-
-                    if len(self.data) == 0:
-                        break
-                break
-
+        while not self.read_packets(timeout=2):
             # If there is no data from the beaglebone 'Looking for data ...' will print
             # If you see this make sure that the beaglebone has been set up properly
             # print('Looking for data ...')
+            pass
 
-    def parse_counter_info(self, data):
-        """Method to parse the Encoder Packet and put them to counter_queue
+    def read_packets(self, timeout=2):
+        """Waits for a single read from the socket and parses the data
 
         Parameters
         ----------
-        data : str
-           string for the encoder ounter info
+        timeout : float, optional
+           Seconds to wait for data from the beaglebone
+
+        Returns
+        -------
+        bool
+           True if data was received, False if the wait timed out
+
+        """
+        # If there is data from the socket attached to the beaglebone then
+        #     ready[0] = true
+        # If not then continue checking for timeout seconds and if there is still no data
+        #     ready[0] = false
+        ready = select.select([self.sock], [], [], timeout)
+        if not ready[0]:
+            return False
+
+        # Add the data from the socket attached to the beaglebone
+        # to the end of the unparsed data in self.buffer
+        if len(self.buffer) - self._end < self.read_chunk_size:
+            self._compact()
+        self._end += self.sock.recv_into(self._view[self._end:],
+                                         self.read_chunk_size)
+        self.parse_buffer()
+        return True
+
+    def start_receiving(self):
+        """Starts a thread which continuously reads and parses the packets
+        from the beaglebone into counter_queue and irig_queue, independent of
+        how fast the queues are consumed. data_ready is set whenever new data
+        are put to the queues. Unexpected errors stop the thread and are
+        stored in receiver_error.
+        """
+        if self._receiver is not None and self._receiver.is_alive():
+            return
+        self.receiver_error = None
+        self._receiving = True
+        self._receiver = threading.Thread(target=self._receive_loop, daemon=True)
+        self._receiver.start()
+
+    def stop_receiving(self):
+        """Stops the receiver thread started by start_receiving"""
+        self._receiving = False
+        if self._receiver is not None:
+            self._receiver.join()
+            self._receiver = None
+
+    def _receive_loop(self):
+        while self._receiving:
+            try:
+                if self.read_packets(timeout=1):
+                    self.data_ready.set()
+            except OSError as e:
+                self.log.error(f'Failed to read from the socket: {e}')
+                time.sleep(1)
+            except Exception as e:
+                self.log.error(f'Receiver thread stopped by an unexpected error: {e!r}')
+                self.receiver_error = e
+                self.data_ready.set()
+                return
+
+    def _put(self, queue, item, num_packets):
+        """Puts a batch to one of the bounded queues, dropping it if the queue is full"""
+        if len(queue) >= self.max_queue_size:
+            self.num_dropped_packets += num_packets
+            return
+        queue.append(item)
+
+    def get_stats(self):
+        """Returns counters describing the health of the data reception
+
+        Returns
+        -------
+        dict
+           num_counter_packets: total number of received encoder packets
+           num_irig_packets: total number of received IRIG packets
+           num_dropped_packets: total number of packets dropped since a queue was full
+           counter_queue_depth: number of batches waiting in counter_queue
+           irig_queue_depth: number of batches waiting in irig_queue
+
+        """
+        return {'num_counter_packets': self.num_counter_packets,
+                'num_irig_packets': self.num_irig_packets,
+                'num_dropped_packets': self.num_dropped_packets,
+                'counter_queue_depth': len(self.counter_queue),
+                'irig_queue_depth': len(self.irig_queue)}
+
+    def parse_buffer(self):
+        """Parses all complete packets in self.buffer.
+        Incomplete packets at the end of the buffer are kept for the next read.
+        """
+        counter_offsets = []
+        irig_offsets = []
+        pos = self._start
+        end = self._end
+        while pos < end:
+            # Check to make sure that there is at least 1 int in the packet
+            # The first int in every packet should be the header
+            if end - pos < 4:
+                self.log.error('Error 0')
+                break
+
+            # Convert a structure value from the beaglebone (header) to an int
+            header = struct.unpack_from('<I', self.buffer, pos)[0]
+
+            # 0x1EAF = Encoder Packet
+            # 0xCAFE = IRIG Packet
+            # 0xE12A = Error Packet
+
+            # Encoder
+            if header == 0x1eaf:
+                # Make sure the data is the correct length for an Encoder Packet
+                if end - pos < COUNTER_PACKET_SIZE:
+                    self.log.error('Error 1')
+                    break
+                counter_offsets.append(pos)
+                pos += COUNTER_PACKET_SIZE
+
+            # IRIG
+            elif header == 0xcafe:
+                # Make sure the data is the correct length for an IRIG Packet
+                if end - pos < IRIG_PACKET_SIZE:
+                    self.log.error('Error 2')
+                    break
+                irig_offsets.append(pos)
+                pos += IRIG_PACKET_SIZE
+
+            # Error
+            # An Error Packet will be sent if there is a timing error in the
+            # synchronization pulses of the IRIG packet
+            # If you see 'Packet Error' check to make sure the IRIG is functioning as
+            # intended and that all the connections are made correctly
+            # The rest of the data is discarded in these cases.
+            elif header == 0xe12a:
+                self.log.error('Packet Error')
+                pos = end
+            elif header == 0x1234:
+                self.log.error('Received timeout packet.')
+                pos = end
+            else:
+                self.log.error('Bad header')
+                pos = end
+
+        if counter_offsets:
+            self.parse_counter_info(self._gather(counter_offsets, COUNTER_PACKET_DTYPE))
+        if irig_offsets:
+            self.parse_irig_info(self._gather(irig_offsets, IRIG_PACKET_DTYPE))
+
+        if pos == end:
+            self._start = self._end = 0
+        else:
+            self._start = pos
+
+    def parse_counter_info(self, packets):
+        """Method to parse a batch of Encoder Packets and put them to counter_queue
+
+        Parameters
+        ----------
+        packets : numpy.ndarray
+           structured array of the encoder packets with COUNTER_PACKET_DTYPE
 
         Note:
-           'data' structure:
-           (Please note that '150' below might be replaced by COUNTER_INFO_LENGTH)
-           [0] Readout from the quadrature
-           [1-150] clock counts of 150 data points
-           [151-300] corresponding clock overflow of the 150 data points (each overflow count
-           is equal to 2^16 clock counts)
-           [301-450] corresponding absolute number of the 150 data points ((1, 2, 3, etc ...)
-           or (150, 151, 152, etc ...) or (301, 302, 303, etc ...) etc ...)
+           packet structure:
+           (Please note that '120' below might be replaced by COUNTER_INFO_LENGTH)
+           header: 0x1EAF
+           quad: Readout from the quadrature
+           clock: clock counts of 120 data points
+           overflow: corresponding clock overflow of the 120 data points (each overflow count
+           is equal to 2^32 clock counts)
+           index: corresponding absolute number of the 120 data points ((1, 2, 3, etc ...)
+           or (120, 121, 122, etc ...) or (241, 242, 243, etc ...) etc ...)
 
            counter_queue structure:
-           counter_queue = [[64 bit clock counts],
+           counter_queue = [[64 bit clock counts of all packets],
                             [clock count indicese incremented by every edge],
-                            quadrature,
+                            [quadrature of each packet],
                             current system time]
         """
+        self.num_counter_packets += len(packets)
+        counter = packets['clock'].astype(np.int64)
+        counter += packets['overflow'].astype(np.int64) << 32
+        self._put(self.counter_queue,
+                  (counter.ravel(), packets['index'].astype(np.int64).ravel(),
+                   packets['quad'].astype(np.int64), time.time()),
+                  len(packets))
 
-        # Convert the Encoder Packet structure into a numpy array
-        derter = np.array(struct.unpack('<' + 'I' + 'III' * COUNTER_INFO_LENGTH, data))
-
-        # self.quad_queue.append(derter[0].item()) # merged to counter_queue
-        self.counter_queue.append((derter[1:COUNTER_INFO_LENGTH + 1]
-                                   + (derter[COUNTER_INFO_LENGTH + 1:2 * COUNTER_INFO_LENGTH + 1] << 32),
-                                   derter[2 * COUNTER_INFO_LENGTH + 1:3 * COUNTER_INFO_LENGTH + 1],
-                                   derter[0].item(), time.time()))
-
-    def parse_irig_info(self, data):
-        """Method to parse the IRIG Packet and put them to the irig_queue
+    def parse_irig_info(self, packets):
+        """Method to parse a batch of IRIG Packets and put them to the irig_queue
 
         Parameters
         ----------
-        data : str
-           string for the IRIG info
+        packets : numpy.ndarray
+           structured array of the IRIG packets with IRIG_PACKET_DTYPE
 
         Note
         ----
-           'data' structure:
-           [0] clock count of the IRIG Packet which the UTC time corresponds to
-           [1] overflow count of initial rising edge
-           [2] binary encoding of the second data
-           [3] binary encoding of the minute data
-           [4] binary encoding of the hour data
-           [5-11] additional IRIG information which we do mot use
-           [12-21] synchronization pulse clock counts
-           [22-31] overflow count at each synchronization pulse
+           packet structure:
+           header: 0xCAFE
+           rising_edge: clock count of the IRIG Packet which the UTC time corresponds to
+           rising_edge_overflow: overflow count of initial rising edge
+           info[0]: binary encoding of the second data
+           info[1]: binary encoding of the minute data
+           info[2]: binary encoding of the hour data
+           info[3-9]: additional IRIG information which we do mot use
+           synch_pulse: synchronization pulse clock counts
+           synch_pulse_overflow: overflow count at each synchronization pulse
 
            irig_queue structure:
-           irig_queue = [Packet clock count,
-                         Packet UTC time in sec,
-                         [binary encoded IRIG data],
-                         [synch pulses clock counts],
-                         current system time]
+           irig_queue = [[Packet clock count],
+                         [Packet UTC time in sec],
+                         [[binary encoded IRIG data]],
+                         [[synch pulses clock counts]],
+                         current system time,
+                         {decoded IRIG fields: [values]},
+                         fitted clock frequency]
 
         """
-
-        # Convert the IRIG Packet structure into a numpy array
-        unpacked_data = struct.unpack('<L' + 'L' + 'L' * 10 + 'L' * 10 + 'L' * 10, data)
-
-        # Start of the packet clock count
-        # overflow.append(unpacked_data[1])
-        # print "overflow: ", overflow
-
-        rising_edge_time = unpacked_data[0] + (unpacked_data[1] << 32)
+        self.num_irig_packets += len(packets)
+        sys_time = time.time()
+        rising_edge_time = packets['rising_edge'].astype(np.int64)
+        rising_edge_time += packets['rising_edge_overflow'].astype(np.int64) << 32
 
         # Stores IRIG time data
-        irig_info = unpacked_data[2:12]
+        irig_info = packets['info'].astype(np.int64)
 
-        # Prints the time information and returns the current time in seconds
-        irig_time = self.pretty_print_irig_info(irig_info, rising_edge_time)
+        # Decodes the time information of all packets at once
+        fields = decode_irig(irig_info)
+        irig_time = irig2unix(fields)
+        for i in np.flatnonzero(irig_time < 0):
+            self.log.error('Invalid IRIG-B timestamp: '
+                           f'{fields["year"][i]} {fields["day"][i]} {fields["hour"][i]} '
+                           f'{fields["min"][i]} {fields["sec"][i]}')
+
+        # If it is the first time that the data is parsed then set self.start_time
+        # to the current time
+        if self.is_start == 1:
+            self.start_time = [int(fields['hour'][0]), int(fields['min'][0]),
+                               int(fields['sec'][0])]
+            self.is_start = 0
+        self.current_time = int(irig_time[-1])
+
+        # Fits the clock frequency to the rising edges with valid timestamps,
+        # starting over if the clock count was reset
+        for count, t in zip(rising_edge_time[irig_time >= 0].tolist(),
+                            irig_time[irig_time >= 0].tolist()):
+            if self._irig_edges and count <= self._irig_edges[-1][0]:
+                self._irig_edges.clear()
+            self._irig_edges.append((count, t))
+        if len(self._irig_edges) >= 2:
+            self.clock_freq = fit_clock_freq(*zip(*self._irig_edges))
 
         # Stores synch pulse clock counts accounting for overflow of 32 bit counter
-        synch_pulse_clock_times = (np.asarray(unpacked_data[12:22])
-                                   + (np.asarray(unpacked_data[22:32]) << 32)).tolist()
+        synch_pulse_clock_times = packets['synch_pulse'].astype(np.int64)
+        synch_pulse_clock_times += packets['synch_pulse_overflow'].astype(np.int64) << 32
 
-        # self.irig_queue = [Packet clock count,Packet UTC time in sec,
-        #                    [binary encoded IRIG data],[synch pulses clock counts],
-        #                    [current system time]]
-        self.irig_queue.append((rising_edge_time, irig_time, irig_info,
-                                synch_pulse_clock_times, time.time()))
+        self._put(self.irig_queue,
+                  (rising_edge_time, irig_time, irig_info,
+                   synch_pulse_clock_times, sys_time,
+                   {k: v.tolist() for k, v in fields.items()}, self.clock_freq),
+                  len(packets))
 
     def __del__(self):
         self.sock.close()
 
 
+class CounterBuffer:
+    """Preallocated, array-backed accumulator for the encoder counter data
+    waiting to be published
+
+    Attributes
+    ----------
+    num_counter : int
+       number of counter samples in the buffer
+    num_packets : int
+       number of encoder packets in the buffer
+
+    Parameters
+    ----------
+    size : int, optional
+       initial capacity in counter samples. The buffer is enlarged
+       if a batch does not fit.
+
+    """
+
+    def __init__(self, size=2 * NUM_ENCODER_TO_PUBLISH):
+        self._counter = np.zeros(size, dtype=np.int64)
+        self._counter_index = np.zeros(size, dtype=np.int64)
+        self._quad = np.zeros(size // COUNTER_INFO_LENGTH + 1, dtype=np.int64)
+        self._received_time = np.zeros(size // COUNTER_INFO_LENGTH + 1)
+        self.num_counter = 0
+        self.num_packets = 0
+
+    @staticmethod
+    def _fit(array, size):
+        if size <= len(array):
+            return array
+        new_array = np.zeros(max(size, 2 * len(array)), dtype=array.dtype)
+        new_array[:len(array)] = array
+        return new_array
+
+    def append(self, counter, counter_index, quad, sys_time):
+        """Copies a batch from EncoderParser.counter_queue into the buffer
+
+        Parameters
+        ----------
+        counter : numpy.ndarray
+           64 bit clock counts
+        counter_index : numpy.ndarray
+           clock count indices
+        quad : numpy.ndarray
+           quadrature of each packet
+        sys_time : float
+           system time when the batch was received
+
+        """
+        n0, n1 = self.num_counter, self.num_counter + len(counter)
+        p0, p1 = self.num_packets, self.num_packets + len(quad)
+        self._counter = self._fit(self._counter, n1)
+        self._counter_index = self._fit(self._counter_index, n1)
+        self._quad = self._fit(self._quad, p1)
+        self._received_time = self._fit(self._received_time, p1)
+
+        self._counter[n0:n1] = counter
+        self._counter_index[n0:n1] = counter_index
+        self._quad[p0:p1] = quad
+        self._received_time[p0:p1] = sys_time
+        self.num_counter, self.num_packets = n1, p1
+
+    def clear(self):
+        """Empties the buffer, keeping the allocated memory"""
+        self.num_counter = 0
+        self.num_packets = 0
+
+    @property
+    def counter(self):
+        return self._counter[:self.num_counter]
+
+    @property
+    def counter_index(self):
+        return self._counter_index[:self.num_counter]
+
+    @property
+    def quad(self):
+        return self._quad[:self.num_packets]
+
+    @property
+    def received_time(self):
+        return self._received_time[:self.num_packets]
+
+
 class HWPBBBAgent:
     """OCS agent for HWP encoder DAQ using Beaglebone Black
 
@@ -483,6 +699,9 @@ class HWPBBBAgent:
        saved for calculating the beaglebone clock frequency
     irig_time : int
        unix timestamp from IRIG
+    clock_freq : float
+       latest fit of the beaglebone clock frequency, used to convert the
+       encoder clock counts to time
 
     """
 
@@ -497,6 +716,7 @@ class HWPBBBAgent:
         # For clock count to time conversion
         self.rising_edge_count = 0
         self.irig_time = 0
+        self.clock_freq = BBB_CLOCK_FREQ
 
         self.last_quad = None
         self.last_quad_time = None
@@ -509,6 +729,93 @@ class HWPBBBAgent:
                                  agg_params=agg_params)
         self.parser = EncoderParser(beaglebone_port=self.port)
 
+    def _publish_irig(self, rising_edge_count, irig_time, irig_info,
+                      synch_pulse_clock_counts, sys_time, fields):
+        """Publishes the decoded and raw info of a single IRIG packet"""
+        data = {'timestamp': sys_time, 'block_name': 'HWPEncoder_irig', 'data': {}}
+        data['data']['irig_time'] = irig_time
+        data['data']['rising_edge_count'] = rising_edge_count
+        data['data']['irig_sec'] = fields['sec']
+        data['data']['irig_min'] = fields['min']
+        data['data']['irig_hour'] = fields['hour']
+        data['data']['irig_day'] = fields['day']
+        data['data']['irig_year'] = fields['year']
+
+        # Beagleboneblack clock frequency measured by IRIG
+        if self.rising_edge_count > 0 and irig_time > 0:
+            bbb_clock_freq = float(rising_edge_count - self.rising_edge_count) \
+                / (irig_time - self.irig_time)
+        else:
+            bbb_clock_freq = 0.
+        data['data']['bbb_clock_freq'] = bbb_clock_freq
+
+        self.agent.publish_to_feed('HWPEncoder', data)
+        self.rising_edge_count = rising_edge_count
+        self.irig_time = irig_time
+
+        # saving clock counts for every refernce edge and every irig bit info
+        data = {'timestamps': [], 'block_name': 'HWPEncoder_irig_raw', 'data': {}}
+        # 0.09: time difference in seconds b/w reference marker and
+        #       the first index marker
+        data['timestamps'] = sys_time + 0.09 + np.arange(10) * 0.1
+        data['data']['irig_synch_pulse_clock_time'] = list(irig_time + 0.09
+                                                           + np.arange(10) * 0.1)
+        data['data']['irig_synch_pulse_clock_counts'] = synch_pulse_clock_counts
+        data['data']['irig_info'] = list(irig_info)
+        self.agent.publish_to_feed('HWPEncoder', data)
+
+    def _publish_counter(self, counter_buffer):
+        """Publishes the encoder data accumulated in a CounterBuffer"""
+        counter = counter_buffer.counter
+        counter_index = counter_buffer.counter_index
+        received_time = counter_buffer.received_time
+
+        # Publishing quadratic data first
+        data = {'timestamps': [], 'block_name': 'HWPEncoder_quad', 'data': {}}
+        data['timestamps'] = received_time.tolist()
+        data['data']['quad'] = counter_buffer.quad.tolist()
+        self.agent.publish_to_feed('HWPEncoder', data)
+        self.last_quad = data['data']['quad'][-1]
+        self.last_quad_time = time.time()
+
+        # Publishing counter data
+        # (full sampled data will not be recorded in influxdb)
+        timestamps = count2time(counter, received_time[0], clock_freq=self.clock_freq)
+        data = {'timestamps': timestamps.tolist(), 'block_name': 'HWPEncoder_counter',
+                'data': {}}
+        data['data']['counter'] = counter.tolist()
+        data['data']['counter_index'] = counter_index.tolist()
+        self.agent.publish_to_feed('HWPEncoder_full', data)
+
+        # Subsampled data for influxdb display
+        data_subsampled = {'block_name': 'HWPEncoder_counter_sub', 'data': {}}
+        data_subsampled['timestamps'] = timestamps[::NUM_SUBSAMPLE].tolist()
+        data_subsampled['data']['counter_sub'] = counter[::NUM_SUBSAMPLE].tolist()
+        data_subsampled['data']['counter_index_sub'] = counter_index[::NUM_SUBSAMPLE].tolist()
+        self.agent.publish_to_feed('HWPEncoder', data_subsampled)
+
+        # For rough estimation of HWP rotation frequency
+        data = {'timestamp': received_time[0].item(),
+                'block_name': 'HWPEncoder_freq', 'data': {}}
+        dclock_counter = counter[-1] - counter[0]
+        dindex_counter = counter_index[-1] - counter_index[0]
+        pulse_rate = dindex_counter * self.clock_freq / dclock_counter
+        hwp_freq = float(pulse_rate / 2. / NUM_SLITS)
+
+        diff_counter = np.diff(counter)
+        diff_index = np.diff(counter_index)
+
+        self.log.debug(f'pulse_rate {pulse_rate} {hwp_freq}')
+        data['data']['approx_hwp_freq'] = hwp_freq
+        data['data']['diff_counter_mean'] = np.mean(diff_counter)
+        data['data']['diff_index_mean'] = np.mean(diff_index)
+        data['data']['diff_counter_std'] = np.std(diff_counter)
+        data['data']['diff_index_std'] = np.std(diff_index)
+        self.agent.publish_to_feed('HWPEncoder', data)
+
+        # Update session.data
+        self.hwp_freq = hwp_freq
+
     def acq(self, session, params):
         """acq()
 
@@ -516,11 +823,7 @@ class HWPBBBAgent:
 
         """
         time_encoder_published = 0
-        counter_list = []
-        counter_index_list = []
-        quad_list = []
-        quad_counter_list = []
-        received_time_list = []
+        counter_buffer = CounterBuffer()
 
         with self.lock.acquire_timeout(timeout=0, job='acq') as acquired:
             if not acquired:
@@ -542,139 +845,74 @@ class HWPBBBAgent:
                 'irig_last_updated': self.ct,
             }
 
-            while self.take_data:
-                # This is blocking until data are available
-                self.parser.grab_and_parse_data()
-
-                # IRIG data; normally every sec
-                while len(self.parser.irig_queue):
-                    irig_data = self.parser.irig_queue.popleft()
-                    rising_edge_count = irig_data[0]
-                    irig_time = irig_data[1]
-                    irig_info = irig_data[2]
-                    synch_pulse_clock_counts = irig_data[3]
-                    sys_time = irig_data[4]
-                    data = {'timestamp': sys_time, 'block_name': 'HWPEncoder_irig', 'data': {}}
-                    data['data']['irig_time'] = irig_time
-                    data['data']['rising_edge_count'] = rising_edge_count
-                    data['data']['irig_sec'] = de_irig(irig_info[0], 1)
-                    data['data']['irig_min'] = de_irig(irig_info[1], 0)
-                    data['data']['irig_hour'] = de_irig(irig_info[2], 0)
-                    data['data']['irig_day'] = de_irig(irig_info[3], 0) \
-                        + de_irig(irig_info[4], 0) * 100
-                    data['data']['irig_year'] = de_irig(irig_info[5], 0)
-
-                    # Beagleboneblack clock frequency measured by IRIG
-                    if self.rising_edge_count > 0 and irig_time > 0:
-                        bbb_clock_freq = float(rising_edge_count - self.rising_edge_count) \
-                            / (irig_time - self.irig_time)
-                    else:
-                        bbb_clock_freq = 0.
-                    data['data']['bbb_clock_freq'] = bbb_clock_freq
-
-                    self.agent.publish_to_feed('HWPEncoder', data)
-                    self.rising_edge_count = rising_edge_count
-                    self.irig_time = irig_time
-
-                    # saving clock counts for every refernce edge and every irig bit info
-                    data = {'timestamps': [], 'block_name': 'HWPEncoder_irig_raw', 'data': {}}
-                    # 0.09: time difference in seconds b/w reference marker and
-                    #       the first index marker
-                    data['timestamps'] = sys_time + 0.09 + np.arange(10) * 0.1
-                    data['data']['irig_synch_pulse_clock_time'] = list(irig_time + 0.09
-                                                                       + np.arange(10) * 0.1)
-                    data['data']['irig_synch_pulse_clock_counts'] = synch_pulse_clock_counts
-                    data['data']['irig_info'] = list(irig_info)
-                    self.agent.publish_to_feed('HWPEncoder', data)
-
-                    data_cache['irig_time'] = self.irig_time
-                    data_cache['irig_last_updated'] = sys_time
-                    session.data.update(data_cache)
-
-                # Reducing the packet size, less frequent publishing
-                # Encoder data; packet coming rate = 570*2*2/150/4 ~ 4Hz packet at 2 Hz rotation
-                while len(self.parser.counter_queue):
-                    counter_data = self.parser.counter_queue.popleft()
-
-                    counter_list += counter_data[0].tolist()
-                    counter_index_list += counter_data[1].tolist()
-
-                    quad_data = counter_data[2]
-                    sys_time = counter_data[3]
+            # Packets are received in a separate thread so that
+            # publishing does not block the reception
+            self.parser.start_receiving()
+            time_health_published = time.time()
+            num_packets_published = 0
+
+            try:
+                while self.take_data:
+                    # Wait for the receiver thread to put data to the queues
+                    self.parser.data_ready.wait(timeout=1)
+                    self.parser.data_ready.clear()
+                    if self.parser.receiver_error is not None:
+                        break
 
-                    received_time_list.append(sys_time)
-                    quad_list.append(quad_data)
-                    quad_counter_list.append(counter_data[0][0])
+                    # IRIG data; normally every sec
+                    while len(self.parser.irig_queue):
+                        irig_batch = self.parser.irig_queue.popleft()
+                        sys_time, fields, self.clock_freq = irig_batch[4:]
+                        for i, (rising_edge_count, irig_time, irig_info, synch_pulse_clock_counts) \
+                                in enumerate(zip(*[x.tolist() for x in irig_batch[:4]])):
+                            self._publish_irig(rising_edge_count, irig_time, irig_info,
+                                               synch_pulse_clock_counts, sys_time,
+                                               {k: v[i] for k, v in fields.items()})
+
+                        data_cache['irig_time'] = self.irig_time
+                        data_cache['irig_last_updated'] = sys_time
+                        session.data.update(data_cache)
+
+                    # Reducing the packet size, less frequent publishing
+                    # Encoder data; packet coming rate = 570*2*2/150/4 ~ 4Hz packet at 2 Hz rotation
+                    while len(self.parser.counter_queue):
+                        counter_buffer.append(*self.parser.counter_queue.popleft())
+                        ct = time.time()
+
+                        if counter_buffer.num_counter >= NUM_ENCODER_TO_PUBLISH \
+                           or (counter_buffer.num_counter
+                               and (ct - time_encoder_published) > SEC_ENCODER_TO_PUBLISH):
+                            self._publish_counter(counter_buffer)
+                            counter_buffer.clear()
+
+                            time_encoder_published = ct
+                            self.ct = ct
+
+                    # Health of the data reception
                     ct = time.time()
-
-                    if len(counter_list) >= NUM_ENCODER_TO_PUBLISH \
-                       or (len(counter_list)
-                           and (ct - time_encoder_published) > SEC_ENCODER_TO_PUBLISH):
-                        # Publishing quadratic data first
-                        data = {'timestamps': [], 'block_name': 'HWPEncoder_quad', 'data': {}}
-                        data['timestamps'] = received_time_list
-                        data['data']['quad'] = quad_list
+                    if ct - time_health_published >= SEC_HEALTH_TO_PUBLISH:
+                        stats = self.parser.get_stats()
+                        num_packets = stats['num_counter_packets'] + stats['num_irig_packets']
+                        stats['packet_rate'] = (num_packets - num_packets_published) \
+                            / (ct - time_health_published)
+                        data = {'timestamp': ct, 'block_name': 'HWPEncoder_health',
+                                'data': stats}
                         self.agent.publish_to_feed('HWPEncoder', data)
-                        if quad_list:
-                            self.last_quad = quad_list[-1]
-                            self.last_quad_time = time.time()
-
-                        # Publishing counter data
-                        # (full sampled data will not be recorded in influxdb)
-                        data = {'timestamps': [], 'block_name': 'HWPEncoder_counter', 'data': {}}
-                        data['data']['counter'] = counter_list
-                        data['data']['counter_index'] = counter_index_list
-
-                        data['timestamps'] = count2time(counter_list, received_time_list[0])
-                        self.agent.publish_to_feed('HWPEncoder_full', data)
-
-                        # Subsampled data for influxdb display
-                        data_subsampled = {'block_name': 'HWPEncoder_counter_sub', 'data': {}}
-                        data_subsampled['timestamps'] = np.array(data['timestamps'])[::NUM_SUBSAMPLE].tolist()
-                        data_subsampled['data']['counter_sub'] = np.array(counter_list)[::NUM_SUBSAMPLE].tolist()
-                        data_subsampled['data']['counter_index_sub'] = np.array(counter_index_list)[::NUM_SUBSAMPLE].tolist()
-                        self.agent.publish_to_feed('HWPEncoder', data_subsampled)
-
-                        # For rough estimation of HWP rotation frequency
-                        data = {'timestamp': received_time_list[0],
-                                'block_name': 'HWPEncoder_freq', 'data': {}}
-                        dclock_counter = counter_list[-1] - counter_list[0]
-                        dindex_counter = counter_index_list[-1] - counter_index_list[0]
-                        # Assuming Beagleboneblack clock is 200 MHz
-                        pulse_rate = dindex_counter * 2.e8 / dclock_counter
-                        hwp_freq = pulse_rate / 2. / NUM_SLITS
-
-                        diff_counter = np.diff(counter_list)
-                        diff_index = np.diff(counter_index_list)
-
-                        self.log.debug(f'pulse_rate {pulse_rate} {hwp_freq}')
-                        data['data']['approx_hwp_freq'] = hwp_freq
-                        data['data']['diff_counter_mean'] = np.mean(diff_counter)
-                        data['data']['diff_index_mean'] = np.mean(diff_index)
-                        data['data']['diff_counter_std'] = np.std(diff_counter)
-                        data['data']['diff_index_std'] = np.std(diff_index)
-                        self.agent.publish_to_feed('HWPEncoder', data)
-
-                        # Initialize lists
-                        counter_list = []
-                        counter_index_list = []
-                        quad_list = []
-                        quad_counter_list = []
-                        received_time_list = []
-
-                        time_encoder_published = ct
+                        time_health_published = ct
+                        num_packets_published = num_packets
 
-                        # Update session.data
-                        self.hwp_freq = hwp_freq
-                        self.ct = ct
-
-                data_cache['approx_hwp_freq'] = self.hwp_freq
-                data_cache['encoder_last_updated'] = self.ct
-                data_cache['last_quad'] = self.last_quad
-                data_cache['last_quad_time'] = self.last_quad_time
-                session.data.update(data_cache)
+                    data_cache['approx_hwp_freq'] = self.hwp_freq
+                    data_cache['encoder_last_updated'] = self.ct
+                    data_cache['last_quad'] = self.last_quad
+                    data_cache['last_quad_time'] = self.last_quad_time
+                    session.data.update(data_cache)
+            finally:
+                self.parser.stop_receiving()
 
         self.agent.feeds['HWPEncoder'].flush_buffer()
+        if self.parser.receiver_error is not None:
+            self.take_data = False
+            return False, f'Receiver thread failed: {self.parser.receiver_error!r}'
         return True, 'Acquisition exited cleanly.'
 
     def _stop_acq(self, session, params=None):
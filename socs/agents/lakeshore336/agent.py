@@ -10,6 +10,7 @@ import numpy as np
 from ocs import ocs_agent, site_config
 from ocs.ocs_twisted import TimeoutLock
 
+from socs.common.ring_buffer import RingBuffer
 from socs.Lakeshore.Lakeshore336 import LS336
 
 
@@ -60,8 +61,9 @@ class LS336_Agent:
         The amount of time (in s) over which the difference between the
         setpoint and the current temperature must not exceed threshold
         while checking for temperature stability.
-    _recent_temps: numpy array, protected
-        Array of recent temperatures for checking temperature stability
+    _recent_temps: RingBuffer, protected
+        Recent temperatures of all channels, collected by acq, for checking
+        temperature stability
     _static_setpoint: float, protected
         The final setpoint value to avoid issues when the setpoint is
         ramping to a new value. Used in checking temperature stability
@@ -168,8 +170,16 @@ class LS336_Agent:
                              "Channel_D_T": (some value)
                              "Channel_D_V": (some value)
                             }
+                   },
+                "ls336_comm_stats":
+                   {"reconnects": 0,
+                    "latency_bins": [0.005, 0.01, ...],
+                    "commands": {"KRDG?": {"count": 12, ...}, ...}
                    }
                }
+
+            See :meth:`socs.Lakeshore.transport.LakeshoreTransport.get_stats`
+            for the contents of "ls336_comm_stats".
         """
         if params is None:
             params = {}
@@ -192,15 +202,14 @@ class LS336_Agent:
 
             session.set_status('running')
 
-            # initialize recent temps array
-            # shape is N_points x N_channels
+            # initialize recent temps buffer
+            # holds N_points samples of N_channels temperatures
             # N_points is 2 hour / t_sample rounded up
             # N_channels is 8 if the extra scanner is installed, 4 otherwise
             # t_sample can't be more than 2 hours
             N_channels = len(self.module.channels)
-            self._recent_temps = np.full(
-                (int(np.ceil(7200 / self.t_sample)), N_channels), -1.0)
-            print(self._recent_temps.size)
+            self._recent_temps = RingBuffer(int(np.ceil(7200 / self.t_sample)),
+                                            shape=(N_channels,))
 
             # acquire data from Lakeshore
             self.take_data = True
@@ -222,9 +231,8 @@ class LS336_Agent:
                     temperatures_message['data'][channel_str
                                                  + '_V'] = voltages[i]
 
-                # append to recent temps array for temp stability check
-                self._recent_temps = np.roll(self._recent_temps, 1, axis=0)
-                self._recent_temps[0] = temps
+                # append to recent temps buffer for temp stability check
+                self._recent_temps.append(current_time, temps)
 
                 # publish to feed
                 self.agent.publish_to_feed(
@@ -234,6 +242,9 @@ class LS336_Agent:
                 # if in use at same time.
                 session.data['ls336_fields'] = temperatures_message
 
+                # Latency and error counters of the connection
+                session.data['ls336_comm_stats'] = self.module.com.get_stats()
+
                 # get heater data
                 heaters_message = {
                     'timestamp': current_time,
@@ -243,14 +254,15 @@ class LS336_Agent:
 
                 for i, heater in enumerate(self.module.heaters.values()):
                     heater_str = heater.output_name.replace(' ', '_')
+                    status = heater.get_status()
                     heaters_message['data'][
-                        heater_str + '_Percent'] = heater.get_heater_percent()
+                        heater_str + '_Percent'] = status['percent']
                     heaters_message['data'][
-                        heater_str + '_Range'] = heater.get_heater_range()
+                        heater_str + '_Range'] = status['range']
                     heaters_message['data'][
-                        heater_str + '_Max_Current'] = heater.get_max_current()
+                        heater_str + '_Max_Current'] = status['max_current']
                     heaters_message['data'][
-                        heater_str + '_Setpoint'] = heater.get_setpoint()
+                        heater_str + '_Setpoint'] = status['setpoint']
 
                 # publish to feed
                 self.agent.publish_to_feed('temperatures', heaters_message)
@@ -903,7 +915,9 @@ class LS336_Agent:
 
         Param 'window' sets the lookback time into the most recent
         temperature data, in seconds. Note that this function grabs the most
-        recent data in one window-length of time; it does not take new data.
+        recent data in one window-length of time, as collected by the 'acq'
+        process; it does not take new data. If 'acq' has not been collecting
+        data for a whole window, the temperature is not considered stable.
 
         If you want to use the result of this task for making logical decisions
         in a client (e.g. waiting longer before starting a process if the
@@ -924,7 +938,6 @@ class LS336_Agent:
         window = params.get('window')
         if window is None:
             window = self.window
-        num_idxs = int(np.ceil(window / self.t_sample))
 
         with self._lock.acquire_timeout(job='check_temperature_stability',
                                         timeout=3) as acquired:
@@ -940,21 +953,27 @@ class LS336_Agent:
             heater_key = params.get('heater', '2')  # default to 50W output
             heater = self.module.heaters[heater_key]
 
-            # get channel
-            channel = heater.get_input_channel()
-            channel_num = self.module.channels[channel].num
+            # get channel, as last read or set, without querying the 336
+            channel_num = self.module.channels[heater.input].num
 
-            # get current temp
-            current_temp = np.round(self.module.get_kelvin(channel), 4)
-
-            # check if recent temps and current temps are within threshold
-            _recent_temps = self._recent_temps[:num_idxs, channel_num - 1]
-            _recent_temps = np.concatenate(
-                (np.array([current_temp]), _recent_temps))
+            # check if recent temps collected by acq are within threshold
+            now = time.time()
+            if self._recent_temps is None:
+                _recent_temps = []
+            else:
+                _recent_temps = self._recent_temps.get(
+                    window=window, now=now)[1][:, channel_num - 1]
+            if not len(_recent_temps) \
+                    or self._recent_temps.oldest > now - window:
+                session.add_message(
+                    f'Not enough temperature data in the last {window}s, '
+                    f'acq must be running to check stability')
+                return False, (f'Servo temperature is not stable within '
+                               f'{threshold}K of setpoint')
 
             # get static setpoint if None
             if self._static_setpoint is None:
-                self._static_setpoint = heater.get_setpoint()
+                self._static_setpoint = heater.setpoint
 
             # avoids checking against the ramping setpoint,
             # i.e. want to compare to commanded setpoint not mid-ramp setpoint
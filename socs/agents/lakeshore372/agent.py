@@ -12,6 +12,7 @@ from ocs import ocs_agent, site_config
 from ocs.ocs_twisted import Pacemaker, TimeoutLock
 from twisted.internet import reactor
 
+from socs.common.ring_buffer import RingBuffer
 from socs.Lakeshore.Lakeshore372 import LS372
 
 
@@ -119,6 +120,11 @@ class LS372_Agent:
         self.module = None
         self.thermometers = []
 
+        # Recent temperature readings of each channel, collected by acq and
+        # used by check_temperature_stability.
+        self._recent_temps = {}
+        self._last_channel = None
+
         self.log = agent.log
         self.initialized = False
         self.take_data = False
@@ -215,6 +221,9 @@ class LS372_Agent:
                 print("Initialized Lakeshore module: {!s}".format(self.module))
                 session.add_message("Lakeshore initilized with ID: %s" % self.module.id)
 
+                # Load the configuration of all channels in a few compound
+                # queries, rather than one channel at a time on first use.
+                self.module.load_channels()
                 self.thermometers = [channel.name for channel in self.module.channels]
 
             self.initialized = True
@@ -253,9 +262,20 @@ class LS372_Agent:
                      "Channel_01": {"T": 293.41, "R": 108.093, "timestamp": 1601924450.9315426},
                      "Channel_02": {"T": 293.701, "R": 30.7398, "timestamp": 1601924466.6130798},
                      "control": {"T": 293.701, "R": 30.7398, "timestamp": 1601924466.6130798}
+                    },
+                 "comm_stats":
+                    {"reconnects": 0,
+                     "latency_bins": [0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0],
+                     "commands": {"SCAN?;KRDG?;SRDG?": {"count": 12, "timeouts": 0, "errors": 0,
+                                                        "latency_mean": 0.011, "latency_max": 0.016,
+                                                        "latency_hist": [0, 3, 9, 0, 0, 0, 0, 0, 0, 0, 0]},
+                                  ...}
                     }
                 }
 
+            See :meth:`socs.Lakeshore.transport.LakeshoreTransport.get_stats`
+            for the contents of "comm_stats".
+
         """
         pm = Pacemaker(10, quantize=True)
 
@@ -278,6 +298,13 @@ class LS372_Agent:
 
             session.data = {"fields": {}}
 
+            def read_sample(channel):
+                chans = [] if channel is None else [channel.channel_num]
+                if self.control_chan_enabled:
+                    chans.append(0)
+                return self.module.get_scan_readings(
+                    chans, heater=params.get("sample_heater", False))
+
             self.take_data = True
             while self.take_data:
                 pm.sleep()
@@ -302,7 +329,11 @@ class LS372_Agent:
                     time.sleep(.1)
 
                 else:
-                    active_channel = self.module.get_active_channel()
+                    # Read the scanner state, the channel we expect it to be
+                    # on, the control channel and the sample heater with a
+                    # single compound query.
+                    sample = read_sample(previous_channel)
+                    active_channel = sample['channel']
 
                     # The 372 reports the last updated measurement repeatedly
                     # during the "pause change time", this results in several
@@ -312,12 +343,13 @@ class LS372_Agent:
                     # enabled.)
                     if previous_channel != active_channel:
                         if previous_channel is not None:
+                            # Pause and dwell both come from one INSET? query.
                             pause_time = active_channel.get_pause()
                             self.log.debug("Pause time for {c}: {p}",
                                            c=active_channel.channel_num,
                                            p=pause_time)
 
-                            dwell_time = active_channel.get_dwell()
+                            dwell_time = active_channel.dwell
                             self.log.debug("User set dwell_time_delay: {p}",
                                            p=self.dwell_time_delay)
 
@@ -344,6 +376,10 @@ class LS372_Agent:
                         # Track the last channel we measured
                         previous_channel = self.module.get_active_channel()
 
+                    # Re-read if the scanner is not on the expected channel.
+                    if active_channel.channel_num not in sample['readings']:
+                        sample = read_sample(active_channel)
+
                     current_time = time.time()
                     data = {
                         'timestamp': current_time,
@@ -353,10 +389,8 @@ class LS372_Agent:
 
                     # Collect both temperature and resistance values from each Channel
                     channel_str = active_channel.name.replace(' ', '_')
-                    temp_reading = self.module.get_temp(unit='kelvin',
-                                                        chan=active_channel.channel_num)
-                    res_reading = self.module.get_temp(unit='ohms',
-                                                       chan=active_channel.channel_num)
+                    temp_reading, res_reading = \
+                        sample['readings'][active_channel.channel_num]
 
                     # For data feed
                     data['data'][channel_str + '_T'] = temp_reading
@@ -370,10 +404,17 @@ class LS372_Agent:
                                                 "timestamp": current_time}}
                     session.data['fields'].update(field_dict)
 
+                    # For check_temperature_stability, keeping the last 10
+                    # minutes of readings at the 10 Hz acq rate
+                    chan = active_channel.channel_num
+                    if chan not in self._recent_temps:
+                        self._recent_temps[chan] = RingBuffer(6000)
+                    self._recent_temps[chan].append(current_time, temp_reading)
+                    self._last_channel = chan
+
                     # Also queries control channel if enabled
                     if self.control_chan_enabled:
-                        temp = self.module.get_temp(unit='kelvin', chan=0)
-                        res = self.module.get_temp(unit='ohms', chan=0)
+                        temp, res = sample['readings'][0]
                         cur_time = time.time()
                         data = {
                             'timestamp': time.time(),
@@ -392,10 +433,16 @@ class LS372_Agent:
                             }
                         })
 
+                    # Latency and error counters of the connection
+                    session.data['comm_stats'] = self.module.com.get_stats()
+
                 if params.get("sample_heater", False):
                     # Sample Heater
-                    heater = self.module.sample_heater
-                    hout = heater.get_sample_heater_output()
+                    if self.fake_data:
+                        heater = self.module.sample_heater
+                        hout = heater.get_sample_heater_output()
+                    else:
+                        hout = sample['heater']
 
                     current_time = time.time()
                     htr_data = {
@@ -1121,6 +1168,12 @@ class LS372_Agent:
             threshold (float): amount within which the average needs to be to
                 the setpoint for stability
 
+        Notes:
+            The measurements are the most recent readings of the active
+            channel taken by the acq Process, which must be running. No new
+            readings are taken, and readings older than the time acq takes
+            to make the measurements (plus a second) are not used.
+
         """
         with self._lock.acquire_timeout(job='check_temp_stability') as acquired:
             if not acquired:
@@ -1135,11 +1188,19 @@ class LS372_Agent:
             if params is None:
                 params = {'measurements': 10, 'threshold': 0.5e-3}
 
+            # acq reads at 10 Hz, allow a second for delays
+            window = params['measurements'] / 10 + 1.
             test_temps = []
-
-            for i in range(params['measurements']):
-                test_temps.append(self.module.get_temp())
-                time.sleep(.1)  # sampling rate is 10 readings/sec, so wait 0.1 s for a new reading
+            recent_temps = self._recent_temps.get(self._last_channel)
+            if self.take_data and recent_temps is not None:
+                test_temps = recent_temps.get(window=window, now=time.time(),
+                                              samples=params['measurements'])[1]
+
+            if len(test_temps) < params['measurements']:
+                session.add_message(f'Only {len(test_temps)} of {params["measurements"]} '
+                                    f'measurements from the last {window} s available, '
+                                    'acq must be running to check stability.')
+                return False, f"Temperature not stable within {params['threshold']}."
 
             mean = np.mean(test_temps)
             session.add_message(f'Average of {params["measurements"]} measurements is {mean} K.')
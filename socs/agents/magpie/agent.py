@@ -2,7 +2,10 @@ import argparse
 import ast
 import os
 import queue
+import threading
 import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import so3g  # noqa: F401
@@ -15,12 +18,28 @@ from spt3g import core
 MAX_CHANS = 4096
 CHANS_PER_BAND = 512
 pA_per_rad = 9e6 / (2 * np.pi)
+# Conversion from SMuRF phase units to radians
+rad_per_phase = 2 * np.pi / 2**16
 
 
 # Map from primary key-names to their index in the SuperTimestream
 # This will be populated when the first frame comes in
 primary_idxs = {}
 
+# Map from number of channels to the list of G3TimestreamMap keys of the
+# readout channels, so they don't need to be formatted for every frame
+timestream_keys = {}
+
+
+def get_timestream_keys(nchans):
+    """
+    Returns the G3TimestreamMap keys ``r0000``, ``r0001``, ... for
+    ``nchans`` readout channels.
+    """
+    if nchans not in timestream_keys:
+        timestream_keys[nchans] = [f'r{i:0>4}' for i in range(nchans)]
+    return timestream_keys[nchans]
+
 
 def load_frame_data(frame):
     """
@@ -44,16 +63,78 @@ def load_frame_data(frame):
     d = frame['data']
     if isinstance(d, core.G3TimestreamMap):
         nchans, nsamps = len(d), d.n_samples
-        data = np.ndarray((nchans, nsamps), dtype=np.float32)
-        for i in range(nchans):
-            data[i] = d[f'r{i:0>4}'] * (2 * np.pi) / 2**16
+        keys = get_timestream_keys(nchans)
+        if hasattr(d, 'data') and d.names == keys:
+            # Bulk conversion of the whole map, which is a view of the
+            # underlying buffer if the map is compact
+            data = np.multiply(d.data, rad_per_phase, dtype=np.float32)
+        else:
+            data = np.empty((nchans, nsamps), dtype=np.float32)
+            for i, k in enumerate(keys):
+                data[i] = d[k]
+            data *= rad_per_phase
 
     else:  # G3SuperTimestream probably
-        data = d.data * (2 * np.pi) / 2**16
+        data = np.multiply(d.data, rad_per_phase)
 
     return times, data
 
 
+def pack_frames(times, data):
+    """
+    Packs a block of lyrebird samples into a single G3Frame. This is much
+    cheaper to create and pass between threads than one frame per sample and
+    data-index. Use ``unpack_frames`` to recover the lyrebird frames.
+
+    Args
+    ----
+    times : np.ndarray
+        Array with shape (nsamps) of timestamps (sec)
+    data : List[np.ndarray]
+        List of arrays with shape (nsamps, nelems). The position in the list
+        is used as the lyrebird data-index.
+
+    Returns
+    --------
+    frame : G3Frame
+        Scan frame containing the whole block
+    """
+    fr = core.G3Frame(core.G3FrameType.Scan)
+    fr['block_nidxs'] = len(data)
+    fr['block_times'] = core.G3VectorDouble(times)
+    fr['block_data'] = core.G3VectorDouble(np.ravel(data))
+    fr['timestamp'] = core.G3Time(times[0] * core.G3Units.s)
+    return fr
+
+
+def unpack_frames(frame):
+    """
+    Generator which yields the lyrebird frames contained in a frame created
+    by ``pack_frames``, in the same order as they would be sent if they were
+    created individually. Frames that are not packed are yielded as is.
+
+    Args
+    ----
+    frame : G3Frame
+        Frame to unpack
+    """
+    if 'block_nidxs' not in frame:
+        yield frame
+        return
+
+    nidxs = frame['block_nidxs']
+    times = np.array(frame['block_times'])
+    data = np.array(frame['block_data']).reshape(nidxs, len(times), -1)
+    for i, t in enumerate(times):
+        ts = core.G3Time(t * core.G3Units.s)
+        for idx in range(nidxs):
+            fr = core.G3Frame(core.G3FrameType.Scan)
+            fr['idx'] = idx
+            fr['data'] = core.G3VectorDouble(data[idx, i])
+            fr['timestamp'] = ts
+            yield fr
+
+
 def sleep_while_running(duration, session, interval=1):
     """
     Sleeps for a certain duration as long as a session object's status is
@@ -97,17 +178,28 @@ class FIRFilter:
         self.a = a
         self.z = np.zeros((nchans, len(b) - 1))
 
-    def lfilt(self, data, in_place=True):
-        """Filters data in place"""
-        n = len(data)
+    def lfilt(self, data, in_place=True, chans=None):
+        """
+        Filters data in place
+
+        Args
+        ----
+        data : np.ndarray
+            Array with shape (nchans, nsamps) to filter
+        in_place : bool
+            If False, filtered data is returned instead of written to data
+        chans : np.ndarray, optional
+            Channel indices of the rows of data, used to select the filter
+            state. If None, rows are assumed to be channels 0 to nchans-1.
+        """
+        if chans is None:
+            chans = slice(0, len(data))
+        d, self.z[chans] = signal.lfilter(
+            self.b, self.a, data, axis=1, zi=self.z[chans]
+        )
         if in_place:
-            data[:, :], self.z[:n] = signal.lfilter(
-                self.b, self.a, data, axis=1, zi=self.z[:n]
-            )
+            data[:, :] = d
         else:
-            d, self.z[:n] = signal.lfilter(
-                self.b, self.a, data, axis=1, zi=self.z[:n]
-            )
             return d
 
     @classmethod
@@ -199,10 +291,20 @@ class Demodulator:
         self.lp_sin = FIRFilter.butter_lowpass(bw, fs)
         self.lp_cos = FIRFilter.butter_lowpass(bw, fs)
 
-    def apply(self, times, data):
+    def apply(self, times, data, chans=None):
         """
         Applies demodulation to data segment.
 
+        Args
+        ----
+        times : np.ndarray
+            Array with shape (nsamps) of timestamps (sec)
+        data : np.ndarray
+            Array with shape (nchans, nsamps) of data
+        chans : np.ndarray, optional
+            Channel indices of the rows of data, used to keep filter state
+            per channel. See ``FIRFilter.lfilt``.
+
         Returns
         --------
         demod : np.ndarray
@@ -213,8 +315,10 @@ class Demodulator:
         cos = np.cos(2 * np.pi * self.f * times)
 
         # We don't really care about normalization
-        demod_sin = self.lp_sin.lfilt(data * sin[None, :], in_place=False)
-        demod_cos = self.lp_cos.lfilt(data * cos[None, :], in_place=False)
+        demod_sin = self.lp_sin.lfilt(data * sin[None, :], in_place=False,
+                                      chans=chans)
+        demod_cos = self.lp_cos.lfilt(data * cos[None, :], in_place=False,
+                                      chans=chans)
 
         return np.sqrt(demod_sin**2 + demod_cos**2)
 
@@ -238,13 +342,16 @@ class WhiteNoiseCalculator:
         self.averager = FIRFilter.moving_avg(navg)
         self.fsamp = fs
 
-    def apply(self, data):
+    def apply(self, data, chans=None):
         """
-        Returns rms / sqrt(fsamp), which estimates the white noise level
+        Returns rms / sqrt(fsamp), which estimates the white noise level.
+        ``chans`` are the channel indices of the rows of data, used to keep
+        filter state per channel.
         """
         return np.sqrt(
             self.averager.lfilt(
-                self.differ.lfilt(data, in_place=False)**2, in_place=False
+                self.differ.lfilt(data, in_place=False, chans=chans)**2,
+                in_place=False, chans=chans
             ) / self.fsamp
         )
 
@@ -517,8 +624,18 @@ class MagpieAgent:
         is seen in the G3Stream, this defaults to being an identity mapping
         which just sends the readout channel no. to itself. Once a status
         frame with the channel mask is seen, this will be updated
+    readout_chans : np.ndarray
+        Readout channels which map to a visual element, in increasing order.
+        This is rebuilt from ``mask`` and ``fp`` by ``_update_chan_map``.
+    elem_idxs : np.ndarray
+        Visual element index for each entry of ``readout_chans``.
     out_queue : Queue
         This is a queue containing outgoing G3Frames to be sent to lyrebird.
+    batch_frames : bool
+        If True, each processed G3Frame is put to the out_queue as a single
+        frame containing all downsampled samples (see ``pack_frames``), which
+        is unpacked by the send process. Otherwise one frame is queued per
+        sample and data-index.
     delay : float
         The outgoing stream will attempt to enforce this delay between the
         relative timestamps in the G3Frames and the real time to ensure a
@@ -542,6 +659,9 @@ class MagpieAgent:
     wlcalc : WhiteNoiseCalculator
         WhiteNoiseCalculator used to calculate white noise levels for incoming
         timestreams
+    dsp_threads : int
+        Number of threads used to filter chunks of channels in parallel for
+        demodulation and white noise calculation.
     """
     mask_register = 'AMCc.SmurfProcessor.ChannelMapper.Mask'
 
@@ -568,7 +688,9 @@ class MagpieAgent:
                                  "using wafer layout")
 
         self.mask = np.arange(MAX_CHANS)
+        self._update_chan_map()
         self.out_queue = queue.Queue(1000)
+        self.batch_frames = args.batch_frames
         self.delay = args.delay
 
         self.demod = None
@@ -577,6 +699,9 @@ class MagpieAgent:
 
         self.wncalc = None
 
+        self.dsp_threads = args.dsp_threads
+        self._dsp_pool = None
+
         self.monitored_channels = []
         self.monitored_chan_sample_rate = 10
         self.agent.register_feed(
@@ -664,6 +789,19 @@ class MagpieAgent:
         self.monitored_chan_sample_rate = params['sample_rate']
         return True, "Set monitored channels"
 
+    def _update_chan_map(self):
+        """
+        Rebuilds the map from readout channel to visual element index. This
+        must be called whenever the channel mask or the focal-plane config
+        changes.
+        """
+        abs_chans = np.asarray(self.mask)
+        elems = np.full(len(abs_chans), -1)
+        valid = (abs_chans >= 0) & (abs_chans < len(self.fp.chan_mask))
+        elems[valid] = self.fp.chan_mask[abs_chans[valid]]
+        self.readout_chans = np.flatnonzero(elems >= 0)
+        self.elem_idxs = elems[self.readout_chans]
+
     def _process_status(self, frame):
         """
         Processes a status frame. This will set or update the channel
@@ -676,6 +814,7 @@ class MagpieAgent:
             self.mask = np.array(
                 ast.literal_eval(status[self.mask_register])
             )
+            self._update_chan_map()
 
     def _process_monitored_chans(self, times, data):
         """
@@ -728,6 +867,41 @@ class MagpieAgent:
         }
         self.agent.publish_to_feed('white_noise', data)
 
+    def _apply_dsp(self, times, data, chans):
+        """
+        Calculates demodulated data and white noise levels. If dsp_threads is
+        larger than 1, channels are split into chunks which are filtered in
+        parallel by the DSP worker pool. scipy's lfilter releases the GIL, and
+        each chunk updates the filter state of its own channels only.
+
+        Returns
+        --------
+        demod : np.ndarray
+            Demodulated data with the same shape as data
+        wl : np.ndarray
+            White noise levels (pA/rt(Hz)) with the same shape as data
+        """
+        def run(sl):
+            demod = self.demod.apply(times, data[sl], chans=chans[sl])
+            # white noise in units of pA/rt(Hz)
+            wl = self.wncalc.apply(data[sl] * pA_per_rad, chans=chans[sl])
+            return demod, wl
+
+        nchunks = min(self.dsp_threads, len(chans))
+        if nchunks <= 1:
+            return run(slice(None))
+
+        bounds = np.linspace(0, len(chans), nchunks + 1).astype(int)
+        chunks = [slice(lo, hi) for lo, hi in zip(bounds[:-1], bounds[1:])]
+        if self._dsp_pool is None:
+            self._dsp_pool = ThreadPoolExecutor(
+                max_workers=self.dsp_threads, thread_name_prefix='magpie-dsp'
+            )
+        results = list(self._dsp_pool.map(run, chunks))
+        demod = np.concatenate([r[0] for r in results])
+        wl = np.concatenate([r[1] for r in results])
+        return demod, wl
+
     def _process_data(self, frame, source_offset=0):
         """
         Processes a Scan frame. If lyrebird is enabled, this will return a seq
@@ -753,10 +927,15 @@ class MagpieAgent:
                 fs=sample_rate, navg=int(sample_rate)
             )
 
-        demod = self.demod.apply(times_in, data_in)
-        # white noise in units of pA/rt(Hz)
-        wl = self.wncalc.apply(data_in * pA_per_rad)
-        self._publish_wls(np.median(wl, axis=1))
+        # Only channels which map to a visual element are processed
+        nmapped = np.searchsorted(self.readout_chans, nchans)
+        readout_chans = self.readout_chans[:nmapped]
+        elem_idxs = self.elem_idxs[:nmapped]
+        data_in = data_in[readout_chans]
+
+        demod, wl = self._apply_dsp(times_in, data_in, readout_chans)
+        if nmapped:
+            self._publish_wls(np.median(wl, axis=1))
 
         ds_factor = sample_rate // self.target_rate
         if np.isnan(ds_factor):  # There is only one element in the timestream
@@ -769,21 +948,20 @@ class MagpieAgent:
         num_frames = len(sample_idxs)
 
         times_out = times_in[sample_idxs]
-        abs_chans = self.mask[np.arange(nchans)]
 
         nelems = len(self.fp.channels)
         raw_out = np.zeros((num_frames, nelems))
         demod_out = np.zeros((num_frames, nelems))
         wl_out = np.zeros((num_frames, nelems))
 
-        for i, c in enumerate(abs_chans):
-            if c >= len(self.fp.chan_mask):
-                continue
-            idx = self.fp.chan_mask[c]
-            if idx >= 0:
-                raw_out[:, idx] = data_in[i, sample_idxs]
-                demod_out[:, idx] = demod[i, sample_idxs]
-                wl_out[:, idx] = wl[i, sample_idxs]
+        raw_out[:, elem_idxs] = data_in[:, sample_idxs].T
+        demod_out[:, elem_idxs] = demod[:, sample_idxs].T
+        wl_out[:, elem_idxs] = wl[:, sample_idxs].T
+
+        if self.batch_frames:
+            if num_frames == 0:
+                return []
+            return [pack_frames(times_out, [raw_out, demod_out, wl_out])]
 
         out = []
         for i in range(num_frames):
@@ -831,61 +1009,96 @@ class MagpieAgent:
         reader = None
         source = None
         source_offset = 0
-        while self._running:
-
-            if reader is None:
-                try:
-                    source = sources[src_idx]
-                    source_is_file = not source.startswith('tcp://')
-                    reader = core.G3Reader(source, timeout=5)
-                except RuntimeError as e:
-                    if source_is_file:
-                        # Raise error if file cannot be found
-                        raise e
-                    else:
-                        # If not a file, log error and try again
-                        self.log.error("G3Reader could not connect! Retrying in 10 sec.")
-                        time.sleep(10)
-                        continue
-
-            frames = reader.Process(None)
-            if not frames:
-                # If source is a file, start over with next file or break if
-                # finished all sources. If socket, just reset reader and try to
-                # reconnect
-                if source_is_file:
-                    src_idx += 1
-                    if src_idx >= len(sources):
-                        self.log.info("Finished reading all sources")
-                        break
-                reader = None
-                continue
-
-            frame = frames[0]
 
-            # If this source is a file, this will shift the timestamps so that
-            # data lines up with the current timestamp instead of using the
-            # timestamps in the file
-            if source_is_file and (not source_offset):
-                source_offset = frame['time'].time / core.G3Units.s \
-                    - time.time()
-            elif not source_is_file:
-                source_offset = 0
+        # Frames are processed in a separate thread so that reading the next
+        # frame is not blocked by processing
+        proc_queue = queue.Queue(10)
+        proc_thread = threading.Thread(
+            target=self._process_frames, args=(proc_queue,), daemon=True
+        )
+        proc_thread.start()
+
+        try:
+            while self._running:
+
+                if reader is None:
+                    try:
+                        source = sources[src_idx]
+                        source_is_file = not source.startswith('tcp://')
+                        reader = core.G3Reader(source, timeout=5)
+                    except RuntimeError as e:
+                        if source_is_file:
+                            # Raise error if file cannot be found
+                            raise e
+                        else:
+                            # If not a file, log error and try again
+                            self.log.error("G3Reader could not connect! Retrying in 10 sec.")
+                            time.sleep(10)
+                            continue
+
+                frames = reader.Process(None)
+                if not frames:
+                    # If source is a file, start over with next file or break if
+                    # finished all sources. If socket, just reset reader and try to
+                    # reconnect
+                    if source_is_file:
+                        src_idx += 1
+                        if src_idx >= len(sources):
+                            self.log.info("Finished reading all sources")
+                            break
+                    reader = None
+                    continue
+
+                frame = frames[0]
+
+                # If this source is a file, this will shift the timestamps so that
+                # data lines up with the current timestamp instead of using the
+                # timestamps in the file
+                if source_is_file and (not source_offset):
+                    source_offset = frame['time'].time / core.G3Units.s \
+                        - time.time()
+                elif not source_is_file:
+                    source_offset = 0
+
+                if frame.type in [core.G3FrameType.Wiring, core.G3FrameType.Scan]:
+                    # This will block until the processing thread catches up.
+                    # This is useful if the src is a file and reader.Process does
+                    # not block
+                    proc_queue.put((frame, source_offset))
+        finally:
+            proc_queue.put(None)
+            proc_thread.join()
+            # The DSP workers are only used by the processing thread
+            if self._dsp_pool is not None:
+                self._dsp_pool.shutdown()
+                self._dsp_pool = None
+        return True, "Stopped read process"
 
-            if frame.type == core.G3FrameType.Wiring:
-                self._process_status(frame)
-                continue
-            elif frame.type == core.G3FrameType.Scan:
+    def _process_frames(self, proc_queue):
+        """
+        Processes frames put to proc_queue by the read process, and puts the
+        resulting lyrebird frames to the out_queue. This runs in its own
+        thread so that reading, processing, and sending frames are pipelined.
+        Returns when None is put to proc_queue.
+        """
+        while True:
+            item = proc_queue.get()
+            if item is None:
+                return
+            frame, source_offset = item
+            try:
+                if frame.type == core.G3FrameType.Wiring:
+                    self._process_status(frame)
+                    continue
                 out = self._process_data(frame, source_offset=source_offset)
-            else:
+            except Exception:
+                self.log.error("Error processing frame:\n{e}",
+                               e=traceback.format_exc())
                 continue
 
             for f in out:
                 # This will block until there's a free spot in the queue.
-                # This is useful if the src is a file and reader.Process does
-                # not block
                 self.out_queue.put(f)
-        return True, "Stopped read process"
 
     def _stop_read(self, session, params=None):
         self._running = False
@@ -952,16 +1165,16 @@ class MagpieAgent:
         sender.Process(self.fp.config_frame())
         session.set_status('running')
         while session.status in ['starting', 'running']:
-            f = self.out_queue.get(block=True)
-            t = f['timestamp'].time / core.G3Units.s
-            now = time.time()
-            if first_frame_time is None:
-                first_frame_time = t
-                stream_start_time = now
+            for f in unpack_frames(self.out_queue.get(block=True)):
+                t = f['timestamp'].time / core.G3Units.s
+                now = time.time()
+                if first_frame_time is None:
+                    first_frame_time = t
+                    stream_start_time = now
 
-            this_frame_time = stream_start_time + (t - first_frame_time) + self.delay
-            sleep_while_running(this_frame_time - now, session)
-            sender.Process(f)
+                this_frame_time = stream_start_time + (t - first_frame_time) + self.delay
+                sleep_while_running(this_frame_time - now, session)
+                sender.Process(f)
 
         return True, "Stopped send process"
 
@@ -1017,6 +1230,14 @@ def make_parser(parser=None):
                         help="Demodulation frequency")
     pgroup.add_argument('--demod-bandwidth', type=float, default=0.5,
                         help="Demodulation bandwidth")
+    pgroup.add_argument('--dsp-threads', type=int, default=1,
+                        help="Number of threads used to filter detector data. "
+                             "Channels are split into this many chunks which are "
+                             "processed in parallel.")
+    pgroup.add_argument('--batch-frames', action='store_true',
+                        help="If set, downsampled data of each incoming frame is "
+                             "queued as a single frame, which is unpacked just "
+                             "before being sent to lyrebird.")
     return parser
 
 
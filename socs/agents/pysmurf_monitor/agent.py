@@ -9,6 +9,7 @@ from twisted.internet import reactor
 from twisted.internet.protocol import DatagramProtocol
 
 from socs.db.suprsync import SupRsyncFilesManager, create_file
+from socs.util import submit_md5sum
 
 
 def create_remote_path(meta, archive_name):
@@ -157,7 +158,8 @@ class PysmurfMonitor(DatagramProtocol):
 
         **Process** - Main process for the pysmurf monitor agent. Processes
         files that have been added to the queue, adding them to the suprsync
-        database.
+        database. File checksums are computed in a pool of worker threads,
+        and each file is added once its checksum is ready.
 
         Parameters:
             test_mode (bool, optional):
@@ -169,8 +171,10 @@ class PysmurfMonitor(DatagramProtocol):
 
         self.running = True
         session.set_status('running')
+
+        # (md5sum future, create_file kwargs) for files waiting on checksums
+        pending = []
         while self.running:
-            files = []
             while not self.file_queue.empty():
                 meta = self.file_queue.get()
                 # Archive name defaults to pysmurf because that is currently
@@ -195,10 +199,12 @@ class PysmurfMonitor(DatagramProtocol):
                             if key in local_path:
                                 deletable = False
 
-                    files.append(
-                        create_file(local_path, remote_path, archive_name,
-                                    deletable=deletable)
-                    )
+                    pending.append((submit_md5sum(local_path), {
+                        'local_path': local_path,
+                        'remote_path': remote_path,
+                        'archive_name': archive_name,
+                        'deletable': deletable,
+                    }))
                 except Exception as e:
                     self.agent.log.error(
                         "Could not generate SupRsync file object from "
@@ -206,11 +212,28 @@ class PysmurfMonitor(DatagramProtocol):
                         meta=meta, e=e
                     )
 
+            files = []
+            waiting = []
+            for future, kwargs in pending:
+                if not future.done():
+                    waiting.append((future, kwargs))
+                    continue
+                try:
+                    files.append(
+                        create_file(local_md5sum=future.result(), **kwargs)
+                    )
+                except Exception as e:
+                    self.agent.log.error(
+                        "Could not compute md5sum for {path}\n"
+                        "Raised Exception: {e}",
+                        path=kwargs['local_path'], e=e
+                    )
+            pending = waiting
+
             if files:
-                with srfm.Session.begin() as session:
-                    session.add_all(files)
+                srfm.add_files(files)
 
-            if params['test_mode']:
+            if params['test_mode'] and not pending:
                 break
 
             time.sleep(1)
@@ -44,6 +44,13 @@ class SupRsync:
         Time (sec) for which cmds run on the remote will timeout
     copy_timeout : float
         Time (sec) after which a copy command will timeout
+    num_workers : int
+        Number of concurrent rsync processes used to copy files
+    max_bytes_in_flight : float, optional
+        Max number of bytes being transferred at once by all workers
+    verify_mode : str
+        How copies are verified, either 'md5sum' or 'rsync'. See
+        SupRsyncFileHandler.
     """
 
     def __init__(self, agent, args):
@@ -64,6 +71,9 @@ class SupRsync:
         self.sleep_time = args.sleep_time
         self.compression = args.compression
         self.bwlimit = args.bwlimit
+        self.num_workers = args.num_workers
+        self.max_bytes_in_flight = args.max_bytes_in_flight
+        self.verify_mode = args.verify_mode
         self.suprsync_file_root = args.suprsync_file_root
 
         # Feed for counting transfer errors, loop iterations.
@@ -118,7 +128,9 @@ class SupRsync:
             srfm, self.archive_name, self.remote_basedir, ssh_host=self.ssh_host,
             ssh_key=self.ssh_key, cmd_timeout=self.cmd_timeout,
             copy_timeout=self.copy_timeout, compression=self.compression,
-            bwlimit=self.bwlimit
+            bwlimit=self.bwlimit, num_workers=self.num_workers,
+            max_bytes_in_flight=self.max_bytes_in_flight,
+            verify_mode=self.verify_mode
         )
 
         self.running = True
@@ -165,6 +177,13 @@ class SupRsync:
 
             now = time.time()
 
+            # Throughput of each rsync worker during this copy
+            for worker, stats in handler.worker_stats.items():
+                self.agent.publish_to_feed('transfer_stats', {
+                    'block_name': f'worker{worker}',
+                    'timestamp': now,
+                    'data': stats})
+
             if now - last_tcdir_update > tcdir_update_interval:
                 # add timecode-dirs for all files from the last week
                 self.log.info("Creating timecode dirs for recent files.....")
@@ -249,7 +268,23 @@ def make_parser(parser=None):
     pgroup.add_argument('--compression', action='store_true', default=False,
                         help="Activate gzip on data transfer (rsync -z)")
     pgroup.add_argument('--bwlimit', type=str, default=None,
-                        help="Bandwidth limit arg (passed through to rsync)")
+                        help="Bandwidth limit arg (passed through to rsync). "
+                             "This is shared evenly between workers.")
+    pgroup.add_argument('--num-workers', type=int, default=1,
+                        help="Number of rsync processes to run concurrently, "
+                             "each copying a separate batch of files")
+    pgroup.add_argument('--max-bytes-in-flight', type=float, default=None,
+                        help="Max number of bytes to be transferring at once "
+                             "across all workers. Default is None, which "
+                             "does not limit batch sizes.")
+    pgroup.add_argument('--verify-mode', choices=['md5sum', 'rsync'],
+                        default='md5sum',
+                        help="How to verify copied files. 'md5sum' runs "
+                             "md5sum on the remote over every copied file. "
+                             "'rsync' uses the md5sum rsync verifies during "
+                             "the transfer (requires rsync >= 3.2 on both "
+                             "ends), only running md5sum on the remote for "
+                             "files rsync did not transfer.")
     pgroup.add_argument('--suprsync-file-root', type=str, required=True,
                         help="Local path where agent will write suprsync files")
     return parser
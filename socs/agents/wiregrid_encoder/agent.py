@@ -7,6 +7,7 @@ from ocs import ocs_agent, site_config
 from ocs.ocs_twisted import TimeoutLock
 
 from socs.agents.wiregrid_encoder.drivers import EncoderParser
+from socs.common.irig import count2time
 
 NUM_ENCODER_TO_PUBLISH = 1000
 SEC_ENCODER_TO_PUBLISH = 1
@@ -15,13 +16,6 @@ COUNTS_ON_BELT = 52000
 REFERENCE_COUNT_MAX = 2 << 15  # > that of belt on wiregrid (=nominal 52000)
 
 
-def count2time(counts, t_offset=0.):
-    t_array = np.array(counts, dtype=float) - counts[0]
-    t_array *= 5.e-9
-    t_array += t_offset
-    return t_array.tolist()
-
-
 class WiregridEncoderAgent:
     """ Agent to record the wiregrid rotary-encoder data.
     The encoder signal and IRIG timing signal is read
@@ -271,7 +265,7 @@ class WiregridEncoderAgent:
                         self.agent.publish_to_feed(
                             'wgencoder_rough', enc_rdata)
                         enc_fdata['timestamps'] =\
-                            count2time(pru_clock, received_time_list[0])
+                            count2time(pru_clock, received_time_list[0]).tolist()
                         enc_fdata['data']['quadrature'] = quad_data
                         enc_fdata['data']['pru_clock'] = pru_clock
                         enc_fdata['data']['reference_count'] = ref_count
@@ -10,6 +10,8 @@ import txaio
 
 txaio.use_twisted()
 
+from socs.common.irig import de_irig
+
 # should be consistent with the software on beaglebone
 COUNTER_INFO_LENGTH = 100
 # header, quad, clock[100], clock_overflow[100], refcount[100], error[100]
@@ -233,16 +235,7 @@ class EncoderParser:
         return self.current_time
 
     def de_irig(self, val, base_shift=0):
-        return (
-            ((val >> (0 + base_shift)) & 1)
-            + ((val >> (1 + base_shift)) & 1) * 2
-            + ((val >> (2 + base_shift)) & 1) * 4
-            + ((val >> (3 + base_shift)) & 1) * 8
-            + ((val >> (5 + base_shift)) & 1) * 10
-            + ((val >> (6 + base_shift)) & 1) * 20
-            + ((val >> (7 + base_shift)) & 1) * 40
-            + ((val >> (8 + base_shift)) & 1) * 80
-        )
+        return de_irig(val, base_shift)
 
     def __del__(self):
         self.sock.close()
@@ -0,0 +1,143 @@
+"""Vectorized decoding of the IRIG-B timing information and the clock counts
+recorded by the Beaglebone Black boards of the HWP and wiregrid encoders.
+
+All functions accept arrays, so whole batches of IRIG packets, or hours of
+archived data, can be decoded at once.
+"""
+
+import numpy as np
+
+#: Nominal frequency of the Beaglebone Black clock in Hz
+BBB_CLOCK_FREQ = 2.e8
+
+# Each IRIG-B field is a 9-bit BCD word: units in bits 0-3, a position
+# identifier in bit 4, and tens in bits 5-8.
+_FIELD_BITS = 9
+_BCD_WEIGHTS = np.array([1, 2, 4, 8, 0, 10, 20, 40, 80])
+_BCD_LUT = ((np.arange(1 << _FIELD_BITS)[:, np.newaxis]
+             >> np.arange(_FIELD_BITS)) & 1) @ _BCD_WEIGHTS
+
+
+def de_irig(val, base_shift=0):
+    """Converts the IRIG signal into sec/min/hours/day/year depending on the
+    parameters.
+
+    Args:
+        val (int or array_like): Raw IRIG bit info of each 100 msec chunk.
+        base_shift (int): Number of bit shifts. This should be 0 except for
+            seconds.
+
+    Returns:
+        int or numpy.ndarray: Either of sec/min/hours/day/year, with the same
+        shape as ``val``.
+
+    """
+    decoded = _BCD_LUT[(np.asarray(val, dtype=np.int64) >> base_shift)
+                       & ((1 << _FIELD_BITS) - 1)]
+    if np.ndim(decoded) == 0:
+        return int(decoded)
+    return decoded
+
+
+def decode_irig(irig_info):
+    """Decodes the time fields of IRIG packets.
+
+    Args:
+        irig_info (array_like): Raw IRIG bit info, with shape (10,) for a
+            single packet or (N, 10) for N packets.
+
+    Returns:
+        dict: Decoded 'sec', 'min', 'hour', 'day' and 'year' fields. Each
+        value is an int for a single packet or an array of length N.
+
+    """
+    info = np.asarray(irig_info, dtype=np.int64)
+    return {'sec': de_irig(info[..., 0], 1),
+            'min': de_irig(info[..., 1]),
+            'hour': de_irig(info[..., 2]),
+            'day': de_irig(info[..., 3]) + de_irig(info[..., 4]) * 100,
+            'year': de_irig(info[..., 5])}
+
+
+def irig2unix(fields):
+    """Converts decoded IRIG fields to unix timestamps.
+
+    The two-digit IRIG year is interpreted like ``time.strptime`` with
+    ``%y``, i.e. 69-99 are 1969-1999 and 0-68 are 2000-2068.
+
+    Args:
+        fields (dict): Decoded IRIG fields, as returned by
+            :func:`decode_irig`.
+
+    Returns:
+        int or numpy.ndarray: Seconds since the unix epoch. Invalid timestamps
+        are set to -1.
+
+    """
+    sec, mins, hour, day, year = [np.asarray(fields[k], dtype=np.int64)
+                                  for k in ('sec', 'min', 'hour', 'day', 'year')]
+    year = np.where(year < 69, year + 2000, year + 1900)
+    year_start = (year - 1970).astype('datetime64[Y]').astype('datetime64[D]')
+    next_year_start = (year - 1969).astype('datetime64[Y]').astype('datetime64[D]')
+    days_in_year = (next_year_start - year_start).astype(np.int64)
+
+    unix_time = (year_start.astype(np.int64) + day - 1) * 86400 \
+        + hour * 3600 + mins * 60 + sec
+    valid = (sec <= 61) & (mins <= 59) & (hour <= 23) \
+        & (day >= 1) & (day <= days_in_year)
+    unix_time = np.where(valid, unix_time, -1)
+    if unix_time.ndim == 0:
+        return int(unix_time)
+    return unix_time
+
+
+def fit_clock_freq(sync_counts, sync_times):
+    """Fits the Beaglebone Black clock frequency from the clock counts of the
+    IRIG synchronization pulses.
+
+    Args:
+        sync_counts (array_like): Clock counts of the synchronization pulses.
+        sync_times (array_like): Times of the synchronization pulses in
+            seconds.
+
+    Returns:
+        float: Clock frequency in Hz. :data:`BBB_CLOCK_FREQ` is returned if
+        fewer than two pulses are given.
+
+    """
+    counts = np.ravel(np.asarray(sync_counts, dtype=np.int64))
+    times = np.ravel(np.asarray(sync_times, dtype=float))
+    if len(counts) < 2:
+        return BBB_CLOCK_FREQ
+
+    # Fit relative to the first pulse to keep full float precision
+    dc = (counts - counts[0]).astype(float)
+    dt = times - times[0]
+    dc -= dc.mean()
+    dt -= dt.mean()
+    var = np.dot(dt, dt)
+    if var == 0:
+        return BBB_CLOCK_FREQ
+    return float(np.dot(dc, dt) / var)
+
+
+def count2time(counts, t_offset=0., clock_freq=BBB_CLOCK_FREQ):
+    """Quick estimation of time using Beaglebone Black clock counts.
+
+    Args:
+        counts (array_like): Beaglebone Black clock counter values.
+        t_offset (float): Time offset in seconds.
+        clock_freq (float): Clock frequency in Hz, e.g. from
+            :func:`fit_clock_freq`.
+
+    Returns:
+        numpy.ndarray: Estimated time in seconds. Without specifying
+        t_offset, output is just the difference from the first sample in the
+        input.
+
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    t_array = (counts - counts[0]).astype(float)
+    t_array /= clock_freq
+    t_array += t_offset
+    return t_array
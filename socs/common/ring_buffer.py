@@ -0,0 +1,134 @@
+"""Fixed size ring buffer holding the most recent samples of a time series.
+
+Appending a sample is O(1), overwriting the oldest sample once the buffer is
+full, and the samples within a time window, or the last few samples, can be
+read back and summarized (min/max/mean/std) without copying the whole buffer.
+"""
+
+import numpy as np
+
+
+class RingBuffer:
+    """Ring buffer of timestamped samples.
+
+    Timestamps are expected to be appended in increasing order.
+
+    Args:
+        size (int): Maximum number of samples kept.
+        shape (tuple): Shape of the value of each sample, e.g. (4,) to store
+            the readings of four channels per sample. Defaults to scalars.
+        dtype: Data type of the values.
+
+    Attributes:
+        size (int): Maximum number of samples kept.
+
+    """
+
+    def __init__(self, size, shape=(), dtype=float):
+        self.size = int(size)
+        self._times = np.zeros(self.size)
+        self._values = np.zeros((self.size,) + tuple(shape), dtype=dtype)
+        self._index = 0  # next position to write to
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, value):
+        """Append a sample, overwriting the oldest one if the buffer is full.
+
+        Args:
+            timestamp (float): Time of the sample.
+            value (float or array_like): Value of the sample.
+
+        """
+        self._times[self._index] = timestamp
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.size
+        self._count = min(self._count + 1, self.size)
+
+    def clear(self):
+        """Remove all samples."""
+        self._index = 0
+        self._count = 0
+
+    @property
+    def oldest(self):
+        """float: Timestamp of the oldest sample, None if empty."""
+        if not self._count:
+            return None
+        return float(self._times[(self._index - self._count) % self.size])
+
+    @property
+    def newest(self):
+        """float: Timestamp of the newest sample, None if empty."""
+        if not self._count:
+            return None
+        return float(self._times[self._index - 1])
+
+    def _num_recent(self, window, now, samples):
+        """Number of most recent samples selected by window and samples."""
+        n = self._count
+        if samples is not None:
+            n = min(n, max(int(samples), 0))
+        if window is not None and n:
+            if now is None:
+                now = self.newest
+            cutoff = now - window
+            # Samples are sorted by time within the newer segment [0, index)
+            # and the older segment [index, count) of the underlying array.
+            newer = self._times[:self._index]
+            older = self._times[self._index:self._count]
+            in_window = (len(newer) - np.searchsorted(newer, cutoff)
+                         + len(older) - np.searchsorted(older, cutoff))
+            n = min(n, int(in_window))
+        return n
+
+    def get(self, window=None, now=None, samples=None):
+        """Get the most recent samples, oldest first.
+
+        Args:
+            window (float): Only return samples with a timestamp within
+                ``window`` of ``now``.
+            now (float): End of the window. Defaults to the timestamp of the
+                newest sample.
+            samples (int): Return at most this many samples.
+
+        Returns:
+            tuple: Arrays of the timestamps and values of the samples. These
+            are views into the buffer, rather than copies, unless the samples
+            wrap around its end.
+
+        """
+        n = self._num_recent(window, now, samples)
+        start = self._index - n
+        if start >= 0:
+            return self._times[start:self._index], self._values[start:self._index]
+        return (np.concatenate((self._times[start:], self._times[:self._index])),
+                np.concatenate((self._values[start:], self._values[:self._index])))
+
+    def _reduce(self, func, window, now, samples):
+        values = self.get(window=window, now=now, samples=samples)[1]
+        if not len(values):
+            return np.full(self._values.shape[1:], np.nan)[()]
+        return func(values, axis=0)
+
+    def min(self, window=None, now=None, samples=None):
+        """Minimum of the selected samples (see :meth:`get`), NaN if there
+        are none."""
+        return self._reduce(np.min, window, now, samples)
+
+    def max(self, window=None, now=None, samples=None):
+        """Maximum of the selected samples (see :meth:`get`), NaN if there
+        are none."""
+        return self._reduce(np.max, window, now, samples)
+
+    def mean(self, window=None, now=None, samples=None):
+        """Mean of the selected samples (see :meth:`get`), NaN if there are
+        none."""
+        return self._reduce(np.mean, window, now, samples)
+
+    def std(self, window=None, now=None, samples=None):
+        """Standard deviation of the selected samples (see :meth:`get`), NaN
+        if there are none."""
+        return self._reduce(np.std, window, now, samples)
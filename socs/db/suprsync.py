@@ -1,16 +1,20 @@
 import os
+import re
 import subprocess
 import tempfile
 import time
+from concurrent.futures import (FIRST_COMPLETED, ThreadPoolExecutor,
+                                as_completed, wait)
 
 import txaio
 import yaml
-from sqlalchemy import (Boolean, Column, Float, ForeignKey, Integer, String,
-                        asc, create_engine)
+from sqlalchemy import (Boolean, Column, Float, ForeignKey, Index, Integer,
+                        String, asc, create_engine, event, func, insert,
+                        inspect, text)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-from socs.util import get_md5sum
+from socs.util import get_md5sum, submit_md5sum
 
 TABLE_VERSION = 0
 txaio.use_twisted()
@@ -22,6 +26,10 @@ Base = declarative_base()
 # the subsequent timecode dir has not been created.
 DAYS_TO_COMPLETE_TCDIR = 1
 
+# Number of seconds after which the archive stats are recomputed from the
+# full files table, in case the incrementally maintained values have drifted.
+STATS_RECONCILE_INTERVAL = 3600
+
 
 class TimecodeDir(Base):
     """
@@ -89,8 +97,23 @@ class SupRsyncFile(Base):
         ignore : Bool
             If true, file will be ignored by SupRsync agent and not
             included in `finalized_until`.
+        synced : Bool
+            True if the remote md5sum has been verified to match the local
+            md5sum.
+        timecode : Int, optional
+            Timecode of the timecode directory the remote path is in, if any.
     """
     __tablename__ = f"supersync_v{TABLE_VERSION}"
+    __table_args__ = (
+        Index(f'ix_supersync_v{TABLE_VERSION}_archive_removed',
+              'archive_name', 'removed', 'ignore', 'synced', 'timestamp'),
+        Index(f'ix_supersync_v{TABLE_VERSION}_archive_synced',
+              'archive_name', 'synced', 'timestamp'),
+        Index(f'ix_supersync_v{TABLE_VERSION}_archive_timestamp',
+              'archive_name', 'timestamp'),
+        Index(f'ix_supersync_v{TABLE_VERSION}_archive_timecode',
+              'archive_name', 'timecode', 'synced'),
+    )
 
     id = Column(Integer, primary_key=True)
     local_path = Column(String, nullable=False)
@@ -104,6 +127,9 @@ class SupRsyncFile(Base):
     failed_copy_attempts = Column(Integer, default=0)
     deletable = Column(Boolean, default=True)
     ignore = Column(Boolean, default=False)
+    synced = Column(Boolean, nullable=False, default=False,
+                    server_default=text('0'))
+    timecode = Column(Integer)
 
     def __str__(self):
         excl = ('_sa_adapter', '_sa_instance_state')
@@ -120,6 +146,125 @@ class SupRsyncFile(Base):
         return s
 
 
+class ArchiveStats(Base):
+    """
+    Table of statistics for each archive in the files table. Rows are kept up
+    to date by triggers on the files table, so they are correct no matter
+    which process adds or updates files, and are periodically recomputed from
+    the files table in full.
+
+    Attributes
+    ----------
+        archive_name : String
+            Name of the archive
+        num_files : Int
+            Number of files in the archive
+        uncopied_files : Int
+            Number of files that are not ignored and not synced
+        last_file_added : String
+            Local path of the file with the latest timestamp
+        last_added_timestamp : Float, optional
+            Timestamp of last_file_added
+        last_file_copied : String
+            Local path of the synced file with the latest timestamp
+        last_copied_timestamp : Float, optional
+            Timestamp of last_file_copied
+        reconciled : Float, optional
+            Time at which the stats were last recomputed in full
+    """
+    __tablename__ = f"archive_stats_v{TABLE_VERSION}"
+
+    archive_name = Column(String, primary_key=True)
+    num_files = Column(Integer, nullable=False, default=0)
+    uncopied_files = Column(Integer, nullable=False, default=0)
+    last_file_added = Column(String, nullable=False, default='')
+    last_added_timestamp = Column(Float)
+    last_file_copied = Column(String, nullable=False, default='')
+    last_copied_timestamp = Column(Float)
+    reconciled = Column(Float)
+
+
+# Triggers that maintain the ArchiveStats rows. Rows created here have
+# reconciled = NULL, so they will be recomputed in full on first use.
+_STATS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS {files}_stats_insert AFTER INSERT ON {files}
+    BEGIN
+        INSERT OR IGNORE INTO {stats} (archive_name, num_files, uncopied_files,
+                                       last_file_added, last_file_copied)
+            VALUES (NEW.archive_name, 0, 0, '', '');
+        UPDATE {stats} SET
+            num_files = num_files + 1,
+            uncopied_files = uncopied_files
+                + coalesce(NEW.ignore = 0 AND NEW.synced = 0, 0),
+            last_file_added = CASE
+                WHEN coalesce(NEW.timestamp >= last_added_timestamp, 1)
+                THEN NEW.local_path ELSE last_file_added END,
+            last_added_timestamp = max(NEW.timestamp,
+                                       coalesce(last_added_timestamp, NEW.timestamp)),
+            last_file_copied = CASE
+                WHEN NEW.synced AND coalesce(NEW.timestamp >= last_copied_timestamp, 1)
+                THEN NEW.local_path ELSE last_file_copied END,
+            last_copied_timestamp = CASE
+                WHEN NEW.synced AND coalesce(NEW.timestamp >= last_copied_timestamp, 1)
+                THEN NEW.timestamp ELSE last_copied_timestamp END
+        WHERE archive_name = NEW.archive_name;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {files}_stats_update
+    AFTER UPDATE OF synced, ignore ON {files}
+    BEGIN
+        UPDATE {stats} SET
+            uncopied_files = uncopied_files
+                - coalesce(OLD.ignore = 0 AND OLD.synced = 0, 0)
+                + coalesce(NEW.ignore = 0 AND NEW.synced = 0, 0),
+            last_file_copied = CASE
+                WHEN NEW.synced AND NOT OLD.synced
+                    AND coalesce(NEW.timestamp >= last_copied_timestamp, 1)
+                THEN NEW.local_path ELSE last_file_copied END,
+            last_copied_timestamp = CASE
+                WHEN NEW.synced AND NOT OLD.synced
+                    AND coalesce(NEW.timestamp >= last_copied_timestamp, 1)
+                THEN NEW.timestamp ELSE last_copied_timestamp END
+        WHERE archive_name = NEW.archive_name;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {files}_stats_delete AFTER DELETE ON {files}
+    BEGIN
+        UPDATE {stats} SET
+            num_files = num_files - 1,
+            uncopied_files = uncopied_files
+                - coalesce(OLD.ignore = 0 AND OLD.synced = 0, 0),
+            reconciled = NULL
+        WHERE archive_name = OLD.archive_name;
+    END
+    """,
+]
+
+
+# A timecode dir is a first path component of exactly 5 digits, not starting
+# with 0, i.e. a timecode of 10000 or more.
+_TIMECODE_RE = re.compile(r'/*([1-9][0-9]{4})(/|\Z)')
+
+# SQL equivalent of check_timecode, for rows added by writers that do not set
+# the timecode column.
+_TIMECODE_SQL = """
+    CASE WHEN ltrim({path}, '/') GLOB '[1-9][0-9][0-9][0-9][0-9]'
+         OR ltrim({path}, '/') GLOB '[1-9][0-9][0-9][0-9][0-9]/*'
+    THEN CAST(substr(ltrim({path}, '/'), 1, 5) AS INTEGER) END
+"""
+
+_TIMECODE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS {files}_timecode AFTER INSERT ON {files}
+    WHEN NEW.timecode IS NULL
+    BEGIN
+        UPDATE {files} SET timecode = {timecode} WHERE id = NEW.id;
+    END
+"""
+
+
 def split_path(path):
     """Splits path into a list where each element is a subdirectory"""
     return os.path.normpath(path).strip('/').split('/')
@@ -128,16 +273,13 @@ def split_path(path):
 def check_timecode(file: SupRsyncFile):
     """
     Tries to extract timecode from the remote path. If it fails, returns
-    None.
+    None. This must agree with _TIMECODE_SQL, which sets the timecode of rows
+    added without one.
     """
-    split = split_path(file.remote_path)
-    try:
-        timecode = int(split[0])
-        if len(str(timecode)) != 5:  # Timecode must be 5 digits
-            raise ValueError("Timecode not 5 digits")
-        return timecode
-    except ValueError:
+    match = _TIMECODE_RE.match(file.remote_path)
+    if match is None:
         return None
+    return int(match.group(1))
 
 
 def create_file(local_path, remote_path, archive_name, local_md5sum=None,
@@ -183,9 +325,24 @@ def create_file(local_path, remote_path, archive_name, local_md5sum=None,
     if deletable is not None:
         file.deletable = deletable
 
+    file.timecode = check_timecode(file)
+
     return file
 
 
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Runs the db in WAL mode, so that readers (e.g. the SupRsync agent) and a
+    writer (e.g. the pysmurf monitor) don't block each other, and waits for
+    locks held by other processes instead of failing immediately.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=30000")
+    cursor.close()
+
+
 class SupRsyncFilesManager:
     """
     Helper class for accessing and adding entries to the SupRsync
@@ -207,46 +364,133 @@ class SupRsyncFilesManager:
             os.makedirs(os.path.dirname(db_path))
 
         self._engine = create_engine(f'sqlite:///{db_path}', echo=echo)
+        event.listen(self._engine, 'connect', _set_sqlite_pragmas)
         self.Session = sessionmaker(bind=self._engine)
 
         if create_all:
             Base.metadata.create_all(self._engine)
+            self._migrate()
 
-    def get_archive_stats(self, archive_name, session=None):
-        if session is None:
-            session = self.Session()
+    def _migrate(self):
+        """
+        Brings a files table created by an older version of this module up to
+        date. Tables from TABLE_VERSION 0 lack the ``synced`` and ``timecode``
+        columns and the indexes, which are added in place, so that writers
+        running older versions can keep using the same table. New rows from
+        such writers get ``synced = 0`` from the server default, which is
+        correct because files are never synced when they are added, and their
+        timecode is set by a trigger.
+        """
+        table = SupRsyncFile.__table__
+        columns = [c['name'] for c in inspect(self._engine).get_columns(table.name)]
+        with self._engine.begin() as conn:
+            if 'synced' not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} "
+                    "ADD COLUMN synced BOOLEAN NOT NULL DEFAULT 0"
+                ))
+                conn.execute(text(
+                    f"UPDATE {table.name} SET synced = 1 "
+                    "WHERE remote_md5sum = local_md5sum"
+                ))
+            if 'timecode' not in columns:
+                conn.execute(text(
+                    f"ALTER TABLE {table.name} ADD COLUMN timecode INTEGER"
+                ))
+                conn.execute(text(
+                    f"UPDATE {table.name} SET timecode = "
+                    + _TIMECODE_SQL.format(path='remote_path')
+                ))
+            conn.execute(text(_TIMECODE_TRIGGER.format(
+                files=table.name,
+                timecode=_TIMECODE_SQL.format(path='NEW.remote_path'))))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+            for trigger in _STATS_TRIGGERS:
+                conn.execute(text(trigger.format(
+                    files=table.name, stats=ArchiveStats.__tablename__)))
+
+    def reconcile_archive_stats(self, archive_name, session=None):
+        """
+        Recomputes the ArchiveStats row for an archive from the full files
+        table. This is done in a single statement, so it is consistent with
+        concurrent writers.
 
-        files = session.query(SupRsyncFile).filter(
-            SupRsyncFile.archive_name == archive_name,
-        ).order_by(asc(SupRsyncFile.timestamp)).all()
+        Args
+        ------
+            archive_name : String
+                Archive name to recompute stats for
+            session : sqlalchemy session
+                SQLAlchemy session to use. If none is passed, will create a new
+                session and commit afterwards.
+        """
+        stmt = text("""
+            INSERT OR REPLACE INTO {stats} (
+                archive_name, num_files, uncopied_files,
+                last_file_added, last_added_timestamp,
+                last_file_copied, last_copied_timestamp, reconciled)
+            SELECT :archive_name,
+                (SELECT count(*) FROM {files}
+                    WHERE archive_name = :archive_name),
+                (SELECT count(*) FROM {files}
+                    WHERE archive_name = :archive_name
+                    AND ignore = 0 AND synced = 0),
+                coalesce((SELECT local_path FROM {files}
+                    WHERE archive_name = :archive_name
+                    ORDER BY timestamp DESC LIMIT 1), ''),
+                (SELECT max(timestamp) FROM {files}
+                    WHERE archive_name = :archive_name),
+                coalesce((SELECT local_path FROM {files}
+                    WHERE archive_name = :archive_name AND synced = 1
+                    ORDER BY timestamp DESC LIMIT 1), ''),
+                (SELECT max(timestamp) FROM {files}
+                    WHERE archive_name = :archive_name AND synced = 1),
+                :now
+        """.format(files=SupRsyncFile.__tablename__,
+                   stats=ArchiveStats.__tablename__))
+        params = {'archive_name': archive_name, 'now': time.time()}
 
-        finalized_until = None
-        num_files_to_copy = 0
-        last_file_added = ''
-        last_file_copied = ''
+        if session is None:
+            with self.Session.begin() as session:
+                session.execute(stmt, params)
+        else:
+            session.execute(stmt, params)
 
-        for f in files:
-            last_file_added = f.local_path
-            if (f.local_md5sum == f.remote_md5sum):
-                last_file_copied = f.local_path
+    def get_archive_stats(self, archive_name, session=None):
+        """
+        Returns summary statistics for an archive. These are read from the
+        ArchiveStats table, which is recomputed in full if it has not been
+        in the last STATS_RECONCILE_INTERVAL seconds.
 
-            if (not f.ignore) and (f.local_md5sum != f.remote_md5sum):
-                num_files_to_copy += 1
+        Args
+        ------
+            archive_name : String
+                Archive name to get stats for
+            session : sqlalchemy session
+                SQLAlchemy session to use. If none is passed, will create a new
+                session and commit afterwards.
+        """
+        if session is None:
+            with self.Session.begin() as session:
+                return self.get_archive_stats(archive_name, session=session)
 
-            if finalized_until is None and not (f.ignore):
-                if f.local_md5sum != f.remote_md5sum:
-                    finalized_until = f.timestamp - 1
+        def query():
+            return session.query(ArchiveStats).filter(
+                ArchiveStats.archive_name == archive_name,
+            ).execution_options(populate_existing=True).one_or_none()
 
-        # There are no more uncopied files that aren't ignored
-        if finalized_until is None:
-            finalized_until = time.time()
+        row = query()
+        if row is None or row.reconciled is None or \
+                time.time() - row.reconciled > STATS_RECONCILE_INTERVAL:
+            self.reconcile_archive_stats(archive_name, session=session)
+            row = query()
 
         stats = {
-            'finalized_until': finalized_until,
-            'num_files': len(files),
-            'uncopied_files': num_files_to_copy,
-            'last_file_added': last_file_added,
-            'last_file_copied': last_file_copied,
+            'finalized_until': self.get_finalized_until(archive_name, session=session),
+            'num_files': row.num_files,
+            'uncopied_files': row.uncopied_files,
+            'last_file_added': row.last_file_added,
+            'last_file_copied': row.last_file_copied,
         }
 
         return stats
@@ -267,17 +511,15 @@ class SupRsyncFilesManager:
         if session is None:
             session = self.Session()
 
-        query = session.query(SupRsyncFile).filter(
+        first_uncopied = session.query(func.min(SupRsyncFile.timestamp)).filter(
             SupRsyncFile.archive_name == archive_name,
-        ).order_by(asc(SupRsyncFile.timestamp))
+            SupRsyncFile.ignore == False,  # noqa: E712
+            SupRsyncFile.synced == False,  # noqa: E712
+        ).scalar()
 
-        for file in query.all():
-            if file.ignore:
-                continue
-            if file.local_md5sum != file.remote_md5sum:
-                return file.timestamp - 1
-        else:
+        if first_uncopied is None:
             return time.time()
+        return first_uncopied - 1
 
     def add_file(self, local_path, remote_path, archive_name,
                  local_md5sum=None, timestamp=None, session=None,
@@ -325,6 +567,8 @@ class SupRsyncFilesManager:
          - local and remote md5sums do not match
          - Failed copy attempts is below the max number of attempts
 
+        Files are returned oldest first.
+
         Args
         ----
             archive_name : string
@@ -345,21 +589,17 @@ class SupRsyncFilesManager:
             max_copy_attempts = 2**10
 
         query = session.query(SupRsyncFile).filter(
-            SupRsyncFile.removed == None,  # noqa: E711
             SupRsyncFile.archive_name == archive_name,
-            SupRsyncFile.failed_copy_attempts < max_copy_attempts,
             SupRsyncFile.ignore == False,  # noqa: E712
-        )
+            SupRsyncFile.synced == False,  # noqa: E712
+            SupRsyncFile.removed == None,  # noqa: E711
+            SupRsyncFile.failed_copy_attempts < max_copy_attempts,
+        ).order_by(asc(SupRsyncFile.timestamp))
 
-        files = []
-        for f in query.all():
-            if f.local_md5sum != f.remote_md5sum:
-                files.append(f)
-            if num_files is not None:
-                if len(files) >= num_files:
-                    break
+        if num_files is not None:
+            query = query.limit(num_files)
 
-        return files
+        return query.all()
 
     def get_deletable_files(self, archive_name, delete_after, session=None):
         """
@@ -381,19 +621,14 @@ class SupRsyncFilesManager:
             session = self.Session()
 
         query = session.query(SupRsyncFile).filter(
-            SupRsyncFile.removed == None,  # noqa: E711
             SupRsyncFile.archive_name == archive_name,
+            SupRsyncFile.removed == None,  # noqa: E711
+            SupRsyncFile.timestamp < time.time() - delete_after,
+            SupRsyncFile.synced == True,  # noqa: E712
             SupRsyncFile.deletable,
         )
 
-        files = []
-        now = time.time()
-        for f in query.all():
-            if f.local_md5sum == f.remote_md5sum:
-                if now > f.timestamp + delete_after:
-                    files.append(f)
-
-        return files
+        return query.all()
 
     def get_known_files(self, archive_name, session=None, min_ctime=None):
         """Gets all files.  This can be used to help avoid
@@ -422,6 +657,89 @@ class SupRsyncFilesManager:
 
         return list(query.all())
 
+    def add_files(self, files, session=None, deletable=True):
+        """
+        Adds many files to the SupRsyncFiles table at once. The timecode dirs
+        of all files are created with one query, and the files are inserted
+        in bulk.
+
+        Args
+        ----
+            files : list
+                Files to add. Each entry is either a SupRsyncFile, e.g. made
+                with ``create_file``, or a tuple of (local_path, remote_path,
+                archive_name), for which the md5sums are computed in
+                parallel.
+            session : sqlalchemy session
+                Session to use to add the files. If None, will create a new
+                session and commit afterwards.
+            deletable : bool
+                If true, files given as tuples can be deleted by suprsync
+                agent
+
+        Returns
+        -------
+            num_files : int
+                Number of files added
+        """
+        if session is None:
+            with self.Session.begin() as session:
+                return self.add_files(files, session=session,
+                                      deletable=deletable)
+
+        md5sums = [submit_md5sum(str(f[0])) if isinstance(f, tuple) else None
+                   for f in files]
+        rows = []
+        for f, md5sum in zip(files, md5sums):
+            if isinstance(f, tuple):
+                local_path, remote_path, archive_name = f
+                f = create_file(local_path, remote_path, archive_name,
+                                local_md5sum=md5sum.result(),
+                                deletable=deletable)
+            rows.append({
+                'local_path': f.local_path,
+                'local_md5sum': f.local_md5sum,
+                'archive_name': f.archive_name,
+                'remote_path': f.remote_path,
+                'timestamp': f.timestamp,
+                'failed_copy_attempts': f.failed_copy_attempts or 0,
+                'deletable': True if f.deletable is None else f.deletable,
+                'ignore': bool(f.ignore),
+                'synced': False,
+                'timecode': check_timecode(f),
+            })
+
+        if not rows:
+            return 0
+
+        self._add_tcdirs(
+            {(r['archive_name'], r['timecode']) for r in rows
+             if r['timecode'] is not None}, session)
+        session.execute(insert(SupRsyncFile), rows)
+        return len(rows)
+
+    def _add_tcdirs(self, timecodes, session):
+        """
+        Creates the TimecodeDirs that do not exist yet.
+
+        Args
+        ----
+            timecodes : set of (str, int)
+                (archive_name, timecode) of each TimecodeDir.
+            session : sqlalchemy session
+                Session to add the TimecodeDirs to.
+        """
+        for archive_name in {a for a, _ in timecodes}:
+            tcs = {tc for a, tc in timecodes if a == archive_name}
+            existing = {tc for tc, in session.query(TimecodeDir.timecode).filter(
+                TimecodeDir.archive_name == archive_name,
+                TimecodeDir.timecode.in_(tcs),
+            )}
+            session.add_all([
+                TimecodeDir(timecode=tc, archive_name=archive_name)
+                for tc in sorted(tcs - existing)
+            ])
+
     def _add_file_tcdir(self, file: SupRsyncFile, session):
         """
         Creates and adds a TimecodeDir for a file if possible.  This will
@@ -446,110 +764,242 @@ class SupRsyncFilesManager:
         return tcdir
 
     def create_all_timecode_dirs(self, archive_name, min_ctime=None):
-        with self.Session.begin() as session:
-            files = self.get_known_files(
-                archive_name, session=session, min_ctime=min_ctime)
-            for file in files:
-                self._add_file_tcdir(file, session)
+        """
+        Creates TimecodeDirs for all files of an archive, if they don't
+        already exist.
+
+        Args
+        ------
+            archive_name : str
+                Name of archive to create TimecodeDirs for
+            min_ctime : float, optional
+                Only consider files added after this time.
+        """
+        if min_ctime is None:
+            min_ctime = 0
 
-    def update_all_timecode_dirs(self, archive_name, file_root, sync_id):
         with self.Session.begin() as session:
-            tcdirs = session.query(TimecodeDir).filter(
-                TimecodeDir.archive_name == archive_name,
-            ).all()
-            for tcdir in tcdirs:
-                self._update_tcdir(tcdir, session, file_root, sync_id)
+            tcs = session.query(SupRsyncFile.timecode).filter(
+                SupRsyncFile.archive_name == archive_name,
+                SupRsyncFile.timestamp > min_ctime,
+                SupRsyncFile.timecode != None,  # noqa: E711
+            ).distinct()
+            self._add_tcdirs({(archive_name, tc) for tc, in tcs}, session)
 
-    def _update_tcdir(self, tcdir, session, file_root, sync_id):
+    def update_all_timecode_dirs(self, archive_name, file_root, sync_id):
         """
-        Takes the next series of actions for a timecode dir object.
+        Takes the next series of actions for all unfinalized timecode dirs of
+        an archive, in a single transaction:
         - If we expect no more files to be added to the tc dir, marks it as
           complete
         - If all files in the tc dir have been synced, marks it as synced
         - If the tc dir is synced and not finalized, creates the finalization
           file and marks as finalized.
         """
-        if tcdir.finalized:
-            return
-
         now = time.time()
+        with self.Session.begin() as session:
+            tcdirs = session.query(TimecodeDir).filter(
+                TimecodeDir.archive_name == archive_name,
+                TimecodeDir.finalized == False,  # noqa: E712
+            ).order_by(asc(TimecodeDir.timecode)).all()
+            if not tcdirs:
+                return
 
-        if not tcdir.completed:
-            all_tcs = session.query(TimecodeDir.timecode).all()
-            for tc, in all_tcs:
-                if tc > tcdir.timecode:
-                    # Mark as complete if there's a timecode after this one
-                    tcdir.completed = True
-                    break
-            else:
-                # No timecodes after this one. Mark after complete if we are
-                # over a full day away.
-                if (now // 1e5 - tcdir.timecode) > DAYS_TO_COMPLETE_TCDIR:
+            max_tc = session.query(func.max(TimecodeDir.timecode)).filter(
+                TimecodeDir.archive_name == archive_name,
+            ).scalar()
+            for tcdir in tcdirs:
+                # Mark as complete if there's a timecode after this one, or if
+                # we are over a full day away.
+                if not tcdir.completed and (
+                        max_tc > tcdir.timecode
+                        or (now // 1e5 - tcdir.timecode) > DAYS_TO_COMPLETE_TCDIR):
                     tcdir.completed = True
 
-        # Gets all files in this tcdir
-        files = session.query(SupRsyncFile).filter(
-            SupRsyncFile.remote_path.like(f'{tcdir.timecode}/%')
-        ).all()
+            # Number of files and of synced files in each tcdir
+            to_check = [tcdir for tcdir in tcdirs
+                        if tcdir.completed and not tcdir.synced]
+            counts = {}
+            if to_check:
+                counts = {tc: (n, nsynced) for tc, n, nsynced in session.query(
+                    SupRsyncFile.timecode, func.count(),
+                    func.sum(SupRsyncFile.synced, type_=Integer),
+                ).filter(
+                    SupRsyncFile.archive_name == archive_name,
+                    SupRsyncFile.timecode.in_([t.timecode for t in to_check]),
+                ).group_by(SupRsyncFile.timecode)}
+            for tcdir in to_check:
+                n, nsynced = counts.get(tcdir.timecode, (0, 0))
+                tcdir.synced = (n == nsynced)
+
+            to_finalize = [tcdir for tcdir in tcdirs if tcdir.synced]
+            if not to_finalize:
+                return
 
-        if tcdir.completed and not tcdir.synced:
-            for f in files:
-                if f.local_md5sum != f.remote_md5sum:
-                    break  # File is not synced properly
-            else:
-                tcdir.synced = True
-
-        if tcdir.synced and not tcdir.finalized:  # Finalize file
             # Get subdirs this suprsync instance is responsible for
-            subdirs = set()
-            for f in files:
-                split = split_path(f.remote_path)
+            num_files = {tcdir.timecode: 0 for tcdir in to_finalize}
+            subdirs = {tcdir.timecode: set() for tcdir in to_finalize}
+            for tc, remote_path in session.query(
+                    SupRsyncFile.timecode, SupRsyncFile.remote_path,
+            ).filter(
+                SupRsyncFile.archive_name == archive_name,
+                SupRsyncFile.timecode.in_(list(num_files)),
+            ):
+                num_files[tc] += 1
+                split = split_path(remote_path)
                 if len(split) > 2:
-                    subdirs.add(split[1])
-
-            tcdir_summary = {
-                'timecode': tcdir.timecode,
-                'num_files': len(files),
-                'subdirs': list(subdirs),
-                'finalized_at': now,
-                'finalized_until': self.get_finalized_until(tcdir.archive_name),
-                'archive_name': tcdir.archive_name,
-                'instance_id': sync_id
-            }
-
-            tc = int(now // 1e5)
-            timestamp = int(now)
-            fname = f'{timestamp}_{tcdir.archive_name}_{tcdir.timecode}_finalized.yaml'
-            finalize_local_path = os.path.join(
-                file_root, str(tc), sync_id, fname,
-            )
-            finalize_remote_path = os.path.join(
-                str(tc), 'suprsync', sync_id, fname
-            )
-            os.makedirs(os.path.dirname(finalize_local_path), exist_ok=True)
-            with open(finalize_local_path, 'w') as f:
-                yaml.dump(tcdir_summary, f)
+                    subdirs[tc].add(split[1])
 
-            file = self.add_file(
-                finalize_local_path, finalize_remote_path, tcdir.archive_name,
-                session=session, timestamp=now
-            )
-            session.add(file)
-            session.flush()
+            finalized_until = self.get_finalized_until(archive_name, session=session)
+            for tcdir in to_finalize:
+                self._finalize_tcdir(
+                    tcdir, session, file_root, sync_id, now,
+                    num_files[tcdir.timecode], subdirs[tcdir.timecode],
+                    finalized_until)
 
-            tcdir.finalized = True
-            tcdir.finalize_file_id = file.id
+    def _finalize_tcdir(self, tcdir, session, file_root, sync_id, now,
+                        num_files, subdirs, finalized_until):
+        """
+        Creates the finalization file for a synced timecode dir, adds it to
+        the db, and marks the timecode dir as finalized.
+        """
+        tcdir_summary = {
+            'timecode': tcdir.timecode,
+            'num_files': num_files,
+            'subdirs': list(subdirs),
+            'finalized_at': now,
+            'finalized_until': finalized_until,
+            'archive_name': tcdir.archive_name,
+            'instance_id': sync_id
+        }
+
+        tc = int(now // 1e5)
+        timestamp = int(now)
+        fname = f'{timestamp}_{tcdir.archive_name}_{tcdir.timecode}_finalized.yaml'
+        finalize_local_path = os.path.join(
+            file_root, str(tc), sync_id, fname,
+        )
+        finalize_remote_path = os.path.join(
+            str(tc), 'suprsync', sync_id, fname
+        )
+        os.makedirs(os.path.dirname(finalize_local_path), exist_ok=True)
+        with open(finalize_local_path, 'w') as f:
+            yaml.dump(tcdir_summary, f)
+
+        file = self.add_file(
+            finalize_local_path, finalize_remote_path, tcdir.archive_name,
+            session=session, timestamp=now
+        )
+        session.add(file)
+        session.flush()
+
+        tcdir.finalized = True
+        tcdir.finalize_file_id = file.id
+
+
+def split_bwlimit(bwlimit, num_workers):
+    """
+    Splits an rsync ``--bwlimit`` value evenly between concurrent workers.
+
+    Args
+    ----
+        bwlimit : str
+            Bandwidth limit as passed to rsync, i.e. a rate in KiB/s with an
+            optional K, M or G suffix.
+        num_workers : int
+            Number of rsync processes sharing the limit.
+
+    Returns
+    -------
+        bwlimit : str
+            Bandwidth limit for each worker, in KiB/s.
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([kmg]?)\s*', str(bwlimit),
+                         flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f"Could not parse bwlimit '{bwlimit}'")
+    scale = {'': 1, 'k': 1, 'm': 1024, 'g': 1024**2}[match.group(2).lower()]
+    rate = float(match.group(1)) * scale
+    if rate > 0:
+        # rsync treats 0 as no limit, so keep each share above that.
+        rate = max(rate / num_workers, 1)
+    return f'{rate:g}'
+
+
+def parse_md5sum_output(output):
+    """
+    Parses the output of ``md5sum``.
+
+    Returns
+    -------
+        md5sums : dict
+            Map from normalized path to md5sum.
+    """
+    md5sums = {}
+    for line in output.split('\n'):
+        split = line.split()
+
+        # If file cannot be found, line will say:
+        # "md5sum: file: No such file or directory
+        if len(split) != 2:
+            continue
+
+        md5sum, path = split
+        md5sums[os.path.normpath(path)] = md5sum
+    return md5sums
+
+
+def parse_rsync_checksums(output, remote_basedir):
+    """
+    Parses the output of rsync run with ``--checksum-choice=md5`` and
+    ``--out-format='%C %n'``. For each transferred file this contains the
+    whole-file md5sum that the receiver verified against the data it wrote.
+    Files that were not transferred, e.g. because they were already up to
+    date, are not listed.
+
+    Returns
+    -------
+        md5sums : dict
+            Map from normalized remote path to md5sum.
+    """
+    md5sums = {}
+    for line in output.split('\n'):
+        split = line.split(' ', 1)
+        if len(split) != 2 or len(split[0]) != 32:
+            continue
+        md5sum, path = split
+        try:
+            int(md5sum, 16)
+        except ValueError:
+            continue
+        remote_path = os.path.normpath(os.path.join(remote_basedir, path))
+        md5sums[remote_path] = md5sum
+    return md5sums
 
 
 class SupRsyncFileHandler:
     """
     Helper class to handle files in the suprsync db and copy them to their
     dest / delete them if enough time has passed.
+
+    Files are copied by up to ``num_workers`` concurrent rsync processes, each
+    transferring a disjoint batch of files. The size of each batch is limited
+    so that no more than ``max_bytes_in_flight`` bytes are being transferred
+    at once, and ``bwlimit`` is shared evenly between the workers.
+
+    Copies are verified according to ``verify_mode``:
+
+    - ``'md5sum'``: runs ``md5sum`` on the remote over every copied file.
+    - ``'rsync'``: uses the md5sum that rsync computes and verifies while
+      transferring each file (requires rsync >= 3.2 on both ends), and only
+      runs ``md5sum`` on the remote for files that rsync did not transfer.
+      This avoids reading every file a second time on the remote.
     """
 
     def __init__(self, file_manager, archive_name, remote_basedir,
                  ssh_host=None, ssh_key=None, cmd_timeout=None,
-                 copy_timeout=None, compression=None, bwlimit=None):
+                 copy_timeout=None, compression=None, bwlimit=None,
+                 num_workers=1, max_bytes_in_flight=None, verify_mode='md5sum'):
         self.srfm = file_manager
         self.archive_name = archive_name
         self.ssh_host = ssh_host
@@ -560,6 +1010,18 @@ class SupRsyncFileHandler:
         self.copy_timeout = copy_timeout
         self.compression = compression
         self.bwlimit = bwlimit
+        self.num_workers = max(int(num_workers), 1)
+        self.max_bytes_in_flight = max_bytes_in_flight
+        if verify_mode not in ['md5sum', 'rsync']:
+            raise ValueError(f"Unknown verify_mode '{verify_mode}'")
+        self.verify_mode = verify_mode
+
+        self.worker_bwlimit = None
+        if bwlimit:
+            self.worker_bwlimit = split_bwlimit(bwlimit, self.num_workers)
+
+        # Transfer stats for each worker over the last call to copy_files
+        self.worker_stats = {}
 
     def run_on_remote(self, cmd, timeout=None):
         """
@@ -587,10 +1049,169 @@ class SupRsyncFileHandler:
                            cmd=_cmd, err=res.stderr.decode())
         return res
 
+    def _make_batches(self, files):
+        """
+        Splits files into batches, one per worker, with each batch limited
+        to its share of max_bytes_in_flight. Every batch holds at least one
+        file.
+
+        Returns
+        -------
+            batches : list of list of (SupRsyncFile, int)
+                Files of each batch with their sizes in bytes.
+        """
+        batch_len = -(-len(files) // self.num_workers)
+        batch_bytes = None
+        if self.max_bytes_in_flight is not None:
+            batch_bytes = self.max_bytes_in_flight / self.num_workers
+
+        batches = [[]]
+        nbytes = 0
+        for file in files:
+            try:
+                size = os.path.getsize(file.local_path)
+            except OSError:
+                size = 0
+            batch = batches[-1]
+            if batch and (len(batch) >= batch_len or (
+                    batch_bytes is not None and nbytes + size > batch_bytes)):
+                batch = []
+                batches.append(batch)
+                nbytes = 0
+            batch.append((file, size))
+            nbytes += size
+        return batches
+
+    def _prepare_batch(self, batch, tmp_dir):
+        """
+        Creates a temp directory with the remote dir structure of symlinks
+        for rsync to copy.
+
+        Returns
+        -------
+            file_map : dict
+                Map from normalized remote path to (SupRsyncFile, size) for
+                each file to be copied.
+        """
+        file_map = {}
+        for file, size in batch:
+            self.log.info(f"- {file.local_path}")
+            tmp_path = os.path.join(tmp_dir, file.remote_path)
+            os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+
+            if not os.path.exists(file.local_path):
+                self.log.warn("Cannot find file {path}", path=file.local_path)
+                file.failed_copy_attempts += 1
+                continue
+
+            if os.path.exists(tmp_path):
+                self.log.warn("Temp file {path} already exists!", path=tmp_path)
+                file.failed_copy_attempts += 1
+                continue
+
+            os.symlink(file.local_path, tmp_path)
+
+            remote_path = os.path.normpath(
+                os.path.join(self.remote_basedir, file.remote_path)
+            )
+            file_map[remote_path] = (file, size)
+        return file_map
+
+    def _transfer_batch(self, tmp_dir, remote_paths):
+        """
+        Runs rsync on a prepared batch, and gets remote md5sums according to
+        ``verify_mode``. This is run in a worker thread, so it must not touch
+        the db.
+
+        Returns
+        -------
+            md5sums : dict
+                Map from normalized remote path to remote md5sum.
+            transfer_time : float
+                Time (sec) taken by rsync.
+        """
+        if self.ssh_host is not None:
+            dest = self.ssh_host + ':' + self.remote_basedir
+        else:
+            dest = self.remote_basedir
+
+        cmd = ['rsync', '-Lrt']
+        if self.compression:
+            cmd.append('-z')
+        if self.worker_bwlimit:
+            cmd.append(f'--bwlimit={self.worker_bwlimit}')
+        if self.ssh_key is not None:
+            cmd.extend(['--rsh', f'ssh -i {self.ssh_key}'])
+        if self.verify_mode == 'rsync':
+            cmd.extend(['--checksum-choice=md5', '--out-format=%C %n'])
+        cmd.extend([tmp_dir + '/', dest])
+
+        start = time.time()
+        res = subprocess.run(cmd, stdout=subprocess.PIPE, check=True,
+                             timeout=self.copy_timeout)
+        transfer_time = time.time() - start
+
+        md5sums = {}
+        if self.verify_mode == 'rsync':
+            md5sums = parse_rsync_checksums(res.stdout.decode(),
+                                            self.remote_basedir)
+
+        unverified = [p for p in remote_paths if p not in md5sums]
+        if unverified:
+            self.log.info("Checksumming {n} files on remote.", n=len(unverified))
+            res = self.run_on_remote(['md5sum'] + unverified)
+            md5sums.update(parse_md5sum_output(res.stdout.decode()))
+
+        return md5sums, transfer_time
+
+    def _finish_batch(self, future, worker, file_map, output, errors):
+        """
+        Records the result of a transferred batch in the db, and updates the
+        worker's stats.
+        """
+        try:
+            md5sums, transfer_time = future.result()
+        except (subprocess.TimeoutExpired, subprocess.CalledProcessError) as e:
+            errors.append(e)
+            return
+
+        now = time.time()
+        nbytes = 0
+        for remote_path, (file, size) in file_map.items():
+            file.copied = now
+            if remote_path in md5sums:
+                file.remote_md5sum = md5sums[remote_path]
+
+            md5_ok = (file.remote_md5sum == file.local_md5sum)
+            file.synced = md5_ok
+            output.append((file.local_path, md5_ok))
+            if md5_ok:
+                nbytes += size
+            else:
+                file.failed_copy_attempts += 1
+                self.log.info(
+                    f"Copy failed for file {file.local_path}! "
+                    f"(copy attempts: {file.failed_copy_attempts})"
+                )
+                self.log.info(f"Local md5: {file.local_md5sum}, "
+                              f"remote_md5: {file.remote_md5sum}")
+
+        stats = self.worker_stats.setdefault(
+            worker, {'files': 0, 'bytes': 0, 'transfer_time': 0.})
+        stats['files'] += len(file_map)
+        stats['bytes'] += nbytes
+        stats['transfer_time'] += transfer_time
+        stats['throughput'] = stats['bytes'] / max(stats['transfer_time'], 1e-6)
+
     def copy_files(self, max_copy_attempts=None, num_files=None):
         """
         Copies a batch of files, and computes remote md5sums.
 
+        The files are split into disjoint batches that are transferred by up
+        to ``num_workers`` concurrent rsync processes. Each batch is prepared
+        while the previous ones are transferring. Per-worker transfer stats
+        are stored in ``worker_stats``.
+
         Args
         ----
             max_copy_attempts : int
@@ -603,8 +1224,16 @@ class SupRsyncFileHandler:
             copy_attempts : list of (str, bool)
                 Each entry of the list provides the path to the copied file,
                 and a bool indicating wheter the remote md5sum matched.
+
+        Raises
+        ------
+            subprocess.TimeoutExpired, subprocess.CalledProcessError
+                If any rsync or remote md5sum command fails. Results of the
+                other batches are committed before this is raised.
         """
         output = []
+        errors = []
+        self.worker_stats = {}
         with self.srfm.Session.begin() as session:
             files = self.srfm.get_copyable_files(
                 self.archive_name, max_copy_attempts=max_copy_attempts,
@@ -614,83 +1243,39 @@ class SupRsyncFileHandler:
             if not files:
                 return []
 
-            if self.ssh_host is not None:
-                dest = self.ssh_host + ':' + self.remote_basedir
-            else:
-                dest = self.remote_basedir
-
-            # Creates temp directory with remote dir structure of symlinks for
-            # rsync to copy.
-            file_map = {}
-            remote_paths = []
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                self.log.info("Copying files:")
-                for file in files:
-                    self.log.info(f"- {file.local_path}")
-                    tmp_path = os.path.join(tmp_dir, file.remote_path)
-                    os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
-
-                    if not os.path.exists(file.local_path):
-                        self.log.warn("Cannot find file {path}", path=file.local_path)
-                        file.failed_copy_attempts += 1
-                        continue
-
-                    if os.path.exists(tmp_path):
-                        self.log.warn("Temp file {path} already exists!", path=tmp_path)
-                        file.failed_copy_attempts += 1
+            self.log.info("Copying files:")
+            free_workers = list(range(self.num_workers))
+            running = {}
+            with tempfile.TemporaryDirectory() as tmp_root, \
+                    ThreadPoolExecutor(self.num_workers) as pool:
+                for i, batch in enumerate(self._make_batches(files)):
+                    tmp_dir = os.path.join(tmp_root, str(i))
+                    file_map = self._prepare_batch(batch, tmp_dir)
+                    if not file_map:
                         continue
 
-                    os.symlink(file.local_path, tmp_path)
-
-                    remote_path = os.path.normpath(
-                        os.path.join(self.remote_basedir, file.remote_path)
-                    )
-                    remote_paths.append(remote_path)
-                    file_map[remote_path] = file
-
-                cmd = ['rsync', '-Lrt']
-                if self.compression:
-                    cmd.append('-z')
-                if self.bwlimit:
-                    cmd.append(f'--bwlimit={self.bwlimit}')
-                if self.ssh_key is not None:
-                    cmd.extend(['--rsh', f'ssh -i {self.ssh_key}'])
-                cmd.extend([tmp_dir + '/', dest])
-
-                subprocess.run(cmd, check=True, timeout=self.copy_timeout)
-
-            for file in files:
-                file.copied = time.time()
-
-            self.log.info("Checksumming on remote.")
-            res = self.run_on_remote(['md5sum'] + remote_paths)
-            for line in res.stdout.decode().split('\n'):
-                split = line.split()
-
-                # If file cannot be found, line will say:
-                # "md5sum: file: No such file or directory
-                if len(split) != 2:
-                    continue
+                    if not free_workers:
+                        done, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            worker, _file_map = running.pop(future)
+                            self._finish_batch(future, worker, _file_map,
+                                               output, errors)
+                            free_workers.append(worker)
 
-                md5sum, path = line.split()
-                key = os.path.normpath(path)
-                if key in file_map:
-                    file_map[key].remote_md5sum = md5sum
+                    worker = free_workers.pop(0)
+                    future = pool.submit(self._transfer_batch, tmp_dir,
+                                         list(file_map))
+                    running[future] = (worker, file_map)
 
-            for file in files:
-                md5_ok = (file.remote_md5sum == file.local_md5sum)
-                output.append((file.local_path, md5_ok))
-                if not md5_ok:
-                    file.failed_copy_attempts += 1
-                    self.log.info(
-                        f"Copy failed for file {file.local_path}! "
-                        f"(copy attempts: {file.failed_copy_attempts})"
-                    )
-                    self.log.info(f"Local md5: {file.local_md5sum}, "
-                                  f"remote_md5: {file.remote_md5sum}")
+                for future in as_completed(running):
+                    worker, file_map = running[future]
+                    self._finish_batch(future, worker, file_map, output, errors)
 
             self.log.info("Copy session complete.")
 
+        if errors:
+            raise errors[0]
+
         return output
 
     def delete_files(self, delete_after):
@@ -50,7 +50,7 @@ def add_local_files_func(args):
     args.local_root = os.path.abspath(args.local_root)
 
     known_files = srfm.get_known_files(args.archive_name)
-    known_paths = [f.local_path for f in known_files]
+    known_paths = {f.local_path for f in known_files}
     local_paths = []
     remote_paths = []
     now = time.time()
@@ -77,8 +77,13 @@ def add_local_files_func(args):
         return
 
     print(f"Adding {len(local_paths)} files to the add to {args.db} from {args.local_root}")
-    for i in trange(len(local_paths)):
-        srfm.add_file(local_paths[i], remote_paths[i], args.archive_name)
+    batch_size = 1000
+    for i in trange(0, len(local_paths), batch_size):
+        srfm.add_files([
+            (local_path, remote_path, args.archive_name)
+            for local_path, remote_path in zip(local_paths[i:i + batch_size],
+                                               remote_paths[i:i + batch_size])
+        ])
 
 
 def main():
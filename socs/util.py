@@ -1,9 +1,90 @@
 import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+#: Size (bytes) of the buffer used to read files in get_md5sum
+MD5_BUFFER_SIZE = 1 << 20
+
+#: Max number of checksums kept in the get_md5sum cache
+MD5_CACHE_SIZE = 10000
+
+#: Number of worker threads used by submit_md5sum
+MD5_WORKERS = 4
+
+_md5_cache = OrderedDict()
+_md5_lock = threading.Lock()
+_md5_pool = None
+
+
+def get_md5sum(filename, use_mmap=False, buffer_size=MD5_BUFFER_SIZE,
+               use_cache=True):
+    """Computes the md5sum of a file.
+
+    The file is read in fixed-size chunks into a reused buffer, or through a
+    memory map if ``use_mmap`` is set. Checksums are cached by path, size,
+    modification time and inode, so an unchanged file is only read once.
+
+    Args:
+        filename (str): Path of the file.
+        use_mmap (bool): If True, hash the file through a memory map instead
+            of reading it into a buffer.
+        buffer_size (int): Size of the read buffer in bytes.
+        use_cache (bool): If True, look up and store the checksum in the
+            cache.
+
+    Returns:
+        str: Hex digest of the md5sum.
+
+    """
+    st = os.stat(filename)
+    key = (os.path.abspath(filename), st.st_size, st.st_mtime_ns, st.st_ino)
+    if use_cache:
+        with _md5_lock:
+            if key in _md5_cache:
+                _md5_cache.move_to_end(key)
+                return _md5_cache[key]
 
-def get_md5sum(filename):
     m = hashlib.md5()
+    with open(filename, 'rb') as f:
+        if use_mmap and st.st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                m.update(mm)
+        else:
+            buf = bytearray(buffer_size)
+            view = memoryview(buf)
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                m.update(view[:n])
+    md5sum = m.hexdigest()
+
+    if use_cache:
+        with _md5_lock:
+            _md5_cache[key] = md5sum
+            while len(_md5_cache) > MD5_CACHE_SIZE:
+                _md5_cache.popitem(last=False)
+    return md5sum
+
+
+def submit_md5sum(filename, **kwargs):
+    """Computes the md5sum of a file in a shared pool of worker threads.
+
+    Args:
+        filename (str): Path of the file.
+        **kwargs: Passed on to :func:`get_md5sum`.
+
+    Returns:
+        concurrent.futures.Future: Future resolving to the hex digest of the
+        md5sum.
 
-    for line in open(filename, 'rb'):
-        m.update(line)
-    return m.hexdigest()
+    """
+    global _md5_pool
+    with _md5_lock:
+        if _md5_pool is None:
+            _md5_pool = ThreadPoolExecutor(MD5_WORKERS,
+                                           thread_name_prefix='md5sum')
+    return _md5_pool.submit(get_md5sum, filename, **kwargs)
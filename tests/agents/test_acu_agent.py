@@ -1,5 +1,14 @@
+import itertools
+import time
+from unittest import mock
+
+import numpy as np
+import pytest
+from ocs.ocs_feed import Feed
+
 from socs.agents.acu import avoidance as av
-from socs.agents.acu.agent import ACUAgent  # noqa: F401
+from socs.agents.acu import drivers as acu_drivers
+from socs.agents.acu.agent import compile_monitor_routes, influx_status_blocks
 
 
 def test_avoidance():
@@ -21,6 +30,26 @@ def test_avoidance():
     assert sun.check_trajectory([90], [20])['sun_time'] > 0
     assert sun.check_trajectory([270], [60])['sun_time'] > 0
 
+    # Batched checks match individual ones.
+    trajs = [([90], [60]), ([90, 180, 270], [20, 20, 20]), ([270], [60])]
+    for traj, info in zip(trajs, sun.check_trajectories(trajs)):
+        single = sun.check_trajectory(*traj)
+        for k, v in single.items():
+            assert abs(info[k] - v) < 1e-9
+
+    # Horizon grid look-ups agree, erring on the safe side, including
+    # near the edge of the exclusion disk.
+    assert sun.lookup_sun_time(90, 60) == 0
+    assert sun.lookup_sun_time(270, 60) > 0
+    azs, els = np.meshgrid(np.arange(0, 360, 1.3), np.arange(-10, 90, 1.1))
+    azs = np.hstack((azs.ravel(), az + np.linspace(-30, 30, 500)))
+    els = np.hstack((els.ravel(), el + np.linspace(-25, 25, 500)[::-1]))
+    for dt in [0, 30, 3600 * 5]:
+        grid = sun.lookup_sun_time(azs, els, t=t0 + dt)
+        exact = sun.check_trajectories(list(zip(azs[:, None], els[:, None])),
+                                       t=t0 + dt)
+        assert np.all(grid <= [info['sun_time'] for info in exact])
+
     # Find safe paths
     paths = sun.analyze_paths(180, 30, 270, 40)
     path, analysis = sun.select_move(paths)
@@ -53,3 +82,112 @@ def test_avoidance():
     assert path is not None
     path = sun.find_escape_paths(az0 + 10, el0)
     assert path is not None
+
+
+def _reference_scan_points(az, endpoints, increasing, az_speed, acc, step_time,
+                           num_scans, n_max, drift=None):
+    # Point-by-point ProgramTrack scan, as generated before vectorization.
+    daz = step_time * az_speed
+    turntime = 2.0 * az_speed / acc
+
+    def get_target(az, t, increasing):
+        target = max(endpoints) if increasing else min(endpoints)
+        if drift is not None:
+            v = az_speed if increasing else -az_speed
+            target = target + drift / (v - drift) * (target - az + v * t)
+        return target
+
+    t, az_flag, group = 0, 0, 0
+    az_vel = az_speed if increasing else -az_speed
+    target_az = get_target(az, t, increasing)
+    points = []
+    while len(points) < n_max:
+        points.append([t, az, az_vel, az_flag, int(group > 0)])
+        group = max(group - 1, 0)
+        sign = 1 if increasing else -1
+        if (az <= target_az - 2 * daz) if increasing else (az >= target_az + 2 * daz):
+            t, az, az_vel, az_flag = t + step_time, az + sign * daz, sign * az_speed, 1
+        elif az == target_az:
+            t, az_vel, az_flag = t + turntime, -sign * az_speed, 1
+            increasing = not increasing
+            target_az = get_target(az, t, increasing)
+            group = acu_drivers.MIN_GROUP_NEW_LEG - 1
+            if num_scans is not None:
+                num_scans -= 1
+                if num_scans == 0:
+                    points[-1][2] = 0
+                    break
+        else:
+            t += sign * (target_az - az) / az_speed
+            az, az_vel, az_flag = target_az, sign * az_speed, 2
+    return points
+
+
+@pytest.mark.parametrize('num_scans,drift,step_time', [
+    (None, None, 1.), (3, None, 0.05), (4, 0.01, 0.1), (None, -0.003, 0.2)])
+def test_generate_constant_velocity_scan(num_scans, drift, step_time):
+    kw = dict(az_endpoint1=120, az_endpoint2=180.5, az_speed=1.5, acc=2.,
+              el_endpoint1=50, el_endpoint2=50, num_scans=num_scans,
+              az_drift=drift, step_time=step_time, start_time=1.7e9,
+              az_start='mid_inc', batch_size=97)
+    batches = list(itertools.islice(
+        acu_drivers.generate_constant_velocity_scan(ptstack_fmt=False, **kw),
+        30))
+    assert all(len(b[0]) == 97 for b in batches[:-1])
+    t, az, _, az_vel, _, az_flag, _, group = [
+        sum([b[k] for b in batches], []) for k in range(8)]
+
+    ref = _reference_scan_points(150.25, (120, 180.5), True, 1.5, 2.,
+                                 step_time, num_scans, len(t), drift=drift)
+    assert len(ref) == len(t)
+    assert [p[0] + 1.7e9 for p in ref] == t
+    assert [p[1] for p in ref] == az
+    assert [p[2] for p in ref] == az_vel
+    assert [p[3] for p in ref] == az_flag
+    assert [p[4] for p in ref] == group
+
+    # Formatted lines match the time.strftime based formatting.
+    lines = acu_drivers.ptstack_format(t, az, [50] * len(t), az_vel,
+                                       [0] * len(t), az_flag, [0] * len(t),
+                                       start_offset=3, absolute=True)
+    for tt, line in zip(t[:200], lines):
+        tt = tt + 3
+        assert line.startswith(time.strftime('%j, %H:%M:%S', time.gmtime(tt))
+                               + ('%.6f' % (tt % 1.))[1:] + '; ')
+
+
+@mock.patch('ocs.ocs_feed.in_reactor_context', mock.MagicMock(return_value=True))
+def test_influx_status_blocks():
+    _, influx_keys = compile_monitor_routes({
+        'summary': {'Azimuth current position': 'Azimuth_current_position',
+                    'Elevation current position': 'Elevation_current_position'},
+        'axis_limits': {'Azimuth CCW limit: 2nd emergency': 'AzCCW_HWlimit_2ndEmergency'},
+        'corotator': {},
+    })
+    status = {'summary': {'Azimuth_current_position': 180.,
+                          'Elevation_current_position': 50.},
+              'axis_limits': {'AzCCW_HWlimit_2ndEmergency': 0},
+              'corotator': {}}
+    feed = Feed(mock.MagicMock(), 'acu_status_influx', record=True,
+                buffer_time=1)
+    last = {}
+
+    def poll(ctime):
+        blocks = influx_status_blocks(status, influx_keys, last, ctime)
+        for block in blocks:
+            feed.publish_message(block)
+        return {b['block_name']: b['data'] for b in blocks}
+
+    assert set(poll(100.)) == {'summary', 'axis_limits'}
+
+    # Changed categories are published with all of their fields, so that
+    # the recorded blocks keep their structure.
+    status['summary']['Elevation_current_position'] = 51.
+    assert poll(100.5) == {'summary': {'Azimuth_current_position_influx': 180.,
+                                       'Elevation_current_position_influx': 51.}}
+    status['summary']['Azimuth_current_position'] = 181.
+    assert list(poll(101.)) == ['summary']
+    assert poll(101.5) == {}
+
+    # All categories are refreshed after MONITOR_MAX_TIME_DELTA.
+    assert set(poll(104.)) == {'summary', 'axis_limits'}
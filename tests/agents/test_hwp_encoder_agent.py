@@ -1 +1,147 @@
-from socs.agents.hwp_encoder.agent import HWPBBBAgent  # noqa: F401
+import socket
+import struct
+from unittest import mock
+
+import numpy as np
+import pytest
+from ocs.ocs_agent import OpSession
+
+from socs.agents.hwp_encoder.agent import (COUNTER_INFO_LENGTH,
+                                           COUNTER_PACKET_SIZE,
+                                           IRIG_PACKET_SIZE, CounterBuffer,
+                                           EncoderParser, HWPBBBAgent)
+
+
+def make_counter_packet(start_index, quad=1):
+    clock = np.arange(COUNTER_INFO_LENGTH) * 1000 + start_index
+    overflow = np.ones(COUNTER_INFO_LENGTH, dtype=int)
+    index = np.arange(COUNTER_INFO_LENGTH) + start_index
+    return struct.pack('<II' + 'I' * 3 * COUNTER_INFO_LENGTH,
+                       0x1eaf, quad, *clock, *overflow, *index)
+
+
+def bcd(value):
+    # IRIG-B BCD: units in bits 0-3, tens in bits 5-8 (bit 4 is a marker)
+    return (value % 10) + ((value // 10) << 5)
+
+
+def make_irig_packet(sec=56, rising_edge=100):
+    # 2024 day 123 12:34:<sec>
+    info = [bcd(sec) << 1, bcd(34), bcd(12), bcd(23), 1, bcd(24), 0, 0, 0, 0]
+    return struct.pack('<' + 'I' * 33, 0xcafe, rising_edge, 2, *info,
+                       *range(10), *([1] * 10))
+
+
+def send(parser, data):
+    port = parser.sock.getsockname()[1]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.sendto(data, ('127.0.0.1', port))
+    parser.grab_and_parse_data()
+
+
+def test_encoder_parser_batches_packets():
+    parser = EncoderParser(beaglebone_port=0)
+    packets = make_counter_packet(0) + make_irig_packet() \
+        + make_counter_packet(COUNTER_INFO_LENGTH, quad=0)
+    assert len(packets) == 2 * COUNTER_PACKET_SIZE + IRIG_PACKET_SIZE
+    send(parser, packets)
+
+    assert len(parser.counter_queue) == 1
+    counter, counter_index, quad, _ = parser.counter_queue.popleft()
+    assert counter_index.tolist() == list(range(2 * COUNTER_INFO_LENGTH))
+    assert counter[0] == 1 << 32
+    assert quad.tolist() == [1, 0]
+
+    assert len(parser.irig_queue) == 1
+    rising_edge, irig_time, irig_info, synch, _, fields, clock_freq = \
+        parser.irig_queue.popleft()
+    assert rising_edge.tolist() == [100 + (2 << 32)]
+    assert irig_time.tolist() == [1714653296]
+    assert synch[0].tolist() == [i + (1 << 32) for i in range(10)]
+    assert fields['sec'] == [56] and fields['day'] == [123]
+    assert clock_freq == 2.e8
+
+
+def test_encoder_parser_fits_clock_freq():
+    parser = EncoderParser(beaglebone_port=0)
+    packets = b''.join(make_irig_packet(sec, 100 + 200001000 * i)
+                       for i, sec in enumerate(range(50, 54)))
+    send(parser, packets)
+    assert parser.clock_freq == 200001000.
+    assert parser.irig_queue.popleft()[6] == 200001000.
+
+    # A reset of the clock counter starts a new fit
+    send(parser, make_irig_packet(54, 5))
+    assert parser.clock_freq == 200001000.
+    send(parser, make_irig_packet(55, 5 + 199999000))
+    assert parser.clock_freq == 199999000.
+
+
+def test_encoder_parser_partial_packet():
+    parser = EncoderParser(beaglebone_port=0)
+    packet = make_counter_packet(0)
+    send(parser, packet[:100])
+    assert len(parser.counter_queue) == 0
+    send(parser, packet[100:])
+    assert len(parser.counter_queue) == 1
+    assert parser.counter_queue[0][1].tolist() == list(range(COUNTER_INFO_LENGTH))
+
+
+def test_counter_buffer_grows():
+    buf = CounterBuffer(size=COUNTER_INFO_LENGTH)
+    for i in range(3):
+        counter = np.arange(COUNTER_INFO_LENGTH) + i * COUNTER_INFO_LENGTH
+        buf.append(counter, counter, np.array([i]), float(i))
+    assert buf.num_counter == 3 * COUNTER_INFO_LENGTH
+    assert buf.counter.tolist() == list(range(3 * COUNTER_INFO_LENGTH))
+    assert buf.quad.tolist() == [0, 1, 2]
+    assert buf.received_time.tolist() == [0., 1., 2.]
+
+    buf.clear()
+    assert len(buf.counter) == 0
+    assert len(buf.received_time) == 0
+
+
+def test_encoder_parser_receiver_thread():
+    parser = EncoderParser(beaglebone_port=0, max_queue_size=2)
+    port = parser.sock.getsockname()[1]
+    parser.start_receiving()
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            for i in range(3):
+                s.sendto(make_counter_packet(i * COUNTER_INFO_LENGTH),
+                         ('127.0.0.1', port))
+                assert parser.data_ready.wait(timeout=5)
+                parser.data_ready.clear()
+    finally:
+        parser.stop_receiving()
+
+    stats = parser.get_stats()
+    assert stats['num_counter_packets'] == 3
+    assert stats['num_dropped_packets'] == 1
+    assert stats['counter_queue_depth'] == 2
+
+
+def test_acq_stops_receiving_on_error():
+    agent = HWPBBBAgent(mock.MagicMock(), port=0)
+    session = OpSession(1, 'acq', app=mock.MagicMock())
+    with mock.patch.object(agent.parser.data_ready, 'wait',
+                           side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            agent.acq(session, {})
+    assert agent.parser._receiver is None
+
+    # The socket is free for the next acq
+    agent.parser.start_receiving()
+    agent.parser.stop_receiving()
+
+
+def test_acq_fails_on_receiver_error():
+    agent = HWPBBBAgent(mock.MagicMock(), port=0)
+    session = OpSession(1, 'acq', app=mock.MagicMock())
+    with mock.patch.object(agent.parser, 'read_packets',
+                           side_effect=ValueError('corrupt packet')):
+        ok, msg = agent.acq(session, {})
+    assert not ok
+    assert 'corrupt packet' in msg
+    assert agent.parser._receiver is None
@@ -1 +1,165 @@
-from socs.agents.lakeshore336.agent import LS336_Agent  # noqa: F401
+import socket
+import time
+from unittest import mock
+
+import numpy as np
+import pytest
+from ocs.ocs_agent import OpSession
+
+import socs.Lakeshore.Lakeshore336 as ls336
+from socs.agents.lakeshore336.agent import LS336_Agent
+from socs.common.ring_buffer import RingBuffer
+
+# Mock responses from the 336
+VALUES = {'*IDN?': 'LSCI,MODEL336,LSA1234,2.9',
+          'KRDG? 0': '+1.0000,+2.0000,+3.0000,+4.0000'}
+for _inp in 'ABCD':
+    VALUES.update({f'INTYPE? {_inp}': '1,0,0,0,1',
+                   f'INNAME? {_inp}': f'Input {_inp}',
+                   f'INCRV? {_inp}': '01',
+                   f'TLIMIT? {_inp}': '+0.0000'})
+for _out in '12':
+    VALUES.update({f'OUTMODE? {_out}': '1,1,0',
+                   f'HTRSET? {_out}': '1,0,+0.500,1',
+                   f'RANGE? {_out}': '2',
+                   f'SETP? {_out}': '+10.000',
+                   f'HTR? {_out}': '+12.5'})
+
+
+class MockSocket:
+    """Mock a 336 socket, which sends back responses a few bytes at a time."""
+
+    compound = True
+    separate_lines = False
+
+    def __init__(self, *args):
+        self.sent = []
+        self.send_times = []
+        self._out = b''
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def sendall(self, data):
+        self.send_times.append(time.monotonic())
+        line = data.decode()
+        assert line.endswith('\r\n')
+        self.sent.append(line.strip())
+        queries = line.strip().split(';')
+        if not (self.compound or self.separate_lines):
+            queries = queries[:1]
+        if '?' not in line:
+            return
+        if self.separate_lines:
+            self._out += ''.join(VALUES[q] + '\r\n' for q in queries).encode()
+        else:
+            self._out += (';'.join(VALUES[q] for q in queries) + '\r\n').encode()
+
+    def recv(self, size):
+        data, self._out = self._out[:3], self._out[3:]
+        return data
+
+    def close(self):
+        pass
+
+
+class MockSocketNoCompound(MockSocket):
+    compound = False
+
+
+class MockSocketSeparateLines(MockSocket):
+    """Mock a 336 that answers each query of a compound query on its own
+    line."""
+    compound = False
+    separate_lines = True
+
+
+@mock.patch('socs.Lakeshore.Lakeshore336.MIN_COMMAND_INTERVAL', 0.01)
+@pytest.mark.parametrize('sock', [MockSocket, MockSocketNoCompound,
+                                  MockSocketSeparateLines])
+def test_ls336_heater_status(sock):
+    with mock.patch('socs.Lakeshore.transport.socket.socket', sock):
+        ls = ls336.LS336('127.0.0.1')
+
+        heater = ls.heaters['1']
+        assert heater.get_status() == {'percent': 12.5,
+                                       'range': 'medium',
+                                       'max_current': 0.5,
+                                       'setpoint': 10.0}
+        assert ls.compound_queries is sock.compound
+        if sock.compound:
+            assert ls.com.sock.sent[-1] == 'HTR? 1;RANGE? 1;HTRSET? 1;SETP? 1'
+        else:
+            assert ls.com.sock.sent[-4:] == ['HTR? 1', 'RANGE? 1', 'HTRSET? 1', 'SETP? 1']
+
+        # Responses left over from the compound query aren't read as the
+        # responses to later queries.
+        assert ls.msg('KRDG? 0') == VALUES['KRDG? 0']
+
+        # Commands are paced, but not delayed further.
+        gaps = [b - a for a, b in zip(ls.com.sock.send_times, ls.com.sock.send_times[1:])]
+        assert min(gaps) >= 0.01
+
+
+class MockSocketSilent(MockSocket):
+    """Mock a 336 that stops responding once silent is set."""
+
+    silent = False
+
+    def recv(self, size):
+        if self.silent:
+            raise socket.timeout
+        return super().recv(size)
+
+
+@mock.patch('socs.Lakeshore.Lakeshore336.MIN_COMMAND_INTERVAL', 0.01)
+def test_ls336_query_error():
+    """A lost connection is raised, and does not disable compound queries."""
+    with mock.patch('socs.Lakeshore.transport.socket.socket', MockSocketSilent):
+        ls = ls336.LS336('127.0.0.1', timeout=0.01)
+        MockSocketSilent.silent = True
+        try:
+            with pytest.raises(RuntimeError):
+                ls.heaters['1'].get_status()
+        finally:
+            MockSocketSilent.silent = False
+
+        assert ls.compound_queries is True
+        assert ls.com.get_stats()['commands']['HTR?;RANGE?;HTRSET?;SETP?']['timeouts'] == 2
+        # No single queries were sent after the failed compound query.
+        assert ls.com.sock is None
+
+        assert ls.heaters['1'].get_status()['setpoint'] == 10.0
+        assert ls.com.sock.sent == ['HTR? 1;RANGE? 1;HTRSET? 1;SETP? 1']
+
+
+@mock.patch('socs.Lakeshore.Lakeshore336.MIN_COMMAND_INTERVAL', 0.01)
+def test_ls336_check_temperature_stability():
+    agent = LS336_Agent(mock.MagicMock(), 'LSA1234', '127.0.0.1')
+    with mock.patch('socs.Lakeshore.transport.socket.socket', MockSocket):
+        agent.module = ls336.LS336('127.0.0.1')
+    session = OpSession(1, 'check_temperature_stability', app=mock.MagicMock())
+    params = {'threshold': 0.1, 'window': 900, 'heater': '1'}
+
+    # No data from acq.
+    assert agent.check_temperature_stability(session, params)[0] is False
+
+    # Input A of heater 1 has been within 0.1 K of the 10 K setpoint for the
+    # last 1000 s.
+    now = time.time()
+    agent._recent_temps = RingBuffer(720, shape=(4,))
+    for t in np.arange(now - 1000, now, 10):
+        agent._recent_temps.append(t, [10.05, 2., 3., 4.])
+    n_sent = len(agent.module.com.sock.sent)
+    assert agent.check_temperature_stability(session, params)[0] is True
+    assert agent.check_temperature_stability(
+        session, dict(params, window=2000))[0] is False
+
+    agent._recent_temps.append(now, [10.2, 2., 3., 4.])
+    assert agent.check_temperature_stability(session, params)[0] is False
+
+    # Served from the data collected by acq, without querying the 336.
+    assert len(agent.module.com.sock.sent) == n_sent
@@ -5,6 +5,8 @@ import txaio
 from ocs.ocs_agent import OpSession
 
 from socs.agents.lakeshore372.agent import LS372_Agent
+from socs.common.ring_buffer import RingBuffer
+from socs.Lakeshore.Lakeshore372 import LS372
 
 txaio.use_twisted()
 
@@ -72,6 +74,7 @@ def mock_372_msg():
     values.update({'RANGE? 0': '0',
                    'RANGE? 2': '1',
                    'STILL?': '+10.60',
+                   'SETP? 0': '+293.870E+00',
                    'HTR?': '+00.0005E+00'})
 
     # Senor readings
@@ -85,8 +88,9 @@ def mock_372_msg():
         if '?' not in arg:
             return ''
 
-        # Mocked example query responses
-        return values[arg]
+        # Mocked example query responses, compound queries are answered on
+        # one line separated by ';'
+        return ';'.join(values[q] for q in arg.split(';'))
 
     mock_msg.side_effect = side_effect
 
@@ -244,6 +248,100 @@ def test_ls372_acq_w_sample_heater(agent):
     assert res[0] is True
 
 
+@mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
+@mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg())
+def test_ls372_acq_compound_query(agent):
+    """Readings in 'acq' should be batched into compound queries."""
+    session = create_session('acq')
+
+    # Have to init before running anything else
+    agent.init_lakeshore(session, None)
+    agent.enable_control_chan(session, None)
+    agent.module.msg.reset_mock()
+
+    params = {'run_once': True, 'sample_heater': True}
+    res = agent.acq(session, params=params)
+    assert res[0] is True
+
+    queries = [c.args[0] for c in agent.module.msg.call_args_list]
+    assert 'SCAN?;KRDG? 1;SRDG? 1;KRDG? A;SRDG? A;HTR?' in queries
+    assert session.data['fields']['Channel_01']['T'] == 293.873
+    assert session.data['fields']['control']['R'] == 0.0
+
+
+def mock_372_msg_no_compound():
+    """Mock a 372 that only answers the first of a compound query."""
+    mock_msg = mock_372_msg()
+    single = mock_msg.side_effect
+    mock_msg.side_effect = lambda arg: single(arg.split(';')[0])
+    return mock_msg
+
+
+@mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
+@mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg())
+def test_ls372_query_error(agent):
+    """Communication errors are raised, rather than disabling compound
+    queries."""
+    agent.init_lakeshore(create_session('init_lakeshore'), None)
+    agent.module.msg.side_effect = RuntimeError('No response')
+    agent.module.msg.reset_mock()
+
+    with pytest.raises(RuntimeError):
+        agent.module.query('SCAN?', 'KRDG? 1')
+    assert agent.module.compound_queries is True
+    assert agent.module.msg.call_count == 1
+
+
+@mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
+@mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg_no_compound())
+def test_ls372_acq_compound_query_fallback(agent):
+    """If compound queries are not supported 'acq' falls back to single
+    queries."""
+    session = create_session('acq')
+
+    # Have to init before running anything else
+    agent.init_lakeshore(session, None)
+
+    params = {'run_once': True}
+    res = agent.acq(session, params=params)
+    assert res[0] is True
+
+    assert agent.module.compound_queries is False
+    assert session.data['fields']['Channel_01']['T'] == 293.873
+    assert session.data['fields']['Channel_01']['R'] == 108.278
+
+
+@mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
+@mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg())
+def test_ls372_lazy_channel_config():
+    """Channel configuration is only queried on first access, in one compound
+    query, and again after a set_* call invalidates it."""
+    ls = LS372('127.0.0.1')
+    assert not any('INSET?' in c.args[0] for c in ls.msg.call_args_list)
+
+    ls.msg.reset_mock()
+    channel = ls.get_active_channel()
+    assert channel is ls.channels[1]
+    assert channel.dwell == 7
+    assert channel.name == 'Channel 01'
+    assert channel.mode == 'voltage'
+    assert [c.args[0] for c in ls.msg.call_args_list] == [
+        'SCAN?', 'INSET? 1;INNAME? 1;INTYPE? 1;TLIMIT? 1']
+
+    ls.msg.reset_mock()
+    channel.set_dwell(10)
+    assert 'dwell' not in vars(channel)
+    assert channel.dwell == 7
+    assert ls.msg.call_args_list[-1].args[0] == 'INSET? 1;INNAME? 1;INTYPE? 1;TLIMIT? 1'
+
+    # Bulk loading of all channels.
+    ls.msg.reset_mock()
+    ls.load_channels()
+    assert ls.msg.call_count == 5
+    assert ls.channels[16].name == 'Channel 16'
+    assert ls.channels[0].tlimit == 0
+
+
 # stop_acq
 @mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
 @mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg())
@@ -526,6 +624,41 @@ def test_ls372_set_autoscan_off(agent):
 # this task should really get reworked, mostly into a client
 # check_temperature_stability
 # this task should become a client function really
+@mock.patch('socs.Lakeshore.Lakeshore372._establish_socket_connection', mock_connection())
+@mock.patch('socs.Lakeshore.Lakeshore372.LS372.msg', mock_372_msg())
+def test_ls372_check_temperature_stability(agent):
+    """'check_temperature_stability' uses the readings taken by 'acq'."""
+    session = create_session('check_temperature_stability')
+    agent.init_lakeshore(session, None)
+
+    # No readings yet.
+    params = {'measurements': 3, 'threshold': 0.01}
+    res = agent.check_temperature_stability(session, params)
+    assert res[0] is False
+
+    for i in range(3):
+        agent.acq(create_session('acq'), params={'run_once': True})
+    agent.take_data = True  # as if acq was still running
+
+    agent.module.msg.reset_mock()
+    res = agent.check_temperature_stability(session, params)
+    assert res[0] is True
+    assert not any('RDG?' in c.args[0] for c in agent.module.msg.call_args_list)
+
+    res = agent.check_temperature_stability(session, {'measurements': 3, 'threshold': 0.001})
+    assert res[0] is False
+    res = agent.check_temperature_stability(session, {'measurements': 4, 'threshold': 0.01})
+    assert res[0] is False
+
+    # Old readings, e.g. from before acq was restarted or from an earlier
+    # visit of the channel by the autoscan, are not used.
+    buf = agent._recent_temps[agent._last_channel]
+    stale = RingBuffer(buf.size)
+    for t, temp in zip(*buf.get()):
+        stale.append(t - 60, temp)
+    agent._recent_temps[agent._last_channel] = stale
+    res = agent.check_temperature_stability(session, params)
+    assert res[0] is False
 
 
 # set_output_mode
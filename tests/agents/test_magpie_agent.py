@@ -1 +1,114 @@
-from socs.agents.magpie.agent import MagpieAgent  # noqa: F401
+import argparse
+from unittest import mock
+
+import numpy as np
+import so3g
+from spt3g import core
+
+from socs.agents.magpie.agent import (Demodulator, MagpieAgent,
+                                      WhiteNoiseCalculator, load_frame_data,
+                                      pack_frames, unpack_frames)
+
+
+def test_pack_unpack_frames():
+    nsamps, nelems = 5, 7
+    times = 1700000000. + np.arange(nsamps) * 0.05
+    data = [np.random.normal(size=(nsamps, nelems)) for _ in range(3)]
+
+    frames = list(unpack_frames(pack_frames(times, data)))
+    assert len(frames) == 3 * nsamps
+    for i, fr in enumerate(frames):
+        samp, idx = divmod(i, 3)
+        assert fr['idx'] == idx
+        assert np.allclose(np.array(fr['data']), data[idx][samp])
+        assert fr['timestamp'] == core.G3Time(times[samp] * core.G3Units.s)
+
+
+def test_unpack_single_frame():
+    fr = core.G3Frame(core.G3FrameType.Scan)
+    fr['idx'] = 0
+    assert list(unpack_frames(fr)) == [fr]
+
+
+def make_agent(**kwargs):
+    args = dict(target_rate=20, layout='grid', stream_id='test', xdim=4,
+                ydim=4, offset=(0, 0), delay=5, demod_freq=8,
+                demod_bandwidth=0.5, batch_frames=False, dsp_threads=1)
+    args.update(kwargs)
+    return MagpieAgent(mock.MagicMock(), argparse.Namespace(**args))
+
+
+def test_chan_map():
+    magpie = make_agent()
+    # readout chans 0-3 map to abs chans 20, 3, 15, 5; grid covers 0-15
+    magpie.mask = np.array([20, 3, 15, 5])
+    magpie._update_chan_map()
+    assert magpie.readout_chans.tolist() == [1, 2, 3]
+    assert magpie.elem_idxs.tolist() == [3, 15, 5]
+
+
+def test_parallel_dsp_matches_serial():
+    times = np.arange(400) / 200.
+    chans = np.arange(10, 30)
+    results = []
+    for dsp_threads in [1, 3]:
+        magpie = make_agent(dsp_threads=dsp_threads)
+        magpie.demod = Demodulator(8, 0.5, fs=200)
+        magpie.wncalc = WhiteNoiseCalculator(fs=200, navg=200)
+        rng = np.random.default_rng(0)
+        # Two consecutive frames to check that filter state is kept
+        for _ in range(2):
+            data = rng.normal(size=(len(chans), len(times)))
+            demod, wl = magpie._apply_dsp(times, data, chans)
+        results.append((demod, wl))
+    assert np.allclose(results[0][0], results[1][0])
+    assert np.allclose(results[0][1], results[1][1])
+
+
+def make_scan_frame(raw, super_timestream):
+    nchans, nsamps = raw.shape
+    times = 1700000000. + np.arange(nsamps) / 200.
+    fr = core.G3Frame(core.G3FrameType.Scan)
+    prim = core.G3TimesampleMap()
+    prim.times = core.G3VectorTime([core.G3Time(t * core.G3Units.s) for t in times])
+    prim['UnixTime'] = core.G3VectorInt((times * 1e9).astype(int))
+    fr['primary'] = prim
+
+    names = [f'r{i:0>4}' for i in range(nchans)]
+    if super_timestream:
+        ts = so3g.G3SuperTimestream()
+        ts.names = names
+        ts.times = prim.times
+        ts.data = raw.astype(np.int32)
+        fr['data'] = ts
+    else:
+        fr['data'] = core.G3TimestreamMap(names, raw.astype(float))
+    return fr
+
+
+def test_load_frame_data_formats():
+    raw = np.random.default_rng(0).integers(-2**15, 2**15, size=(20, 50))
+    expected = raw * 2 * np.pi / 2**16
+    for super_timestream in [False, True]:
+        times, data = load_frame_data(make_scan_frame(raw, super_timestream))
+        assert data.shape == raw.shape
+        assert np.allclose(data, expected, atol=1e-6)
+        assert np.isclose(times[1] - times[0], 1 / 200., atol=1e-6)
+
+
+def test_read_shuts_down_dsp_pool(tmp_path):
+    magpie = make_agent(dsp_threads=3)
+    magpie.demod = Demodulator(8, 0.5, fs=200)
+    magpie.wncalc = WhiteNoiseCalculator(fs=200, navg=200)
+    chans = np.arange(10)
+    magpie._apply_dsp(np.arange(400) / 200., np.zeros((10, 400)), chans)
+    pool = magpie._dsp_pool
+    assert pool is not None
+
+    path = str(tmp_path / 'empty.g3')
+    writer = core.G3Writer(path)
+    writer(core.G3Frame(core.G3FrameType.EndProcessing))
+    res = magpie.read(mock.MagicMock(), {'src': path})
+    assert res[0] is True
+    assert magpie._dsp_pool is None
+    assert all(not t.is_alive() for t in pool._threads)
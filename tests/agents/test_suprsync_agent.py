@@ -1,15 +1,35 @@
 import os
+import re
+import shutil
+import subprocess
 import time
+from unittest import mock
 
 import numpy as np
+import pytest
 import txaio
+from sqlalchemy import create_engine, text
 
-from socs.db.suprsync import (SupRsyncFileHandler, SupRsyncFilesManager,
-                              TimecodeDir)
+from socs.db.suprsync import (SupRsyncFile, SupRsyncFileHandler,
+                              SupRsyncFilesManager, TimecodeDir,
+                              check_timecode, create_file, parse_md5sum_output,
+                              parse_rsync_checksums)
+from socs.util import get_md5sum
 
 txaio.use_twisted()
 
 
+def rsync_version():
+    """Version of the installed rsync as (major, minor), or None."""
+    try:
+        res = subprocess.run(['rsync', '--version'], stdout=subprocess.PIPE,
+                             check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    match = re.search(r'version v?(\d+)\.(\d+)', res.stdout.decode())
+    return tuple(int(x) for x in match.groups()) if match else None
+
+
 def test_suprsync_files_manager(tmp_path):
     """
     Tests table creation and the create_file / add_file functions of the
@@ -128,3 +148,263 @@ def test_suprsync_handle_files(tmp_path):
 
     ncopied = len(os.listdir(os.path.join(remote_basedir, 'test_remote')))
     assert ncopied == nfiles + 1
+
+
+def test_suprsync_queries(tmp_path):
+    """
+    Tests the copyable / deletable file queries and archive stats.
+    """
+    srfm = SupRsyncFilesManager(tmp_path / 'test.db')
+    archive_name = 'test'
+    with srfm.Session.begin() as session:
+        for i in range(10):
+            srfm.add_file(f'/data/{i}.npy', f'{i}.npy', archive_name,
+                          local_md5sum='abc', timestamp=100. + i,
+                          session=session)
+        srfm.add_file('/data/other.npy', 'other.npy', 'other',
+                      local_md5sum='abc', timestamp=50., session=session)
+
+    with srfm.Session.begin() as session:
+        files = srfm.get_copyable_files(archive_name, session=session)
+        assert [f.timestamp for f in files] == [100. + i for i in range(10)]
+        for f in files[:3]:
+            f.remote_md5sum = f.local_md5sum
+            f.synced = True
+        files[3].ignore = True
+
+    files = srfm.get_copyable_files(archive_name, num_files=2)
+    assert [f.local_path for f in files] == ['/data/4.npy', '/data/5.npy']
+    assert len(srfm.get_deletable_files(archive_name, 0)) == 3
+    assert len(srfm.get_deletable_files(archive_name, time.time())) == 0
+
+    stats = srfm.get_archive_stats(archive_name)
+    assert stats['finalized_until'] == 103.
+    assert stats['num_files'] == 10
+    assert stats['uncopied_files'] == 6
+    assert stats['last_file_added'] == '/data/9.npy'
+    assert stats['last_file_copied'] == '/data/2.npy'
+
+
+def test_suprsync_migrate_v0(tmp_path):
+    """
+    Tests that a files table without the synced column is migrated in place.
+    """
+    db_path = tmp_path / 'test.db'
+    engine = create_engine(f'sqlite:///{db_path}')
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE supersync_v0 (id INTEGER PRIMARY KEY, "
+            "local_path VARCHAR NOT NULL, local_md5sum VARCHAR NOT NULL, "
+            "archive_name VARCHAR NOT NULL, remote_path VARCHAR NOT NULL, "
+            "timestamp FLOAT NOT NULL, remote_md5sum VARCHAR, copied FLOAT, "
+            "removed FLOAT, failed_copy_attempts INTEGER, deletable BOOLEAN, "
+            "ignore BOOLEAN)"
+        ))
+        for i, remote_md5sum in enumerate(['abc', 'def', None]):
+            conn.execute(text(
+                "INSERT INTO supersync_v0 (local_path, local_md5sum, "
+                "archive_name, remote_path, timestamp, remote_md5sum, "
+                "failed_copy_attempts, deletable, ignore) VALUES "
+                "(:path, 'abc', 'test', :path, :ts, :md5, 0, 1, 0)"
+            ), {'path': f'{16750 + i}/{i}.npy', 'ts': float(i), 'md5': remote_md5sum})
+
+    srfm = SupRsyncFilesManager(db_path)
+    session = srfm.Session()
+    synced = [f.synced for f in session.query(SupRsyncFile).order_by(SupRsyncFile.id)]
+    assert synced == [True, False, False]
+    assert srfm.get_finalized_until('test') == 0.
+
+    # Timecodes are backfilled, and set for rows added without one
+    with engine.begin() as conn:
+        conn.execute(text(
+            "INSERT INTO supersync_v0 (local_path, local_md5sum, "
+            "archive_name, remote_path, timestamp) VALUES "
+            "('3.npy', 'abc', 'test', '/16751/3.npy', 3.)"
+        ))
+    timecodes = [f.timecode for f in session.query(SupRsyncFile).order_by(SupRsyncFile.id)]
+    assert timecodes == [16750, 16751, 16752, 16751]
+    session.close()
+
+    # Migrating again is a no-op
+    SupRsyncFilesManager(db_path)
+
+
+@pytest.mark.parametrize('remote_path', [
+    '16750/1.npy', '/16750/1.npy', '//16750/a/b.npy', '16750/', '16750',
+    '/16750', '1675/1.npy', '167500/1.npy', '01675/1.npy', '16750.npy',
+    '16750a/1.npy', ' 16750/1.npy', '-1675/1.npy', '+1675/1.npy',
+    '16_750/1.npy', './16750/1.npy', 'a/16750/1.npy', '16750\n', '',
+])
+def test_timecode_sql_matches_check_timecode(tmp_path, remote_path):
+    """
+    Tests that the timecode set by the SQL trigger for rows added without one
+    is the same as the one check_timecode assigns.
+    """
+    srfm = SupRsyncFilesManager(tmp_path / 'test.db')
+    with srfm._engine.begin() as conn:
+        conn.execute(text(
+            f"INSERT INTO {SupRsyncFile.__tablename__} (local_path, "
+            "local_md5sum, archive_name, remote_path, timestamp) VALUES "
+            "('1.npy', 'abc', 'test', :path, 1.)"
+        ), {'path': remote_path})
+    session = srfm.Session()
+    file = session.query(SupRsyncFile).one()
+    assert file.timecode == check_timecode(file)
+    session.close()
+
+
+def test_suprsync_archive_stats_incremental(tmp_path):
+    """
+    Tests that the archive stats maintained incrementally match a full
+    recomputation, including for files added through another manager.
+    """
+    db_path = tmp_path / 'test.db'
+    srfm = SupRsyncFilesManager(db_path)
+    other = SupRsyncFilesManager(db_path)
+    archive_name = 'test'
+
+    srfm.add_file('/data/0.npy', '0.npy', archive_name,
+                  local_md5sum='abc', timestamp=100.)
+    # Reconciles, as the stats row was created by a trigger
+    assert srfm.get_archive_stats(archive_name)['num_files'] == 1
+
+    with other.Session.begin() as session:
+        for i in range(1, 10):
+            other.add_file(f'/data/{i}.npy', f'{i}.npy', archive_name,
+                           local_md5sum='abc', timestamp=100. + i,
+                           session=session)
+    with srfm.Session.begin() as session:
+        files = srfm.get_copyable_files(archive_name, session=session)
+        for f in files[:4]:
+            f.synced = True
+        files[5].ignore = True
+
+    stats = srfm.get_archive_stats(archive_name)
+    assert stats['num_files'] == 10
+    assert stats['uncopied_files'] == 5
+    assert stats['last_file_added'] == '/data/9.npy'
+    assert stats['last_file_copied'] == '/data/3.npy'
+    assert stats['finalized_until'] == 103.
+
+    srfm.reconcile_archive_stats(archive_name)
+    assert srfm.get_archive_stats(archive_name) == stats
+
+
+@pytest.mark.parametrize('verify_mode', [
+    'md5sum',
+    pytest.param('rsync', marks=pytest.mark.skipif(
+        (rsync_version() or (0,)) < (3, 2), reason="requires rsync >= 3.2")),
+])
+def test_suprsync_parallel_copy(tmp_path, verify_mode):
+    """
+    Tests copying and verifying files with several rsync workers and a
+    bytes-in-flight limit, using a local directory as the remote.
+    """
+    dest = tmp_path / 'dest'
+    (dest / 'test_remote').mkdir(parents=True)
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+
+    srfm = SupRsyncFilesManager(tmp_path / 'test.db')
+    nfiles = 20
+    for i in range(nfiles):
+        path = str(data_dir / f'{i}.npy')
+        np.save(path, np.full(1000, i))
+        srfm.add_file(path, f'test_remote/{i}.npy', 'test')
+    size = os.path.getsize(path)
+
+    # Already up to date on the remote, so it is not transferred by rsync
+    shutil.copy2(data_dir / '0.npy', dest / 'test_remote' / '0.npy')
+
+    handler = SupRsyncFileHandler(srfm, 'test', str(dest), bwlimit='1m',
+                                  num_workers=3, max_bytes_in_flight=6 * size,
+                                  verify_mode=verify_mode)
+    assert handler.worker_bwlimit == '341.333'
+    assert [len(b) for b in handler._make_batches(srfm.get_copyable_files('test'))] \
+        == [2] * 10
+
+    with mock.patch.object(handler, 'run_on_remote',
+                           wraps=handler.run_on_remote) as run_on_remote:
+        output = handler.copy_files()
+    assert sorted(output) == sorted((str(data_dir / f'{i}.npy'), True)
+                                    for i in range(nfiles))
+    assert len(os.listdir(dest / 'test_remote')) == nfiles
+    assert srfm.get_copyable_files('test') == []
+
+    files = srfm.get_known_files('test')
+    assert len(files) == nfiles
+    for file in files:
+        assert file.synced
+        assert file.remote_md5sum == get_md5sum(file.local_path)
+
+    # Only the files that rsync did not transfer are checksummed on the
+    # remote in rsync mode.
+    checksummed = sorted(path for call in run_on_remote.call_args_list
+                         for path in call.args[0][1:])
+    if verify_mode == 'rsync':
+        assert checksummed == [str(dest / 'test_remote' / '0.npy')]
+    else:
+        assert checksummed == sorted(str(dest / 'test_remote' / f'{i}.npy')
+                                     for i in range(nfiles))
+
+    assert set(handler.worker_stats) <= {0, 1, 2}
+    assert sum(s['files'] for s in handler.worker_stats.values()) == nfiles
+    assert sum(s['bytes'] for s in handler.worker_stats.values()) == nfiles * size
+
+
+def test_parse_rsync_checksums():
+    output = (
+        "          test_remote/\n"
+        "0cc175b9c0f1b6a831c399e269772661 test_remote/a b.npy\n"
+        "                                 test_remote/skipped.npy\n"
+        "92eb5ffee6ae2fec3ad71c777531578f test_remote/b.npy\n"
+    )
+    md5sums = parse_rsync_checksums(output, '/remote/base/')
+    assert md5sums == {
+        '/remote/base/test_remote/a b.npy': '0cc175b9c0f1b6a831c399e269772661',
+        '/remote/base/test_remote/b.npy': '92eb5ffee6ae2fec3ad71c777531578f',
+    }
+
+    output = (
+        "0cc175b9c0f1b6a831c399e269772661  /remote/base/a.npy\n"
+        "md5sum: /remote/base/c.npy: No such file or directory\n"
+    )
+    assert parse_md5sum_output(output) == {
+        '/remote/base/a.npy': '0cc175b9c0f1b6a831c399e269772661'}
+
+
+def test_suprsync_add_files(tmp_path):
+    """
+    Tests bulk registration of files and their timecode dirs.
+    """
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    srfm = SupRsyncFilesManager(tmp_path / 'test.db')
+
+    files = []
+    for i in range(20):
+        path = data_dir / f'{i}.npy'
+        np.save(path, np.full(10, i))
+        files.append((str(path), f'{16750 + i % 2}/{i}.npy', 'test'))
+    files.append(create_file(str(path), 'other/19.npy', 'test',
+                             local_md5sum='abc', deletable=False))
+    assert srfm.add_files(files) == 21
+
+    session = srfm.Session()
+    tcs = sorted(tc for tc, in session.query(TimecodeDir.timecode))
+    assert tcs == [16750, 16751]
+
+    added = session.query(SupRsyncFile).order_by(SupRsyncFile.id).all()
+    assert [f.local_md5sum for f in added[:20]] == [
+        get_md5sum(f[0]) for f in files[:20]]
+    assert [f.timecode for f in added] == [16750, 16751] * 10 + [None]
+    assert [f.deletable for f in added] == [True] * 20 + [False]
+    assert srfm.get_archive_stats('test')['uncopied_files'] == 21
+
+    # Existing timecode dirs are not duplicated
+    srfm.add_files(files[:2])
+    srfm.create_all_timecode_dirs('test')
+    assert session.query(TimecodeDir).count() == 2
+
+    with srfm._engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == 'wal'
@@ -0,0 +1,54 @@
+import calendar
+import time
+
+import numpy as np
+
+from socs.common.irig import (count2time, de_irig, decode_irig, fit_clock_freq,
+                              irig2unix)
+
+
+def bcd(value):
+    return (value % 10) + ((value // 10) << 5)
+
+
+def reference_de_irig(val, base_shift=0):
+    weights = [1, 2, 4, 8, 0, 10, 20, 40, 80]
+    return sum(((val >> (i + base_shift)) & 1) * w for i, w in enumerate(weights))
+
+
+def test_de_irig_matches_bitwise_decoding():
+    vals = np.random.default_rng(0).integers(0, 1 << 12, size=1000)
+    for shift in (0, 1):
+        expected = [reference_de_irig(int(v), shift) for v in vals]
+        assert de_irig(vals, shift).tolist() == expected
+        assert de_irig(int(vals[0]), shift) == expected[0]
+
+
+def test_decode_irig_batch():
+    info = np.zeros((2, 10), dtype=int)
+    info[:, :6] = [[bcd(56) << 1, bcd(34), bcd(12), bcd(23), 1, bcd(24)],
+                   [bcd(57) << 1, bcd(34), bcd(12), bcd(23), 1, bcd(24)]]
+    fields = decode_irig(info)
+    assert fields['sec'].tolist() == [56, 57]
+    assert fields['day'].tolist() == [123, 123]
+
+    expected = calendar.timegm(time.strptime('24 123 12:34:56', '%y %j %H:%M:%S'))
+    assert irig2unix(fields).tolist() == [expected, expected + 1]
+    assert irig2unix(decode_irig(info[0])) == expected
+
+
+def test_irig2unix_invalid():
+    fields = {'sec': [0, 0, 0], 'min': [0, 60, 0], 'hour': [0, 0, 0],
+              'day': [0, 1, 366], 'year': [24, 24, 23]}
+    assert irig2unix(fields).tolist() == [-1, -1, -1]
+
+
+def test_count2time_with_fitted_clock():
+    freq = 2.e8 + 50
+    counts = (np.arange(10) * int(freq / 10)).astype(np.int64) + (1 << 40)
+    times = np.arange(10) * 0.1
+    fitted = fit_clock_freq(counts, times)
+    assert abs(fitted - freq) < 1
+
+    t = count2time(counts, 10., fitted)
+    assert np.allclose(t, times + 10., rtol=0, atol=1e-9)
@@ -0,0 +1,154 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from socs.Lakeshore.Lakeshore372 import LS372
+from socs.Lakeshore.transport import TCPTransport
+
+SIMULATOR = os.path.join(os.path.dirname(__file__),
+                         '../../simulators/lakeshore372/ls372_simulator.py')
+
+
+class SocketPairs:
+    """Connect function handing out one end of a new socket pair on each
+    (re)connect, keeping the other end as the 'device'."""
+
+    def __init__(self):
+        self.devices = []
+        self.responses = []
+
+    def __call__(self, ip, timeout, port=7777):
+        sock, device = socket.socketpair()
+        sock.settimeout(timeout)
+        self.devices.append(device)
+        # Queue up a response from the new 'device'.
+        if self.responses:
+            device.sendall(self.responses.pop(0))
+        return sock
+
+    @property
+    def device(self):
+        return self.devices[-1]
+
+
+@pytest.fixture
+def transport():
+    pairs = SocketPairs()
+    com = TCPTransport('127.0.0.1', connect=pairs, timeout=1)
+    yield com, pairs
+    com.close()
+    for device in pairs.devices:
+        device.close()
+
+
+def test_transport_framing(transport):
+    com, pairs = transport
+
+    # Several responses in one read.
+    pairs.device.sendall(b'one\r\ntwo\r\n')
+    assert com.msg('A?') == 'one'
+    assert com.msg('B? 1') == 'two'
+
+    # A response split over several reads.
+    pairs.device.sendall(b'th')
+    threading.Timer(0.05, pairs.device.sendall, [b'ree\r\n']).start()
+    assert com.msg('C?') == 'three'
+
+    # Commands are terminated, and only queries wait for a response.
+    assert com.msg('SET 1') == ''
+    assert pairs.device.recv(100) == b'A?\r\nB? 1\r\nC?\r\nSET 1\r\n'
+
+    stats = com.get_stats()
+    assert stats['reconnects'] == 0
+    assert set(stats['commands']) == {'A?', 'B?', 'C?', 'SET'}
+    c = stats['commands']['C?']
+    assert c['count'] == 1 and c['timeouts'] == 0
+    assert 0.05 <= c['latency_max'] < 1
+    assert sum(c['latency_hist']) == 1
+    assert len(c['latency_hist']) == len(stats['latency_bins']) + 1
+
+
+def test_transport_late_response(transport):
+    com, pairs = transport
+
+    with pytest.raises(RuntimeError):
+        com.msg('A?', timeout=0.05)
+    assert com.get_stats()['commands']['A?']['timeouts'] == 2
+
+    # The connection was dropped, so a late response to 'A?' can't be read as
+    # the response to the next query, which re-opens the connection.
+    pairs.responses.append(b'fresh\r\n')
+    assert com.msg('B?') == 'fresh'
+    assert len(pairs.devices) == 2
+    assert pairs.device.recv(100) == b'B?\r\n'
+
+
+def test_transport_reconnect(transport):
+    com, pairs = transport
+    pairs.device.close()
+
+    # The lost connection is re-opened and the query sent again.
+    pairs.responses.append(b'reply\r\n')
+    assert com.msg('A?') == 'reply'
+    assert pairs.device.recv(100) == b'A?\r\n'
+
+    stats = com.get_stats(reset=True)
+    assert stats['reconnects'] == 1
+    assert stats['commands']['A?']['errors'] == 1
+    assert com.get_stats()['commands'] == {}
+
+
+@pytest.fixture(scope='module')
+def simulator():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, SIMULATOR, '-p', str(port)],
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                            env=dict(os.environ, LOGLEVEL='warning'))
+    # Wait for the simulator to listen.
+    for i in range(100):
+        if proc.poll() is not None:
+            break
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.1).close()
+            break
+        except OSError:
+            time.sleep(0.1)
+    yield port
+    proc.terminate()
+    proc.wait()
+
+
+def test_ls372_simulator(simulator):
+    ls = LS372('127.0.0.1', timeout=5, port=simulator)
+    assert ls.id.split(',')[:2] == ['LSCI', 'MODEL372']
+    assert len(ls.channels) == 17
+
+    # Channel configurations are loaded in a few compound queries.
+    ls.load_channels()
+    assert ls.channels[16].name == 'Channel 16'
+
+    # Commands and queries sent back to back are framed separately.
+    ls.msg('SCAN 5,0')
+    assert ls.msg('SCAN?') == '05,0'
+    assert ls.query('*IDN?', 'SCAN?') == [ls.id, '05,0']
+
+    # Reconnect after losing the connection.
+    ls.com.sock.shutdown(socket.SHUT_RDWR)
+    assert ls.msg('SCAN?') == '05,0'
+
+    stats = ls.com.get_stats()
+    assert stats['reconnects'] == 1
+    assert stats['commands']['*IDN?']['count'] == 1
+    assert stats['commands']['*IDN?;SCAN?']['count'] == 1
+    assert sum(c['count'] for k, c in stats['commands'].items()
+               if 'INNAME?' in k) == 5
+    assert stats['commands']['SCAN?']['errors'] == 1
+    ls.com.close()
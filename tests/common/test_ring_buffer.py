@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from socs.common.ring_buffer import RingBuffer
+
+
+def test_ring_buffer_empty():
+    buf = RingBuffer(5)
+    assert len(buf) == 0
+    assert buf.oldest is None and buf.newest is None
+    times, values = buf.get(window=10)
+    assert len(times) == 0 and len(values) == 0
+    assert np.isnan(buf.mean())
+
+
+@pytest.mark.parametrize('n', [3, 5, 12])
+def test_ring_buffer_window(n):
+    buf = RingBuffer(5)
+    for t in range(n):
+        buf.append(100. + t, t ** 2)
+    kept = np.arange(max(n - 5, 0), n)
+
+    assert len(buf) == len(kept)
+    assert buf.oldest == 100. + kept[0] and buf.newest == 100. + kept[-1]
+    times, values = buf.get()
+    np.testing.assert_array_equal(times, 100. + kept)
+    np.testing.assert_array_equal(values, kept ** 2)
+
+    # Window relative to the newest sample, or to a given time.
+    last = kept[kept >= n - 3]
+    np.testing.assert_array_equal(buf.get(window=2)[1], last ** 2)
+    np.testing.assert_array_equal(buf.get(window=2.5, now=100. + n)[1],
+                                  kept[kept >= n - 2.5] ** 2)
+    np.testing.assert_array_equal(buf.get(samples=2)[1], kept[-2:] ** 2)
+    assert len(buf.get(window=10, now=1000.)[0]) == 0
+
+    assert buf.min(window=2) == (last ** 2).min()
+    assert buf.max(window=2) == (last ** 2).max()
+    assert buf.mean(window=2) == pytest.approx((last ** 2).mean())
+    assert buf.std(samples=4) == pytest.approx((kept[-4:] ** 2).std())
+
+    buf.clear()
+    assert len(buf) == 0
+
+
+def test_ring_buffer_channels():
+    buf = RingBuffer(4, shape=(2,))
+    for t in range(6):
+        buf.append(t, [t, -t])
+    np.testing.assert_array_equal(buf.get(samples=3)[1],
+                                  [[3, -3], [4, -4], [5, -5]])
+    np.testing.assert_array_equal(buf.max(), [5, -2])
+    np.testing.assert_array_equal(buf.min(window=1), [4, -5])
+    assert np.isnan(RingBuffer(4, shape=(2,)).mean()).all()
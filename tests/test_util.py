@@ -1 +1,42 @@
-from socs import util  # noqa: F401
+import hashlib
+import os
+
+import pytest
+
+from socs import util
+
+
+@pytest.mark.parametrize('use_mmap', [False, True])
+def test_get_md5sum(tmp_path, use_mmap):
+    data = os.urandom(10000) + b'\n' * 10
+    path = tmp_path / 'test.dat'
+    path.write_bytes(data)
+    md5sum = util.get_md5sum(str(path), use_mmap=use_mmap, buffer_size=1024,
+                             use_cache=False)
+    assert md5sum == hashlib.md5(data).hexdigest()
+
+    empty = tmp_path / 'empty.dat'
+    empty.write_bytes(b'')
+    assert util.get_md5sum(str(empty), use_mmap=use_mmap, use_cache=False) \
+        == hashlib.md5(b'').hexdigest()
+
+
+def test_get_md5sum_cache(tmp_path):
+    path = tmp_path / 'test.dat'
+    path.write_bytes(b'abc')
+    assert util.get_md5sum(str(path)) == hashlib.md5(b'abc').hexdigest()
+
+    # A modified file is not served from the cache
+    path.write_bytes(b'abcd')
+    os.utime(path, ns=(0, 0))
+    assert util.get_md5sum(str(path)) == hashlib.md5(b'abcd').hexdigest()
+
+
+def test_submit_md5sum(tmp_path):
+    futures = {}
+    for i in range(10):
+        path = tmp_path / f'{i}.dat'
+        path.write_bytes(bytes([i]) * 1000)
+        futures[i] = util.submit_md5sum(str(path))
+    for i, future in futures.items():
+        assert future.result() == hashlib.md5(bytes([i]) * 1000).hexdigest()